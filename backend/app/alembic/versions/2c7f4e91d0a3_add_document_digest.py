@@ -0,0 +1,24 @@
+"""Add document digest
+
+Revision ID: 2c7f4e91d0a3
+Revises: 8e3d2a7c5b19
+Create Date: 2026-10-19 15:11:48.502761
+
+"""
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = "2c7f4e91d0a3"
+down_revision = "8e3d2a7c5b19"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute("ALTER TABLE document ADD COLUMN IF NOT EXISTS digest JSON")
+
+
+def downgrade():
+    op.execute("ALTER TABLE document DROP COLUMN IF EXISTS digest")
@@ -0,0 +1,37 @@
+"""Add vector search indexes to documentchunk
+
+Revision ID: 4ec3c185ddf8
+Revises:
+Create Date: 2026-10-19 09:18:22.981578
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '4ec3c185ddf8'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute("CREATE EXTENSION IF NOT EXISTS vector")
+    # Built concurrently so ingestion keeps writing chunks while the
+    # indexes are created on an existing table.
+    with op.get_context().autocommit_block():
+        op.execute(
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_documentchunk_document_id "
+            "ON documentchunk (document_id)"
+        )
+        op.execute(
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_documentchunk_embedding_hnsw "
+            "ON documentchunk USING hnsw (embedding vector_cosine_ops) "
+            "WITH (m = 16, ef_construction = 64)"
+        )
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.execute("DROP INDEX CONCURRENTLY IF EXISTS ix_documentchunk_embedding_hnsw")
+        op.execute("DROP INDEX CONCURRENTLY IF EXISTS ix_documentchunk_document_id")
@@ -0,0 +1,25 @@
+"""Add documentchunk start_offset
+
+Revision ID: 71c6f0c0bd41
+Revises: 4ec3c185ddf8
+Create Date: 2026-10-19 09:21:02.474015
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '71c6f0c0bd41'
+down_revision = '4ec3c185ddf8'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute(
+        "ALTER TABLE documentchunk ADD COLUMN IF NOT EXISTS start_offset INTEGER"
+    )
+
+
+def downgrade():
+    op.execute("ALTER TABLE documentchunk DROP COLUMN IF EXISTS start_offset")
@@ -0,0 +1,25 @@
+"""Add documentchunk token_count
+
+Revision ID: 8e3d2a7c5b19
+Revises: d9fdb57ffc7d
+Create Date: 2026-10-19 14:02:37.118204
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '8e3d2a7c5b19'
+down_revision = 'd9fdb57ffc7d'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute(
+        "ALTER TABLE documentchunk ADD COLUMN IF NOT EXISTS token_count INTEGER"
+    )
+
+
+def downgrade():
+    op.execute("ALTER TABLE documentchunk DROP COLUMN IF EXISTS token_count")
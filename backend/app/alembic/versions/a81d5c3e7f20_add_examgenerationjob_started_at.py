@@ -0,0 +1,30 @@
+"""Add examgenerationjob started_at
+
+Revision ID: a81d5c3e7f20
+Revises: 2c7f4e91d0a3
+Create Date: 2026-10-19 18:42:07.311954
+
+"""
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = "a81d5c3e7f20"
+down_revision = "2c7f4e91d0a3"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # The table itself is created with the models on first start
+    op.execute(
+        "ALTER TABLE IF EXISTS examgenerationjob "
+        "ADD COLUMN IF NOT EXISTS started_at TIMESTAMP WITHOUT TIME ZONE"
+    )
+
+
+def downgrade():
+    op.execute(
+        "ALTER TABLE IF EXISTS examgenerationjob DROP COLUMN IF EXISTS started_at"
+    )
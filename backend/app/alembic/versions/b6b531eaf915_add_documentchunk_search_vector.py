@@ -0,0 +1,35 @@
+"""Add documentchunk search_vector
+
+Revision ID: b6b531eaf915
+Revises: 71c6f0c0bd41
+Create Date: 2026-10-19 09:37:03.023554
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'b6b531eaf915'
+down_revision = '71c6f0c0bd41'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # A stored generated column rewrites the table once; afterwards Postgres
+    # keeps it in sync with `text` on every insert and update.
+    op.execute(
+        "ALTER TABLE documentchunk ADD COLUMN IF NOT EXISTS search_vector tsvector "
+        "GENERATED ALWAYS AS (to_tsvector('english', text)) STORED"
+    )
+    with op.get_context().autocommit_block():
+        op.execute(
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_documentchunk_search_vector "
+            "ON documentchunk USING gin (search_vector)"
+        )
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.execute("DROP INDEX CONCURRENTLY IF EXISTS ix_documentchunk_search_vector")
+    op.execute("ALTER TABLE documentchunk DROP COLUMN IF EXISTS search_vector")
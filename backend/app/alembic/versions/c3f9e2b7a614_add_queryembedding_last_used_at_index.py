@@ -0,0 +1,34 @@
+"""Add queryembedding last_used_at index
+
+Revision ID: c3f9e2b7a614
+Revises: a81d5c3e7f20
+Create Date: 2026-10-19 19:05:33.870215
+
+"""
+
+import sqlalchemy as sa
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = "c3f9e2b7a614"
+down_revision = "a81d5c3e7f20"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # The table is created with the models (and this index) on first start;
+    # a table created before the index was declared gets it here.
+    if not sa.inspect(op.get_bind()).has_table("queryembedding"):
+        return
+    with op.get_context().autocommit_block():
+        op.execute(
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_queryembedding_last_used_at "
+            "ON queryembedding (last_used_at)"
+        )
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.execute("DROP INDEX CONCURRENTLY IF EXISTS ix_queryembedding_last_used_at")
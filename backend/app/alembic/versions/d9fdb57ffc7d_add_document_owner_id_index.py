@@ -0,0 +1,29 @@
+"""Add document owner_id index
+
+Revision ID: d9fdb57ffc7d
+Revises: f4b54b49c1e2
+Create Date: 2026-10-19 10:05:17.725837
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'd9fdb57ffc7d'
+down_revision = 'f4b54b49c1e2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Document search and listing are scoped to one owner.
+    with op.get_context().autocommit_block():
+        op.execute(
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_document_owner_id "
+            "ON document (owner_id)"
+        )
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.execute("DROP INDEX CONCURRENTLY IF EXISTS ix_document_owner_id")
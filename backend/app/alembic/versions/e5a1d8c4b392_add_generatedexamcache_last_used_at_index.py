@@ -0,0 +1,36 @@
+"""Add generatedexamcache last_used_at index
+
+Revision ID: e5a1d8c4b392
+Revises: c3f9e2b7a614
+Create Date: 2026-10-19 19:21:46.105382
+
+"""
+
+import sqlalchemy as sa
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = "e5a1d8c4b392"
+down_revision = "c3f9e2b7a614"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # The table is created with the models (and this index) on first start;
+    # a table created before the index was declared gets it here.
+    if not sa.inspect(op.get_bind()).has_table("generatedexamcache"):
+        return
+    with op.get_context().autocommit_block():
+        op.execute(
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS "
+            "ix_generatedexamcache_last_used_at ON generatedexamcache (last_used_at)"
+        )
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.execute(
+            "DROP INDEX CONCURRENTLY IF EXISTS ix_generatedexamcache_last_used_at"
+        )
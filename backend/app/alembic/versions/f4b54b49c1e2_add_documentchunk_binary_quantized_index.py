@@ -0,0 +1,47 @@
+"""Add documentchunk binary quantized index
+
+Revision ID: f4b54b49c1e2
+Revises: b6b531eaf915
+Create Date: 2026-10-19 09:49:13.987229
+
+"""
+import logging
+
+import sqlalchemy as sa
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'f4b54b49c1e2'
+down_revision = 'b6b531eaf915'
+branch_labels = None
+depends_on = None
+
+logger = logging.getLogger("alembic.runtime.migration")
+
+
+def pgvector_version():
+    version = op.get_bind().execute(
+        sa.text("SELECT extversion FROM pg_extension WHERE extname = 'vector'")
+    ).scalar_one()
+    return tuple(int(part) for part in version.split(".")[:2])
+
+
+def upgrade():
+    # binary_quantize() and bit_hamming_ops arrived in pgvector 0.7; older
+    # servers keep working, only RETRIEVAL_MODE=binary is unavailable there.
+    if pgvector_version() < (0, 7):
+        logger.warning("pgvector < 0.7: skipping the binary quantized index")
+        return
+    with op.get_context().autocommit_block():
+        op.execute(
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_documentchunk_embedding_bq_hnsw "
+            "ON documentchunk USING hnsw "
+            "((binary_quantize(embedding)::bit(1536)) bit_hamming_ops) "
+            "WITH (m = 16, ef_construction = 64)"
+        )
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.execute("DROP INDEX CONCURRENTLY IF EXISTS ix_documentchunk_embedding_bq_hnsw")
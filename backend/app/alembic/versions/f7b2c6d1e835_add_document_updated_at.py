@@ -0,0 +1,27 @@
+"""Add document updated_at
+
+Revision ID: f7b2c6d1e835
+Revises: e5a1d8c4b392
+Create Date: 2026-10-19 19:48:12.657340
+
+"""
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = "f7b2c6d1e835"
+down_revision = "e5a1d8c4b392"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute(
+        "ALTER TABLE document ADD COLUMN IF NOT EXISTS updated_at "
+        "TIMESTAMP WITHOUT TIME ZONE NOT NULL DEFAULT (now() AT TIME ZONE 'utc')"
+    )
+
+
+def downgrade():
+    op.execute("ALTER TABLE document DROP COLUMN IF EXISTS updated_at")
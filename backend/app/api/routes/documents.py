@@ -2,16 +2,23 @@ import logging
 import uuid
 from typing import Any
 
-from fastapi import APIRouter, BackgroundTasks, File, HTTPException, UploadFile
+from fastapi import APIRouter, BackgroundTasks, File, HTTPException, Query, UploadFile
 from sqlmodel import func, select
 
+from app import crud
 from app.api.deps import CurrentUser, SessionDep
-from app.core.extractors import extract_text_and_save_to_db
+from app.core.ai.clustering import (
+    invalidate_document as invalidate_document_clusters,
+)
+from app.core.ai.exam_cache import pregenerate_default_exam
+from app.core.ai.vector_cache import invalidate_document
+from app.core.extractors import build_document_digest, extract_text_and_save_to_db
 from app.core.s3 import generate_s3_url, upload_file_to_s3
 from app.models import (
     Document,
     DocumentCreate,
     DocumentPublic,
+    DocumentSearchResults,
     DocumentsPublic,
     DocumentUpdate,
     Message,
@@ -79,11 +86,41 @@ def create_document(
             "Validation error: {e} Failed to create DocumentCreate instance. file: {file.filename}, content_type: {file.content_type}, size: {file.size}, s3_url: {url}, s3_key: {key}"
         )
 
-    # 3. Kick off background job
+    # 3. Kick off background jobs: extraction, the study digest, then the
+    # draft of the default exam (generated from the digest, so it comes last)
     background_tasks.add_task(extract_text_and_save_to_db, key, str(document.id))
+    background_tasks.add_task(build_document_digest, str(document.id))
+    background_tasks.add_task(pregenerate_default_exam, str(document.id))
     return document
 
 
+@router.get("/search", response_model=DocumentSearchResults)
+def search_documents(
+    session: SessionDep,
+    current_user: CurrentUser,
+    q: str = Query(min_length=1, max_length=256),
+    limit: int = Query(default=20, ge=1, le=100),
+    cursor: str | None = None,
+) -> Any:
+    """
+    Full-text search across the current user's document chunks, best first.
+    """
+    try:
+        after = crud.decode_search_cursor(cursor) if cursor else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+    hits = crud.search_document_chunks(
+        session=session, owner_id=current_user.id, query=q, limit=limit, after=after
+    )
+    next_cursor = (
+        crud.encode_search_cursor(hits[-1].rank, hits[-1].chunk_id)
+        if len(hits) == limit
+        else None
+    )
+    return DocumentSearchResults(data=hits, next_cursor=next_cursor)
+
+
 @router.get("/{id}", response_model=DocumentPublic)
 def read_document(session: SessionDep, current_user: CurrentUser, id: uuid.UUID) -> Any:
     """
@@ -166,4 +203,6 @@ def delete_document(
         raise HTTPException(status_code=400, detail="Not enough permissions")
     session.delete(document)
     session.commit()
+    invalidate_document(id)
+    invalidate_document_clusters(id)
     return Message(message="Document deleted successfully")
@@ -1,65 +1,195 @@
+import json
+import logging
 import uuid
+from collections.abc import AsyncIterator
 from typing import Any
 
-from fastapi import APIRouter, HTTPException
-from sqlmodel import func, select
+from fastapi import APIRouter, BackgroundTasks, HTTPException, Query
+from fastapi.responses import JSONResponse, StreamingResponse
+from sqlmodel import Session, func, select
 
 from app import crud
 from app.api.deps import CurrentUser, SessionDep
-from app.core.ai.openai import generate_questions_from_documents
+from app.core.ai.question_bank import fetch_texts_by_document, stream_questions_banked
+from app.core.ai.vector_cache import invalidate_exam
+from app.core.exam_jobs import (
+    after_exam_generated,
+    expire_lost_job,
+    generate_exam_questions,
+    generated_exam_in,
+    run_exam_generation_job,
+)
 from app.models import (
     Exam,
     ExamAttempt,
-    ExamCreate,
+    ExamGenerationJob,
+    ExamGenerationJobPublic,
+    ExamJobStatus,
     ExamPublic,
     ExamsPublic,
     ExamUpdate,
     GenerateQuestionsPublic,
     Message,
-    QuestionCreate,
+    User,
 )
 
+logger = logging.getLogger(__name__)
+
 router = APIRouter(prefix="/exams", tags=["exams"])
 
 
-@router.post("/generate", response_model=ExamPublic)
+def sse_event(event: str, data: Any) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+
+@router.post(
+    "/generate",
+    response_model=ExamPublic,
+    responses={202: {"model": ExamGenerationJobPublic}},
+)
 async def generate_exam(
     *,
     session: SessionDep,
     payload: GenerateQuestionsPublic,
     current_user: CurrentUser,
-) -> ExamPublic:
-    source_document_ids = [str(doc_id) for doc_id in payload.document_ids]
-
-    exam_in = ExamCreate(
-        title=payload.title,
-        description="generated exam",
-        duration_minutes=30,
-        is_published=False,
-        source_document_ids=source_document_ids,
-        difficulty=payload.difficulty if payload.difficulty else None,
-        question_types=payload.question_types if payload.question_types else [],
+    background_tasks: BackgroundTasks,
+    run_async: bool = Query(default=False, alias="async"),
+) -> Any:
+    """
+    Generate an exam from documents.
+
+    With `?async=true` the response is 202 with a job to poll at
+    `/exams/jobs/{id}`; once it has succeeded the exam is at
+    `/exams/jobs/{id}/result`. The exam is only saved if generation succeeds.
+    """
+    if run_async:
+        job = crud.create_exam_generation_job(
+            session=session, payload=payload, owner_id=current_user.id
+        )
+        background_tasks.add_task(run_exam_generation_job, job.id)
+        return JSONResponse(
+            status_code=202,
+            content=ExamGenerationJobPublic.model_validate(job).model_dump(mode="json"),
+        )
+
+    db_exam = await generate_exam_questions(session, payload, current_user.id)
+    session.commit()
+    session.refresh(db_exam)
+
+    # Link questions to chunks and top up the question banks
+    background_tasks.add_task(after_exam_generated, db_exam.id, payload)
+
+    return ExamPublic.model_validate(db_exam)
+
+
+def read_owned_job(
+    session: Session, current_user: User, job_id: uuid.UUID
+) -> ExamGenerationJob:
+    job = session.get(ExamGenerationJob, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if not current_user.is_superuser and (job.owner_id != current_user.id):
+        raise HTTPException(status_code=400, detail="Not enough permissions")
+    return expire_lost_job(session, job)
+
+
+@router.get("/jobs/{job_id}", response_model=ExamGenerationJobPublic)
+def read_exam_generation_job(
+    session: SessionDep, current_user: CurrentUser, job_id: uuid.UUID
+) -> Any:
+    """
+    Get the status of an exam generation job.
+    """
+    return read_owned_job(session, current_user, job_id)
+
+
+@router.get("/jobs/{job_id}/result", response_model=ExamPublic)
+def read_exam_generation_result(
+    session: SessionDep, current_user: CurrentUser, job_id: uuid.UUID
+) -> Any:
+    """
+    Get the exam generated by a job that has succeeded.
+    """
+    job = read_owned_job(session, current_user, job_id)
+    if job.status == ExamJobStatus.failed:
+        raise HTTPException(status_code=409, detail=f"Job failed: {job.error}")
+    if job.status != ExamJobStatus.succeeded:
+        raise HTTPException(
+            status_code=409, detail=f"Job is {ExamJobStatus(job.status).value}"
+        )
+    exam = session.get(Exam, job.exam_id) if job.exam_id else None
+    if not exam:
+        raise HTTPException(status_code=404, detail="Exam not found")
+    return exam
+
+
+@router.post("/generate/stream", response_class=StreamingResponse)
+async def generate_exam_stream(
+    *,
+    session: SessionDep,
+    payload: GenerateQuestionsPublic,
+    current_user: CurrentUser,
+) -> StreamingResponse:
+    """
+    Generate an exam, streaming it as Server-Sent Events.
+
+    Events: `exam` with the new exam, then a `question` for each question
+    as soon as it is generated and saved, then `done` with the number of
+    questions, or `error` with its detail. An exam whose generation fails
+    before its first question is deleted.
+    """
+    texts_by_document = fetch_texts_by_document(
+        session, payload.document_ids, payload.topics
     )
     db_exam = crud.create_db_exam(
         session=session,
-        exam_in=exam_in,
+        exam_in=generated_exam_in(payload),
         owner_id=current_user.id,
-        source_document_ids=source_document_ids,
+        source_document_ids=[str(doc_id) for doc_id in payload.document_ids],
     )
+    exam = ExamPublic.model_validate(db_exam).model_dump(mode="json")
+    background_tasks = BackgroundTasks()
+    background_tasks.add_task(after_exam_generated, db_exam.id, payload)
 
-    # 2. Generate questions
-    generated_questions: list[QuestionCreate] = await generate_questions_from_documents(
-        session,
-        payload.document_ids,
-        num_questions=payload.num_questions if payload.num_questions else 5,
-        difficulty=payload.difficulty if payload.difficulty else None,
-        question_types=payload.question_types if payload.question_types else None,
-    )
+    async def events() -> AsyncIterator[str]:
+        yield sse_event("exam", exam)
+        count = 0
+        # The request's session is closed before the response streams
+        with Session(session.get_bind()) as stream_session:
+            try:
+                async for question in stream_questions_banked(
+                    stream_session,
+                    texts_by_document,
+                    num_questions=payload.num_questions,
+                    difficulty=payload.difficulty,
+                    question_types=payload.question_types or None,
+                    use_bank=not payload.topics,
+                ):
+                    saved = crud.create_question(
+                        session=stream_session,
+                        question_in=question,
+                        exam_id=db_exam.id,
+                    )
+                    count += 1
+                    yield sse_event("question", saved.model_dump(mode="json"))
+            except Exception as e:
+                logger.error(f"Streaming generation of exam {db_exam.id} failed: {e}")
+                stream_session.rollback()
+                if count == 0:
+                    failed = stream_session.get(Exam, db_exam.id)
+                    if failed:
+                        stream_session.delete(failed)
+                        stream_session.commit()
+                detail = e.detail if isinstance(e, HTTPException) else str(e)
+                yield sse_event("error", {"detail": detail})
+                return
+        yield sse_event("done", {"exam_id": str(db_exam.id), "count": count})
 
-    return crud.create_exam(
-        session=session,
-        db_exam=db_exam,
-        questions=generated_questions,
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        background=background_tasks,
     )
 
 
@@ -161,4 +291,5 @@ def delete_exam(
         raise HTTPException(status_code=403, detail="Not enough permissions")
     session.delete(exam)
     session.commit()
+    invalidate_exam(id)
     return Message(message="Exam deleted successfully")
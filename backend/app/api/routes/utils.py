@@ -1,8 +1,10 @@
 from fastapi import APIRouter, Depends
 from pydantic.networks import EmailStr
 
-from app.api.deps import get_current_active_superuser
-from app.models import Message
+from app.api.deps import SessionDep, get_current_active_superuser
+from app.core.ai.exam_cache import exam_cache_stats
+from app.core.ai.tokens import token_usage
+from app.models import ExamCacheStats, LLMTokenStats, Message
 from app.utils import generate_test_email, send_email
 
 router = APIRouter(prefix="/utils", tags=["utils"])
@@ -26,6 +28,30 @@ def test_email(email_to: EmailStr) -> Message:
     return Message(message="Test email sent")
 
 
+@router.get(
+    "/exam-cache-stats/",
+    dependencies=[Depends(get_current_active_superuser)],
+    response_model=ExamCacheStats,
+)
+def read_exam_cache_stats(session: SessionDep) -> ExamCacheStats:
+    """
+    Hits, misses and generation time saved by the generated-exam cache.
+    """
+    return exam_cache_stats(session)
+
+
+@router.get(
+    "/llm-token-stats/",
+    dependencies=[Depends(get_current_active_superuser)],
+    response_model=LLMTokenStats,
+)
+def read_llm_token_stats() -> LLMTokenStats:
+    """
+    Prompt, cached prompt and completion tokens used by this worker's LLM calls.
+    """
+    return token_usage.stats()
+
+
 @router.get("/health-check/")
 async def health_check() -> bool:
     return True
@@ -0,0 +1,304 @@
+"""
+Representative chunks of material too long to generate from in full.
+
+Generating from every word of a large document set costs a call per section,
+and cutting the material short favours the first document. Instead, once
+the documents hold more than GENERATION_CONTEXT_TOKENS, their chunk
+embeddings are clustered with k-means, one cluster for about every chunk
+the budget holds. Each document gets a share of the budget in proportion
+to its size, and chunks are taken nearest-centroid first from every
+cluster in turn, so the excerpts cover every topic of every document.
+
+Cluster assignments are cached per document set, so repeated exams on the
+same documents skip loading the embeddings and clustering; a cached entry
+is used only while the documents' version stamp is unchanged.
+"""
+
+import logging
+from collections.abc import Collection, Sequence
+from dataclasses import dataclass
+from typing import Any
+from uuid import UUID
+
+import numpy as np
+from numpy.typing import NDArray
+from sqlalchemy import func, select
+from sqlmodel import Session
+
+from app.core.ai.context import join_by_document
+from app.core.ai.tokens import count_tokens, truncate_to_tokens
+from app.core.ai.vector_cache import (
+    DocumentVersions,
+    document_versions,
+    estimate_matrix_bytes,
+    load_chunk_matrix,
+)
+from app.core.cache import LRUCache
+from app.core.config import settings
+from app.models import DocumentChunk, RetrievedChunk
+
+logger = logging.getLogger(__name__)
+
+KMEANS_MAX_ITERATIONS = 25
+KMEANS_SEED = 0
+# One cluster per this many tokens of budget: about one fixed-size chunk
+TOKENS_PER_CLUSTER = 250
+
+
+def kmeans(
+    points: NDArray[np.float32],
+    k: int,
+    *,
+    max_iterations: int = KMEANS_MAX_ITERATIONS,
+    seed: int = KMEANS_SEED,
+) -> tuple[NDArray[np.float32], NDArray[np.intp]]:
+    """
+    Centroids and labels of `k` clusters of the rows of `points`.
+
+    Lloyd's algorithm from a k-means++ start, with a fixed seed so the same
+    points always give the same clusters. Distances of all points to all
+    centroids are one matrix product per iteration; a cluster left empty
+    keeps its centroid.
+    """
+    n = len(points)
+    k = max(1, min(k, n))
+    rng = np.random.default_rng(seed)
+    squared_norms = np.einsum("ij,ij->i", points, points)
+
+    # k-means++: each centroid is drawn with probability proportional to the
+    # squared distance to the nearest centroid drawn so far
+    centroids = np.empty((k, points.shape[1]), dtype=np.float32)
+    centroids[0] = points[rng.integers(n)]
+    nearest = np.sum((points - centroids[0]) ** 2, axis=1)
+    for i in range(1, k):
+        cumulative = np.cumsum(nearest)
+        index = int(np.searchsorted(cumulative, rng.random() * cumulative[-1]))
+        centroids[i] = points[min(index, n - 1)]
+        np.minimum(nearest, np.sum((points - centroids[i]) ** 2, axis=1), out=nearest)
+
+    labels = np.full(n, -1, dtype=np.intp)
+    for _ in range(max_iterations):
+        distances = (
+            squared_norms[:, None]
+            - 2 * points @ centroids.T
+            + np.einsum("ij,ij->i", centroids, centroids)[None, :]
+        )
+        new_labels = np.argmin(distances, axis=1)
+        if np.array_equal(new_labels, labels):
+            break
+        labels = new_labels
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, points)
+        counts = np.bincount(labels, minlength=k)
+        filled = counts > 0
+        centroids[filled] = sums[filled] / counts[filled, None]
+    return centroids, labels
+
+
+def selection_order(
+    labels: NDArray[np.intp], distances: NDArray[np.float32]
+) -> NDArray[np.intp]:
+    """
+    Chunk indices round-robin over the clusters: the chunk nearest each
+    centroid, then the second nearest, and so on.
+    """
+    by_cluster = np.lexsort((distances, labels))
+    sorted_labels = labels[by_cluster]
+    # Rank of each chunk within its cluster, nearest first
+    ranks = np.empty(len(labels), dtype=np.intp)
+    ranks[by_cluster] = np.arange(len(labels)) - np.searchsorted(
+        sorted_labels, sorted_labels
+    )
+    order: NDArray[np.intp] = np.lexsort((distances, ranks))
+    return order
+
+
+@dataclass
+class ChunkClusters:
+    """The chunks of a document set in selection order (see `selection_order`)."""
+
+    chunks: list[RetrievedChunk]
+    num_clusters: int
+    # `document_versions` of the documents when they were clustered
+    versions: DocumentVersions = frozenset()
+
+    @property
+    def nbytes(self) -> int:
+        # Texts dominate; they are counted roughly.
+        return sum(len(chunk.text) for chunk in self.chunks)
+
+
+def cluster_chunks(
+    session: Session,
+    document_ids: list[UUID],
+    num_clusters: int,
+    versions: DocumentVersions = frozenset(),
+) -> ChunkClusters:
+    """
+    Load the documents' embedded chunks and order them by `kmeans` clusters.
+
+    Documents whose embeddings would exceed VECTOR_CACHE_MAX_BYTES are not
+    loaded; they get no clusters, as if not embedded.
+    """
+    if estimate_matrix_bytes(session, document_ids) > settings.VECTOR_CACHE_MAX_BYTES:
+        logger.warning(
+            f"Embeddings of {len(document_ids)} documents exceed "
+            "VECTOR_CACHE_MAX_BYTES, not clustering them"
+        )
+        return ChunkClusters(chunks=[], num_clusters=0, versions=versions)
+    matrix = load_chunk_matrix(session, document_ids)
+    if len(matrix) == 0:
+        return ChunkClusters(chunks=[], num_clusters=0, versions=versions)
+    centroids, labels = kmeans(matrix.matrix, num_clusters)
+    distances = np.linalg.norm(matrix.matrix - centroids[labels], axis=1)
+    order = selection_order(labels, distances)
+    chunks = [
+        RetrievedChunk(
+            id=matrix.chunk_ids[i],
+            document_id=matrix.document_ids[i],
+            text=matrix.texts[i],
+            distance=float(distances[i]),
+            start_offset=matrix.start_offsets[i],
+            token_count=matrix.token_counts[i],
+        )
+        for i in order
+    ]
+    return ChunkClusters(chunks=chunks, num_clusters=len(centroids), versions=versions)
+
+
+# Keyed by the document set and the number of clusters
+_document_set_clusters: LRUCache[tuple[frozenset[UUID], int], ChunkClusters] = LRUCache(
+    max_bytes=settings.VECTOR_CACHE_MAX_BYTES,
+    ttl_seconds=settings.VECTOR_CACHE_TTL_SECONDS,
+    sizeof=lambda clusters: clusters.nbytes,
+)
+
+
+def get_chunk_clusters(
+    session: Session, document_ids: list[UUID], num_clusters: int
+) -> ChunkClusters:
+    """
+    `cluster_chunks`, cached per document set until a document changes
+    (see `document_versions`).
+    """
+    key = (frozenset(document_ids), num_clusters)
+    versions = document_versions(session, document_ids)
+    clusters = _document_set_clusters.get(key)
+    if clusters is None or clusters.versions != versions:
+        clusters = cluster_chunks(session, document_ids, num_clusters, versions)
+        _document_set_clusters.set(key, clusters)
+        logger.info(
+            f"Clustered {len(clusters.chunks)} chunks of {len(document_ids)} "
+            f"documents into {clusters.num_clusters} clusters"
+        )
+    return clusters
+
+
+def invalidate_document(document_id: UUID | str) -> None:
+    """Drop the cached clusters of every document set including `document_id`."""
+    document_uuid = document_id if isinstance(document_id, UUID) else UUID(document_id)
+    _document_set_clusters.discard_where(lambda key, _: document_uuid in key[0])
+
+
+def share_budget(sizes: dict[UUID, int], max_tokens: int) -> dict[UUID, int]:
+    """Split `max_tokens` over documents in proportion to their sizes."""
+    total = sum(sizes.values())
+    if total == 0:
+        return {document_id: 0 for document_id in sizes}
+    return {
+        document_id: max_tokens * size // total for document_id, size in sizes.items()
+    }
+
+
+def select_excerpts(
+    chunks: Sequence[RetrievedChunk], budgets: dict[UUID, int]
+) -> dict[UUID, str]:
+    """
+    Take `chunks` in order while their documents' budgets last, joined per
+    document by `join_by_document`.
+    """
+    remaining = dict(budgets)
+    selected: list[RetrievedChunk] = []
+    for chunk in chunks:
+        left = remaining.get(chunk.document_id, 0)
+        tokens = chunk.token_count
+        if tokens is None:
+            tokens = count_tokens(chunk.text)
+        if tokens <= left:
+            selected.append(chunk)
+            remaining[chunk.document_id] = left - tokens
+    return join_by_document(selected)
+
+
+def chunk_token_totals(session: Session, document_ids: list[UUID]) -> dict[UUID, int]:
+    """
+    Tokens of each document by its chunks' token counts; documents with an
+    uncounted chunk are left out.
+    """
+    stmt: Any = (
+        select(  # type: ignore[call-overload]
+            DocumentChunk.document_id, func.sum(DocumentChunk.token_count)
+        )
+        .where(DocumentChunk.document_id.in_(document_ids))  # type: ignore[attr-defined]
+        .group_by(DocumentChunk.document_id)
+        .having(func.count(DocumentChunk.token_count) == func.count())  # type: ignore[arg-type]
+    )
+    return {document_id: int(total) for document_id, total in session.execute(stmt)}
+
+
+def representative_texts(
+    session: Session,
+    texts_by_document: dict[UUID, str],
+    clustered: Collection[UUID],
+) -> dict[UUID, str]:
+    """
+    `texts_by_document`, with the texts of the `clustered` documents
+    replaced by representative excerpts if all texts together exceed
+    GENERATION_CONTEXT_TOKENS.
+
+    Every document gets a share of the budget by size; the clustered ones
+    are represented within theirs, the other texts (digests, already short)
+    are kept whole. A document without embedded chunks is cut to its share
+    instead. Sizes come from the chunks' stored token counts where every
+    chunk has one, so long texts are not tokenized again.
+    """
+    totals = chunk_token_totals(
+        session,
+        [document_id for document_id in texts_by_document if document_id in clustered],
+    )
+    sizes = {
+        document_id: totals.get(document_id) or count_tokens(text)
+        for document_id, text in texts_by_document.items()
+    }
+    if sum(sizes.values()) <= settings.GENERATION_CONTEXT_TOKENS or not any(
+        document_id in clustered for document_id in sizes
+    ):
+        return texts_by_document
+
+    budgets = {
+        document_id: budget
+        for document_id, budget in share_budget(
+            sizes, settings.GENERATION_CONTEXT_TOKENS
+        ).items()
+        if document_id in clustered
+    }
+    budget = sum(budgets.values())
+    clusters = get_chunk_clusters(
+        session, list(budgets), max(1, budget // TOKENS_PER_CLUSTER)
+    )
+    excerpts = select_excerpts(clusters.chunks, budgets)
+    embedded = {chunk.document_id for chunk in clusters.chunks}
+
+    texts = dict(texts_by_document)
+    for document_id in budgets:
+        if document_id in embedded:
+            texts[document_id] = excerpts.get(document_id, "")
+        else:
+            texts[document_id] = truncate_to_tokens(
+                texts[document_id], budgets[document_id]
+            )
+    logger.info(
+        f"Represented {sum(sizes[d] for d in budgets)} tokens of {len(budgets)} "
+        f"documents by {budget} tokens of excerpts"
+    )
+    return {document_id: text for document_id, text in texts.items() if text}
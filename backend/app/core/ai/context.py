@@ -0,0 +1,171 @@
+"""
+Packing retrieved chunks into prompt context.
+
+Retrieval over-fetches candidates; the packer picks a relevant but diverse
+subset with Maximal Marginal Relevance, stitches chunks that overlap in the
+source text back together (fixed-size chunks share 200 characters with their
+neighbours) and trims the result to a token budget.
+"""
+
+from collections.abc import Sequence
+from dataclasses import dataclass
+from uuid import UUID
+
+import numpy as np
+
+from app.core.ai.tokens import count_tokens, truncate_to_tokens
+from app.core.ai.vector_cache import normalize_rows
+from app.models import RetrievedChunk
+
+# Weight of relevance against novelty in MMR; 1.0 is plain top-k
+MMR_LAMBDA = 0.5
+# A trimmed passage shorter than this is dropped rather than cut
+MIN_PASSAGE_TOKENS = 40
+
+
+def mmr_select(
+    relevance: Sequence[float],
+    candidate_embeddings: np.ndarray,
+    k: int,
+    *,
+    lambda_: float = MMR_LAMBDA,
+) -> list[int]:
+    """
+    Indices of `k` candidates chosen by Maximal Marginal Relevance.
+
+    Each step takes the candidate maximising
+    lambda * relevance(c) - (1 - lambda) * max(sim(c, selected)), where
+    `relevance` is the candidates' cosine similarity to the query. The
+    candidate-to-candidate similarities are one matrix product.
+    """
+    n = len(candidate_embeddings)
+    if n == 0 or k <= 0:
+        return []
+    embeddings = normalize_rows(candidate_embeddings)
+    relevance_scores = np.asarray(relevance, dtype=np.float32)
+    similarity = embeddings @ embeddings.T
+
+    selected = [int(np.argmax(relevance_scores))]
+    max_similarity = similarity[selected[0]].copy()
+    while len(selected) < min(k, n):
+        scores = lambda_ * relevance_scores - (1 - lambda_) * max_similarity
+        scores[selected] = -np.inf
+        best = int(np.argmax(scores))
+        selected.append(best)
+        np.maximum(max_similarity, similarity[best], out=max_similarity)
+    return selected
+
+
+@dataclass
+class Passage:
+    text: str
+    rank: int  # best rank among the chunks it was built from
+    document_id: UUID
+    start_offset: int | None
+    # Token count stored at ingest; None once chunks are merged
+    tokens: int | None = None
+
+    @property
+    def end_offset(self) -> int | None:
+        if self.start_offset is None:
+            return None
+        return self.start_offset + len(self.text)
+
+
+def merge_overlapping(chunks: Sequence[RetrievedChunk]) -> list[Passage]:
+    """
+    Join chunks that overlap or touch in the same document.
+
+    Chunks without a known offset are kept as they are. Passages come back
+    in rank order, where a chunk's rank is its position in `chunks`.
+    """
+    passages = [
+        Passage(
+            text=chunk.text,
+            rank=rank,
+            document_id=chunk.document_id,
+            start_offset=chunk.start_offset,
+            tokens=chunk.token_count,
+        )
+        for rank, chunk in enumerate(chunks)
+    ]
+    located = sorted(
+        (p for p in passages if p.start_offset is not None),
+        key=lambda p: (str(p.document_id), p.start_offset),
+    )
+    merged: list[Passage] = [p for p in passages if p.start_offset is None]
+    for passage in located:
+        previous = merged[-1] if merged else None
+        if (
+            previous is not None
+            and previous.end_offset is not None
+            and previous.document_id == passage.document_id
+            and passage.start_offset is not None
+            and passage.start_offset <= previous.end_offset
+        ):
+            overlap = previous.end_offset - passage.start_offset
+            previous.text += passage.text[overlap:]
+            previous.rank = min(previous.rank, passage.rank)
+            previous.tokens = None
+        else:
+            merged.append(passage)
+    return sorted(merged, key=lambda p: p.rank)
+
+
+def join_by_document(chunks: Sequence[RetrievedChunk]) -> dict[UUID, str]:
+    """
+    Each document's chunks as one text, in reading order, overlapping
+    chunks merged and the rest separated by blank lines.
+    """
+    passages = sorted(
+        merge_overlapping(chunks),
+        key=lambda p: (p.start_offset is None, p.start_offset or 0, p.rank),
+    )
+    texts: dict[UUID, list[str]] = {}
+    for passage in passages:
+        texts.setdefault(passage.document_id, []).append(passage.text)
+    return {document_id: "\n\n".join(parts) for document_id, parts in texts.items()}
+
+
+def trim_to_budget(passages: Sequence[Passage], max_tokens: int) -> list[str]:
+    """Keep passages in order until `max_tokens`; the last one may be cut."""
+    texts: list[str] = []
+    remaining = max_tokens
+    for passage in passages:
+        tokens = passage.tokens
+        if tokens is None:
+            tokens = count_tokens(passage.text)
+        if tokens <= remaining:
+            texts.append(passage.text)
+            remaining -= tokens
+            continue
+        if remaining >= MIN_PASSAGE_TOKENS or not texts:
+            cut = truncate_to_tokens(passage.text, remaining)
+            # End on a word boundary rather than mid-word
+            texts.append(cut.rsplit(maxsplit=1)[0] if " " in cut else cut)
+        break
+    return texts
+
+
+def pack_context(
+    candidates: Sequence[RetrievedChunk], *, k: int, max_tokens: int
+) -> list[str]:
+    """
+    Build prompt context from retrieval candidates, best passage first.
+
+    Relevance is each candidate's similarity to the query it was retrieved
+    for, so no query embedding is needed here. MMR needs every candidate's
+    embedding; without them the candidates' retrieval order is used.
+    """
+    if not candidates:
+        return []
+    if all(chunk.embedding is not None for chunk in candidates):
+        order = mmr_select(
+            [chunk.similarity for chunk in candidates],
+            np.vstack([chunk.embedding for chunk in candidates]),
+            k,
+        )
+        selected = [candidates[i] for i in order]
+    else:
+        selected = list(candidates[:k])
+    return trim_to_budget(merge_overlapping(selected), max_tokens)
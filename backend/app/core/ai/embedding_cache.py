@@ -0,0 +1,159 @@
+"""
+Memoised query embeddings.
+
+Explanation queries repeat: every student who picks the same wrong option
+produces the same query text. Embeddings are keyed by a hash of the
+normalised text and the model, looked up in a worker-local LRU first and
+then in the `queryembedding` table, which all workers share. Only texts
+missing from both reach the embeddings API.
+"""
+
+import hashlib
+import unicodedata
+from datetime import datetime, timedelta, timezone
+from typing import Any
+
+import numpy as np
+from numpy.typing import NDArray
+from sqlalchemy import delete, select, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlmodel import Session
+
+from app.core.ai.embeddings import EMBEDDING_MODEL, embed_queries
+from app.core.cache import EveryNth, LRUCache, try_transaction_lock
+from app.core.config import settings
+from app.core.vectors import EMBEDDING_DIM
+from app.models import QueryEmbedding
+
+_local_embeddings: LRUCache[str, NDArray[np.float32]] = LRUCache(
+    max_items=settings.QUERY_EMBEDDING_CACHE_LOCAL_ITEMS,
+    ttl_seconds=settings.QUERY_EMBEDDING_CACHE_TTL_SECONDS,
+)
+_prune_schedule = EveryNth(settings.QUERY_EMBEDDING_CACHE_PRUNE_EVERY)
+
+
+def normalize_query_text(text: str) -> str:
+    """Unicode-, case- and whitespace-insensitive form of a query."""
+    return " ".join(unicodedata.normalize("NFKC", text).casefold().split())
+
+
+def query_embedding_key(normalized_text: str) -> str:
+    return hashlib.sha256(f"{EMBEDDING_MODEL}\n{normalized_text}".encode()).hexdigest()
+
+
+def embed_queries_cached(session: Session, texts: list[str]) -> NDArray[np.float32]:
+    """
+    Embed queries, reusing earlier embeddings of the same normalised text.
+
+    Misses are embedded with a single API request and written to the shared
+    table; row i of the returned array is the embedding of `texts[i]`. The
+    table is read and written in short transactions of their own on
+    `session`'s engine, committed before the API request, so no row locks
+    are held while the embeddings or the caller's LLM calls run.
+    """
+    if not texts:
+        return np.empty((0, EMBEDDING_DIM), dtype=np.float32)
+    if not settings.QUERY_EMBEDDING_CACHE_ENABLED:
+        return embed_queries(texts)
+
+    normalized = [normalize_query_text(text) for text in texts]
+    keys = [query_embedding_key(text) for text in normalized]
+
+    found: dict[str, NDArray[np.float32]] = {}
+    for key in set(keys):
+        embedding = _local_embeddings.get(key)
+        if embedding is not None:
+            found[key] = embedding
+
+    missing = {
+        key: text
+        for key, text in zip(keys, normalized, strict=True)
+        if key not in found
+    }
+    if missing:
+        with Session(session.get_bind()) as cache_session:
+            shared = _touch_shared_embeddings(cache_session, list(missing))
+            cache_session.commit()
+            fresh = {key: text for key, text in missing.items() if key not in shared}
+            if fresh:
+                embedded = dict(
+                    zip(fresh, embed_queries(list(fresh.values())), strict=True)
+                )
+                _store_shared_embeddings(cache_session, embedded)
+                if _prune_schedule.due():
+                    prune_query_embeddings(cache_session)
+                cache_session.commit()
+                shared.update(embedded)
+
+        for key, embedding in shared.items():
+            _local_embeddings.set(key, embedding)
+        found.update(shared)
+
+    return np.vstack([found[key] for key in keys])
+
+
+def _touch_shared_embeddings(
+    session: Session, keys: list[str]
+) -> dict[str, NDArray[np.float32]]:
+    """Fetch unexpired rows for `keys` and mark them used, in one statement."""
+    now = datetime.now(timezone.utc)
+    cutoff = now - timedelta(seconds=settings.QUERY_EMBEDDING_CACHE_TTL_SECONDS)
+    stmt: Any = (
+        update(QueryEmbedding)
+        .where(
+            QueryEmbedding.key.in_(keys),  # type: ignore[attr-defined]
+            QueryEmbedding.created_at >= cutoff,  # type: ignore[arg-type]
+        )
+        .values(last_used_at=now)
+        .returning(QueryEmbedding.key, QueryEmbedding.embedding)  # type: ignore[call-overload]
+    )
+    return {row.key: row.embedding for row in session.execute(stmt)}
+
+
+def _store_shared_embeddings(
+    session: Session, embeddings: dict[str, NDArray[np.float32]]
+) -> None:
+    now = datetime.now(timezone.utc)
+    stmt = insert(QueryEmbedding).values(
+        [
+            {"key": key, "embedding": embedding, "created_at": now, "last_used_at": now}
+            for key, embedding in embeddings.items()
+        ]
+    )
+    # Another worker may have embedded the same text meanwhile; last write wins.
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["key"],
+        set_={
+            "embedding": stmt.excluded.embedding,
+            "created_at": stmt.excluded.created_at,
+            "last_used_at": stmt.excluded.last_used_at,
+        },
+    )
+    session.execute(stmt)
+
+
+def prune_query_embeddings(session: Session) -> None:
+    """
+    Delete expired rows and the least recently used rows over the cap,
+    unless another transaction is pruning already.
+    """
+    if not try_transaction_lock(session, "queryembedding prune"):
+        return
+    cutoff = datetime.now(timezone.utc) - timedelta(
+        seconds=settings.QUERY_EMBEDDING_CACHE_TTL_SECONDS
+    )
+    session.execute(
+        delete(QueryEmbedding).where(
+            QueryEmbedding.created_at < cutoff  # type: ignore[arg-type]
+        )
+    )
+    overflow = (
+        select(QueryEmbedding.key)  # type: ignore[call-overload]
+        .order_by(QueryEmbedding.last_used_at.desc())  # type: ignore[attr-defined]
+        .offset(settings.QUERY_EMBEDDING_CACHE_MAX_ROWS)
+    )
+    session.execute(
+        delete(QueryEmbedding).where(
+            QueryEmbedding.key.in_(overflow)  # type: ignore[attr-defined]
+        )
+    )
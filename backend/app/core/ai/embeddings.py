@@ -1,6 +1,11 @@
+import numpy as np
 from langchain_openai import OpenAIEmbeddings
+from numpy.typing import NDArray
 
 from app.core.config import settings
+from app.core.vectors import EMBEDDING_DIM, as_float32
+
+EMBEDDING_MODEL = "text-embedding-3-small"
 
 _embeddings_model: OpenAIEmbeddings | None = None
 
@@ -9,17 +14,25 @@ def get_embeddings_model() -> OpenAIEmbeddings:
     global _embeddings_model
     if _embeddings_model is None:
         _embeddings_model = OpenAIEmbeddings(
-            model="text-embedding-3-small",
+            model=EMBEDDING_MODEL,
             api_key=settings.OPENAI_API_KEY,  # type: ignore
         )
     return _embeddings_model
 
 
-def embed_text(text: str) -> list[float]:
+def embed_text(text: str) -> NDArray[np.float32]:
     model = get_embeddings_model()
-    return model.embed_query(text)
+    return as_float32(model.embed_query(text))
 
 
-def embed_documents(texts: list[str]) -> list[list[float]]:
+def embed_documents(texts: list[str]) -> NDArray[np.float32]:
+    """Embed texts as the rows of one (len(texts), EMBEDDING_DIM) array."""
+    if not texts:
+        return np.empty((0, EMBEDDING_DIM), dtype=np.float32)
     model = get_embeddings_model()
-    return model.embed_documents(texts)
+    return as_float32(model.embed_documents(texts))
+
+
+def embed_queries(texts: list[str]) -> NDArray[np.float32]:
+    """Embed several queries with a single API request."""
+    return embed_documents(texts)
@@ -0,0 +1,356 @@
+"""
+Cached exam generation.
+
+Classes generate exams from the same documents with the same parameters
+again and again. Generated questions are keyed by the hashes of the
+document texts, the exam parameters, the prompt version and the model, and
+kept in the `generatedexamcache` table, which all workers share. A changed
+document, prompt or model yields a new key, so stale questions are never
+served; entries also expire after EXAM_CACHE_TTL_SECONDS.
+
+With the "exact" policy a hit returns the questions of the earlier
+generation. With the "pool" policy the key leaves out the number of
+questions, misses add their questions to the pool, and once the pool holds
+EXAM_CACHE_POOL_FACTOR times as many questions as asked for, hits sample
+from it, so students do not all get the same exam.
+
+With EXAM_PREGENERATION_ENABLED, the default exam of every new document is
+generated into the cache as soon as the document is ready, so the first
+default exam on it is a hit rather than a wait for the LLM.
+"""
+
+import hashlib
+import json
+import logging
+import math
+import random
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any
+from uuid import UUID
+
+from sqlalchemy import delete, func, select, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlmodel import Session
+
+from app.core.ai.openai import (
+    QUESTION_PROMPT_VERSION,
+    generate_questions_from_texts,
+    llm,
+    normalize_difficulty,
+    normalize_question_types,
+    select_questions,
+)
+from app.core.ai.question_bank import (
+    fetch_texts_by_document,
+    generate_questions_banked,
+)
+from app.core.cache import EveryNth, try_transaction_lock
+from app.core.config import settings
+from app.core.db import engine
+from app.models import (
+    Difficulty,
+    Document,
+    DocumentStatus,
+    ExamCacheStats,
+    GeneratedExamCache,
+    GenerateQuestionsBase,
+    QuestionCreate,
+    QuestionType,
+)
+
+logger = logging.getLogger(__name__)
+
+_prune_schedule = EveryNth(settings.EXAM_CACHE_PRUNE_EVERY)
+
+
+def exam_cache_key(
+    document_texts: list[str],
+    *,
+    num_questions: int,
+    difficulty: Difficulty,
+    question_types: list[QuestionType],
+) -> str:
+    """Key of the questions for these texts and parameters under the current policy."""
+    parameters = {
+        "documents": sorted(
+            hashlib.sha256(text.encode()).hexdigest() for text in document_texts
+        ),
+        "difficulty": difficulty.value,
+        "question_types": sorted(question_types),
+        "num_questions": (
+            num_questions if settings.EXAM_CACHE_POLICY == "exact" else None
+        ),
+        "prompt_version": QUESTION_PROMPT_VERSION,
+        "model": llm.model_name,
+    }
+    return hashlib.sha256(json.dumps(parameters).encode()).hexdigest()
+
+
+def reuse_questions(
+    cached: list[QuestionCreate], num_questions: int
+) -> list[QuestionCreate] | None:
+    """The questions a hit returns under the current policy, or None for a miss."""
+    if settings.EXAM_CACHE_POLICY == "exact":
+        return cached or None
+    if len(cached) < num_questions * settings.EXAM_CACHE_POOL_FACTOR:
+        return None
+    return random.sample(cached, num_questions)
+
+
+async def generate_questions_cached(
+    session: Session,
+    document_ids: list[UUID],
+    num_questions: int = 5,
+    difficulty: Difficulty | None = None,
+    question_types: list[QuestionType] | None = None,
+    topics: list[str] | None = None,
+) -> list[QuestionCreate]:
+    """
+    Questions for an exam, reused from the cache when the policy allows.
+
+    On a miss they come from the documents' question banks and the LLM (see
+    `generate_questions_banked`); an exam focused on `topics` is generated
+    from the chunks retrieved for them, bypassing the banks. The cache is
+    read and written in short transactions of its own on `session`'s
+    engine, so nothing is locked while the LLM runs.
+    """
+    texts_by_document = fetch_texts_by_document(session, document_ids, topics)
+    if not settings.EXAM_CACHE_ENABLED:
+        return await generate_questions_banked(
+            session,
+            texts_by_document,
+            num_questions=num_questions,
+            difficulty=difficulty,
+            question_types=question_types,
+            use_bank=not topics,
+        )
+
+    difficulty = normalize_difficulty(difficulty)
+    question_types = normalize_question_types(question_types)
+    key = exam_cache_key(
+        list(texts_by_document.values()),
+        num_questions=num_questions,
+        difficulty=difficulty,
+        question_types=question_types,
+    )
+
+    with Session(session.get_bind()) as cache_session:
+        cached = get_cached_questions(cache_session, key)
+        reused = reuse_questions(cached, num_questions)
+        if reused is not None:
+            seconds_saved = record_hit(cache_session, key)
+            cache_session.commit()
+            logger.info(f"Exam cache hit, saved {seconds_saved:.1f} s of generation")
+            return reused
+
+    start = time.perf_counter()
+    questions = await generate_questions_banked(
+        session,
+        texts_by_document,
+        num_questions=num_questions,
+        difficulty=difficulty,
+        question_types=question_types,
+        use_bank=not topics,
+    )
+    seconds = time.perf_counter() - start
+    logger.info(f"Exam cache miss, generated in {seconds:.1f} s")
+
+    if questions:
+        if settings.EXAM_CACHE_POLICY == "pool":
+            stored = select_questions([cached, questions], len(cached) + len(questions))
+        else:
+            stored = questions
+        with Session(session.get_bind()) as cache_session:
+            store_questions(cache_session, key, stored, seconds)
+            if _prune_schedule.due():
+                prune_exam_cache(cache_session)
+            cache_session.commit()
+    return questions
+
+
+async def pregenerate_default_exam(document_id: str) -> None:
+    """
+    Background task after ingest: generate the default exam of a ready
+    document (default number of medium questions of every type) into the
+    cache as a draft for the first default `/exams/generate` on it.
+
+    Under the "pool" policy EXAM_CACHE_POOL_FACTOR times as many questions
+    are generated, as a hit needs. The draft is generated outside any
+    transaction and skipped if the cache already serves the exam. Failures
+    are only logged.
+    """
+    if not (settings.EXAM_PREGENERATION_ENABLED and settings.EXAM_CACHE_ENABLED):
+        return
+    num_questions: int = GenerateQuestionsBase.model_fields["num_questions"].default
+    difficulty = normalize_difficulty(None)
+    question_types = normalize_question_types(None)
+    try:
+        with Session(engine) as session:
+            document = session.get(Document, document_id)
+            if not document or document.status != DocumentStatus.ready:
+                return
+            texts_by_document = fetch_texts_by_document(session, [document.id])
+            key = exam_cache_key(
+                list(texts_by_document.values()),
+                num_questions=num_questions,
+                difficulty=difficulty,
+                question_types=question_types,
+            )
+            cached = get_cached_questions(session, key)
+        if reuse_questions(cached, num_questions) is not None:
+            return
+
+        if settings.EXAM_CACHE_POLICY == "pool":
+            wanted = math.ceil(num_questions * settings.EXAM_CACHE_POOL_FACTOR)
+        else:
+            wanted = num_questions
+        start = time.perf_counter()
+        questions = await generate_questions_from_texts(
+            list(texts_by_document.values()),
+            num_questions=wanted,
+            difficulty=difficulty,
+            question_types=question_types,
+        )
+        seconds = time.perf_counter() - start
+        if not questions:
+            return
+
+        if settings.EXAM_CACHE_POLICY == "pool":
+            questions = select_questions(
+                [cached, questions], len(cached) + len(questions)
+            )
+        with Session(engine) as session:
+            store_questions(session, key, questions, seconds)
+            if _prune_schedule.due():
+                prune_exam_cache(session)
+            session.commit()
+        logger.info(
+            f"Pre-generated the default exam of document {document_id} "
+            f"in {seconds:.1f} s"
+        )
+    except Exception as e:
+        logger.warning(
+            f"Failed to pre-generate the default exam of document {document_id}: {e}"
+        )
+
+
+def _cutoff() -> datetime:
+    return datetime.now(timezone.utc) - timedelta(
+        seconds=settings.EXAM_CACHE_TTL_SECONDS
+    )
+
+
+def get_cached_questions(session: Session, key: str) -> list[QuestionCreate]:
+    """The unexpired questions stored under `key`, or an empty list."""
+    stmt: Any = select(GeneratedExamCache.questions).where(  # type: ignore[call-overload]
+        GeneratedExamCache.key == key,  # type: ignore[arg-type]
+        GeneratedExamCache.created_at >= _cutoff(),  # type: ignore[arg-type]
+    )
+    questions = session.execute(stmt).scalar_one_or_none() or []
+    return [QuestionCreate.model_validate(question) for question in questions]
+
+
+def record_hit(session: Session, key: str) -> float:
+    """Count a hit; returns the generation time it saved."""
+    stmt: Any = (
+        update(GeneratedExamCache)
+        .where(GeneratedExamCache.key == key)  # type: ignore[arg-type]
+        .values(
+            hits=GeneratedExamCache.hits + 1,
+            last_used_at=datetime.now(timezone.utc),
+        )
+        .returning(
+            GeneratedExamCache.generation_seconds,  # type: ignore[call-overload]
+            GeneratedExamCache.misses,
+        )
+    )
+    row = session.execute(stmt).one()
+    return float(row.generation_seconds / max(row.misses, 1))
+
+
+def store_questions(
+    session: Session,
+    key: str,
+    questions: list[QuestionCreate],
+    generation_seconds: float,
+) -> None:
+    """Store the questions under `key` and count the miss that generated them."""
+    # An expired entry starts over
+    session.execute(
+        delete(GeneratedExamCache).where(
+            GeneratedExamCache.key == key,  # type: ignore[arg-type]
+            GeneratedExamCache.created_at < _cutoff(),  # type: ignore[arg-type]
+        )
+    )
+    now = datetime.now(timezone.utc)
+    stmt = insert(GeneratedExamCache).values(
+        key=key,
+        questions=[question.model_dump(mode="json") for question in questions],
+        misses=1,
+        generation_seconds=generation_seconds,
+        created_at=now,
+        last_used_at=now,
+    )
+    # Another worker may have generated for the same key meanwhile; last write wins.
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["key"],
+        set_={
+            "questions": stmt.excluded.questions,
+            "misses": GeneratedExamCache.misses + 1,
+            "generation_seconds": GeneratedExamCache.generation_seconds
+            + stmt.excluded.generation_seconds,
+            "last_used_at": stmt.excluded.last_used_at,
+        },
+    )
+    session.execute(stmt)
+
+
+def prune_exam_cache(session: Session) -> None:
+    """
+    Delete expired entries and the least recently used entries over the cap,
+    unless another transaction is pruning already.
+    """
+    if not try_transaction_lock(session, "generatedexamcache prune"):
+        return
+    session.execute(
+        delete(GeneratedExamCache).where(
+            GeneratedExamCache.created_at < _cutoff()  # type: ignore[arg-type]
+        )
+    )
+    overflow = (
+        select(GeneratedExamCache.key)  # type: ignore[call-overload]
+        .order_by(GeneratedExamCache.last_used_at.desc())  # type: ignore[attr-defined]
+        .offset(settings.EXAM_CACHE_MAX_ROWS)
+    )
+    session.execute(
+        delete(GeneratedExamCache).where(
+            GeneratedExamCache.key.in_(overflow)  # type: ignore[attr-defined]
+        )
+    )
+
+
+def exam_cache_stats(session: Session) -> ExamCacheStats:
+    """Hits, misses and generation time saved by the unexpired entries."""
+    stmt: Any = select(  # type: ignore[call-overload]
+        func.count(),
+        func.coalesce(func.sum(GeneratedExamCache.hits), 0),
+        func.coalesce(func.sum(GeneratedExamCache.misses), 0),
+        func.coalesce(
+            func.sum(
+                GeneratedExamCache.hits
+                * GeneratedExamCache.generation_seconds
+                / func.greatest(GeneratedExamCache.misses, 1)
+            ),
+            0,
+        ),
+    ).where(
+        GeneratedExamCache.created_at >= _cutoff()  # type: ignore[arg-type]
+    )
+    entries, hits, misses, seconds_saved = session.execute(stmt).one()
+    return ExamCacheStats(
+        entries=entries,
+        hits=hits,
+        misses=misses,
+        seconds_saved=float(seconds_saved),
+    )
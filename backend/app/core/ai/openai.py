@@ -1,53 +1,85 @@
+import asyncio
 import logging
-from typing import Any
+import math
+import re
+from collections.abc import AsyncGenerator, AsyncIterator, Sequence
+from functools import lru_cache
+from typing import Any, TypeVar
 from uuid import UUID
 
 from fastapi import HTTPException
 from langchain_openai import ChatOpenAI
+from numpy.typing import ArrayLike
 from pydantic import ValidationError
 from sqlalchemy import select
 from sqlmodel import Session
 
-from app.core.ai.embeddings import embed_text
-from app.core.ai.retrieval import retrieve_top_k_chunks
+from app.core.ai.context import pack_context
+from app.core.ai.embedding_cache import embed_queries_cached
+from app.core.ai.retrieval import (
+    attach_embeddings,
+    load_linked_chunks,
+    retrieve_top_k_chunks,
+    retrieve_top_k_chunks_batch,
+)
+from app.core.ai.tokens import (
+    count_tokens,
+    prompt_budget,
+    split_by_tokens,
+    token_usage,
+)
+from app.core.ai.vector_cache import get_exam_chunk_matrix
 from app.core.config import settings
 from app.models import (
     Difficulty,
+    DigestEntry,
+    DigestOutput,
     Document,
     ExplanationOutput,
+    ExplanationRequest,
     QuestionCreate,
+    QuestionItem,
     QuestionOutput,
     QuestionType,
+    RetrievalMode,
+    RetrievedChunk,
+    StudyDigest,
 )
 
 # Initialize logging
 logger = logging.getLogger(__name__)
 
-# Maximum characters for extracted text when generating exam questions
-MAX_CHARS = 15_000
+# Bump when the question-generation prompt changes, so cached exams are regenerated
+QUESTION_PROMPT_VERSION = 2
+# Completion tokens of one call, enough for GENERATION_QUESTIONS_PER_CALL questions
+MAX_COMPLETION_TOKENS = 500
+# Questions whose word sets overlap at least this much count as duplicates
+DUPLICATE_QUESTION_JACCARD = 0.8
 
 llm = ChatOpenAI(
-    model="gpt-4o-mini",
+    model=settings.LLM_MODEL,
     temperature=0.5,
-    max_completion_tokens=500,
+    max_completion_tokens=MAX_COMPLETION_TOKENS,
     api_key=settings.OPENAI_API_KEY,  # type: ignore
+    # Report token usage of streamed calls too
+    stream_usage=True,
+    callbacks=[token_usage],
 )
 
-structured_question_llm = llm.with_structured_output(QuestionOutput)
+# Question output comes back as plain JSON and is validated item by item, so an
+# invalid question is dropped instead of failing the whole response, and the
+# output can be parsed while it streams
+structured_question_llm = llm.with_structured_output(QuestionOutput.model_json_schema())
+streaming_question_llm = structured_question_llm
 
+T = TypeVar("T")
 
-def generate_questions_prompt(
-    text: str,
-    num_questions: int = 5,
-    difficulty: Difficulty | None = None,
-    question_types: list[QuestionType] | None = None,
-) -> str:
-    difficulty_str = difficulty.value if difficulty else "medium"
-    question_types_str = (
-        ", ".join(question_types) if question_types else "multiple_choice, true_false"
-    )
-    return f"""
-Generate {num_questions} questions from the following document text.
+
+# Prompts are laid out for the provider's prompt-prefix cache: the static
+# instructions come first, then the document text, and the per-request
+# parameters last, so calls over the same documents share their prefix.
+QUESTION_PROMPT_RULES = """
+You write exam questions about the document text that follows these rules.
 
 Rules (must follow exactly):
 - Each question MUST include:
@@ -89,28 +121,74 @@ Additional constraints:
 - Do NOT rely on outside knowledge
 - Difficulty MUST affect question complexity, not wording alone
 
-Return structured data only.
-
-Document text:
-{text}
-
-Difficulty: {difficulty_str}
-Allowed question types: {question_types_str}
-
 CRITICAL: The question type MUST match the options:
 - If type is "true_false", options MUST be exactly ["True", "False"]
 - If type is "multiple_choice", options MUST have at least 3 different choices (NOT True/False)
 - Do NOT mix types: a true_false question cannot have multiple choice options, and vice versa
 
+Return structured data only.
+
+Document text:
 """
+QUESTION_PROMPT_REQUEST = """
+
+Generate {num_questions} questions from the document text above.
+{focus}Difficulty: {difficulty}
+Allowed question types: {question_types}
+"""
+QUESTION_PROMPT_FOCUS = (
+    "Base them mainly on part {index} of {count} of the text "
+    "(as if it were cut into equal parts), so they differ from the questions "
+    "asked about the other parts.\n"
+)
+
+
+def generate_questions_prompt(
+    text: str,
+    num_questions: int = 5,
+    difficulty: Difficulty | None = None,
+    question_types: list[QuestionType] | None = None,
+    part: tuple[int, int] | None = None,
+) -> str:
+    focus = QUESTION_PROMPT_FOCUS.format(index=part[0], count=part[1]) if part else ""
+    return (
+        QUESTION_PROMPT_RULES
+        + text
+        + QUESTION_PROMPT_REQUEST.format(
+            num_questions=num_questions,
+            focus=focus,
+            difficulty=difficulty.value if difficulty else "medium",
+            question_types=(
+                ", ".join(question_types)
+                if question_types
+                else "multiple_choice, true_false"
+            ),
+        )
+    )
+
+
+def generation_text(extracted_text: str, digest: dict[str, Any] | None) -> str:
+    """
+    The text questions are generated from: the document's digest if it has
+    a non-empty one and GENERATION_USE_DIGESTS is set, else its extracted text.
+    """
+    if digest and settings.GENERATION_USE_DIGESTS:
+        return render_digest(StudyDigest.model_validate(digest)) or extracted_text
+    return extracted_text
 
 
 def fetch_document_texts(session: Session, document_ids: list[UUID]) -> list[str]:
-    """Fetch extracted texts for given document IDs."""
+    """Fetch the generation texts (see `generation_text`) for given document IDs."""
     try:
-        stmt = select(Document.extracted_text).where(Document.id.in_(document_ids))  # type: ignore[attr-defined, call-overload]
+        stmt = select(Document.extracted_text, Document.digest).where(  # type: ignore[call-overload]
+            Document.id.in_(document_ids)  # type: ignore[attr-defined]
+        )
         results = session.exec(stmt).all()
-        texts = [text for (text,) in results if text]
+        texts = [
+            generation_text(extracted_text, digest)
+            for extracted_text, digest in results
+            if extracted_text
+        ]
         if not texts:
             raise ValueError(f"No extracted texts found for documents: {document_ids}")
         return texts
@@ -133,14 +211,35 @@ def validate_and_convert_question_item(q: Any) -> QuestionCreate | None:
         raise
 
 
+def parse_question_item(item: Any) -> QuestionCreate | None:
+    """Validate one question item; invalid items are logged and dropped."""
+    try:
+        return validate_and_convert_question_item(QuestionItem.model_validate(item))
+    except ValueError as ve:
+        logger.warning(f"Skipping invalid question item {item}: {ve}")
+        return None
+
+
+def output_items(llm_output: Any) -> list[Any]:
+    """The question items of a structured output, parsed or plain JSON."""
+    if isinstance(llm_output, dict):
+        return llm_output.get("questions") or []
+    return list(llm_output.questions)
+
+
 def parse_llm_output(llm_output: Any) -> list[QuestionCreate]:
-    """Parse LLM structured output into QuestionCreate list."""
+    """Parse LLM structured output into QuestionCreate list, dropping invalid items."""
+    items = output_items(llm_output)
     questions: list[QuestionCreate] = []
-    for q in llm_output.questions:
-        qc = validate_and_convert_question_item(q)
+    for q in items:
+        qc = parse_question_item(q)
         if qc:
             questions.append(qc)
 
+    if len(questions) < len(items):
+        logger.warning(
+            f"Dropped {len(items) - len(questions)} of {len(items)} invalid question items"
+        )
     return questions
 
 
@@ -158,6 +257,344 @@ def normalize_difficulty(difficulty: Difficulty | None) -> Difficulty:
     return difficulty
 
 
+def split_into_sections(texts: Sequence[str], max_tokens: int) -> list[str]:
+    """
+    Pack document texts into sections of at most `max_tokens` tokens.
+
+    Sections break between paragraphs where possible; a paragraph longer
+    than `max_tokens` is cut into pieces.
+    """
+    paragraphs = [
+        piece
+        for text in texts
+        for paragraph in text.split("\n\n")
+        if paragraph.strip()
+        for piece in split_by_tokens(paragraph, max_tokens)
+    ]
+    sections: list[str] = []
+    current = ""
+    current_tokens = 0
+    for paragraph, tokens in paragraphs:
+        # The blank line joining two paragraphs is one token
+        if current and current_tokens + 1 + tokens > max_tokens:
+            sections.append(current)
+            current = ""
+        if current:
+            current = f"{current}\n\n{paragraph}"
+            current_tokens += 1 + tokens
+        else:
+            current = paragraph
+            current_tokens = tokens
+    if current:
+        sections.append(current)
+    return sections
+
+
+def allocate_questions(
+    section_lengths: Sequence[int], num_questions: int, oversample: float
+) -> list[int]:
+    """Candidates to ask of each section: proportional to length, at least one."""
+    total = sum(section_lengths)
+    wanted = num_questions * oversample
+    return [max(1, math.ceil(wanted * length / total)) for length in section_lengths]
+
+
+def shard_questions(num_questions: int, per_call: int) -> list[int]:
+    """Split `num_questions` evenly into the fewest calls of at most `per_call`."""
+    shards, extra = divmod(num_questions, per_call)
+    num_shards = shards + (1 if extra else 0)
+    base, remainder = divmod(num_questions, num_shards)
+    return [base + 1] * remainder + [base] * (num_shards - remainder)
+
+
+def question_words(question: QuestionCreate) -> frozenset[str]:
+    return frozenset(re.findall(r"\w+", question.question.casefold()))
+
+
+def is_near_duplicate(
+    words: frozenset[str], selected_words: Sequence[frozenset[str]]
+) -> bool:
+    return any(
+        len(words & other) >= DUPLICATE_QUESTION_JACCARD * len(words | other)
+        for other in selected_words
+    )
+
+
+def select_questions(
+    candidates: Sequence[Sequence[QuestionCreate]], num_questions: int
+) -> list[QuestionCreate]:
+    """
+    Pick `num_questions` distinct questions, taking turns across sections.
+
+    Round robin keeps every section represented; a candidate whose words
+    overlap an already picked question by DUPLICATE_QUESTION_JACCARD or
+    more is skipped.
+    """
+    selected: list[QuestionCreate] = []
+    selected_words: list[frozenset[str]] = []
+    for round_ in range(max((len(c) for c in candidates), default=0)):
+        for section in candidates:
+            if len(selected) == num_questions:
+                return selected
+            if round_ >= len(section):
+                continue
+            words = question_words(section[round_])
+            if is_near_duplicate(words, selected_words):
+                continue
+            selected.append(section[round_])
+            selected_words.append(words)
+    return selected
+
+
+async def request_section_questions(prompt: str) -> tuple[list[QuestionCreate], int]:
+    """One LLM call: the valid questions it returned, and how many items were dropped."""
+    try:
+        # async call to the API
+        llm_output = await structured_question_llm.ainvoke(prompt)
+        questions = parse_llm_output(llm_output)
+        return questions, len(output_items(llm_output)) - len(questions)
+    except ValidationError as ve:
+        logger.error(f"Pydantic validation error: {ve}")
+        raise HTTPException(status_code=500, detail=f"LLM validation error: {ve}")
+    except Exception as e:
+        logger.error(f"Error generating questions from LLM: {e}")
+        raise HTTPException(
+            status_code=500, detail=f"Failed to generate questions: {e}"
+        )
+
+
+async def generate_section_questions(
+    text: str,
+    *,
+    num_questions: int,
+    difficulty: Difficulty,
+    question_types: list[QuestionType],
+    part: tuple[int, int] | None = None,
+    follow_ups: int | None = None,
+) -> list[QuestionCreate]:
+    """
+    Questions about `text`, or about `part` (i, n) of it.
+
+    Invalid items in the answer are dropped rather than failing it. If any
+    were, up to `follow_ups` (default GENERATION_SALVAGE_FOLLOW_UPS) more
+    calls ask only for the questions still missing; a failed follow-up
+    keeps the questions salvaged so far.
+    """
+    if follow_ups is None:
+        follow_ups = settings.GENERATION_SALVAGE_FOLLOW_UPS
+    questions: list[QuestionCreate] = []
+    for attempt in range(1 + follow_ups):
+        missing = num_questions - len(questions)
+        prompt = generate_questions_prompt(
+            text,
+            num_questions=missing,
+            difficulty=difficulty,
+            question_types=question_types,
+            part=part,
+        )
+        try:
+            valid, dropped = await request_section_questions(prompt)
+        except HTTPException:
+            if not attempt:
+                raise
+            logger.warning(f"Follow-up for {missing} missing questions failed")
+            break
+        questions.extend(valid)
+        if not dropped or len(questions) >= num_questions:
+            break
+        logger.info(
+            f"Asking for {num_questions - len(questions)} more questions "
+            f"after dropping {dropped} invalid items"
+        )
+    return questions
+
+
+async def stream_section_questions(
+    text: str,
+    *,
+    num_questions: int,
+    difficulty: Difficulty,
+    question_types: list[QuestionType],
+    part: tuple[int, int] | None = None,
+) -> AsyncIterator[QuestionCreate]:
+    """
+    One streamed LLM call: questions about `text`, each yielded as soon as
+    it is complete.
+
+    The structured output is parsed as it streams; an item is complete once
+    the next one has started, and the last one once the stream ends.
+    Invalid items are dropped, and the questions they cost are asked for
+    again once the stream has ended.
+    """
+    prompt = generate_questions_prompt(
+        text,
+        num_questions=num_questions,
+        difficulty=difficulty,
+        question_types=question_types,
+        part=part,
+    )
+
+    items: list[Any] = []
+    parsed = 0
+    yielded = 0
+    try:
+        async for partial in streaming_question_llm.astream(prompt):
+            items = (
+                (partial.get("questions") or []) if isinstance(partial, dict) else []
+            )
+            for item in items[parsed : len(items) - 1]:
+                question = parse_question_item(item)
+                if question:
+                    yielded += 1
+                    yield question
+            parsed = max(parsed, len(items) - 1)
+    except Exception as e:
+        logger.error(f"Error streaming questions from LLM: {e}")
+        raise HTTPException(
+            status_code=500, detail=f"Failed to generate questions: {e}"
+        )
+    for item in items[parsed:]:
+        question = parse_question_item(item)
+        if question:
+            yielded += 1
+            yield question
+
+    # Ask again only for the questions lost to invalid items
+    missing = min(num_questions, len(items)) - yielded
+    if missing > 0 and settings.GENERATION_SALVAGE_FOLLOW_UPS:
+        logger.info(f"Asking for {missing} more questions after dropping invalid items")
+        try:
+            salvaged = await generate_section_questions(
+                text,
+                num_questions=missing,
+                difficulty=difficulty,
+                question_types=question_types,
+                part=part,
+                follow_ups=settings.GENERATION_SALVAGE_FOLLOW_UPS - 1,
+            )
+        except HTTPException:
+            logger.warning(f"Follow-up for {missing} missing questions failed")
+            return
+        for question in salvaged:
+            yield question
+
+
+_STREAM_DONE = object()
+
+
+async def merge_streams(
+    streams: Sequence[AsyncIterator[T]],
+) -> AsyncGenerator[T, None]:
+    """
+    Items of all `streams` in the order they arrive, the streams running
+    concurrently.
+
+    A failed stream is logged and dropped; if every stream fails before
+    any item arrives, the first error is raised. Closing the merged stream
+    cancels the rest.
+    """
+    queue: asyncio.Queue[tuple[Any, BaseException | None]] = asyncio.Queue()
+
+    async def drain(stream: AsyncIterator[T]) -> None:
+        try:
+            async for item in stream:
+                await queue.put((item, None))
+        except Exception as e:
+            await queue.put((_STREAM_DONE, e))
+        else:
+            await queue.put((_STREAM_DONE, None))
+
+    tasks = [asyncio.create_task(drain(stream)) for stream in streams]
+    failures: list[BaseException] = []
+    received = False
+    try:
+        running = len(tasks)
+        while running:
+            item, error = await queue.get()
+            if item is _STREAM_DONE:
+                running -= 1
+                if error is not None:
+                    failures.append(error)
+                continue
+            received = True
+            yield item
+    finally:
+        for task in tasks:
+            task.cancel()
+
+    if failures and not received:
+        raise failures[0]
+    if failures:
+        logger.warning(f"{len(failures)} of {len(tasks)} streams failed to generate")
+
+
+def plan_shards(
+    sections: Sequence[str], num_questions: int
+) -> list[tuple[str, int, tuple[int, int] | None]]:
+    """
+    (section, questions, part) of each call generating candidates for
+    `num_questions` questions over `sections`.
+
+    Each section's share of candidates is sharded into calls of at most
+    GENERATION_QUESTIONS_PER_CALL questions, so every answer fits the
+    completion-token limit; the shards of a section each focus on a
+    different part of it.
+    """
+    counts = allocate_questions(
+        [len(section) for section in sections],
+        num_questions,
+        settings.GENERATION_OVERSAMPLE,
+    )
+    shards: list[tuple[str, int, tuple[int, int] | None]] = []
+    for section, count in zip(sections, counts, strict=True):
+        sizes = shard_questions(count, settings.GENERATION_QUESTIONS_PER_CALL)
+        for i, size in enumerate(sizes, start=1):
+            shards.append((section, size, (i, len(sizes)) if len(sizes) > 1 else None))
+    return shards
+
+
+async def generate_questions_map_reduce(
+    sections: list[str],
+    *,
+    num_questions: int,
+    difficulty: Difficulty,
+    question_types: list[QuestionType],
+) -> list[QuestionCreate]:
+    """
+    Generate candidates for every section concurrently, then select.
+
+    The calls are planned by `plan_shards`, and at most
+    GENERATION_CONCURRENCY of them run at once. A failed shard is logged
+    and skipped; only if every shard fails is the error raised.
+    """
+    semaphore = asyncio.Semaphore(settings.GENERATION_CONCURRENCY)
+
+    async def map_shard(
+        section: str, count: int, part: tuple[int, int] | None
+    ) -> list[QuestionCreate]:
+        async with semaphore:
+            return await generate_section_questions(
+                section,
+                num_questions=count,
+                difficulty=difficulty,
+                question_types=question_types,
+                part=part,
+            )
+
+    results = await asyncio.gather(
+        *(map_shard(*shard) for shard in plan_shards(sections, num_questions)),
+        return_exceptions=True,
+    )
+
+    candidates = [r for r in results if not isinstance(r, BaseException)]
+    failures = [r for r in results if isinstance(r, BaseException)]
+    if not candidates:
+        raise failures[0]
+    if failures:
+        logger.warning(f"{len(failures)} of {len(results)} shards failed to generate")
+    return select_questions(candidates, num_questions)
+
+
 async def generate_questions_from_documents(
     session: Session,
     document_ids: list[UUID],
@@ -165,39 +602,288 @@ async def generate_questions_from_documents(
     difficulty: Difficulty | None = None,
     question_types: list[QuestionType] | None = None,
 ) -> list[QuestionCreate]:
-    """Main function: fetch documents, generate questions via LLM, and return QuestionCreate objects."""
+    """
+    Main function: fetch documents, generate questions via LLM, and return QuestionCreate objects.
+
+    A small exam on material that fits one prompt takes a single call.
+    Longer material is split into sections (at most GENERATION_MAX_SECTIONS,
+    grown beyond GENERATION_SECTION_TOKENS if needed), and more questions
+    than fit one completion are sharded; the calls run concurrently, so any
+    exam takes about the latency of one call.
+    """
     document_texts = fetch_document_texts(session, document_ids)
     if not document_texts:
         return []
+    return await generate_questions_from_texts(
+        document_texts,
+        num_questions=num_questions,
+        difficulty=difficulty,
+        question_types=question_types,
+    )
 
-    # Join texts and truncate to MAX_CHARS
-    combined_text = "\n".join(document_texts)
-    original_length = len(combined_text)
-    if original_length > MAX_CHARS:
-        combined_text = combined_text[:MAX_CHARS]
-        logger.warning(
-            f"Truncated extracted text from {original_length} to {MAX_CHARS} characters"
+
+@lru_cache
+def question_prompt_overhead() -> int:
+    """Tokens of a question prompt without its document text, plus its completion."""
+    template = generate_questions_prompt(
+        "",
+        num_questions=settings.GENERATION_QUESTIONS_PER_CALL,
+        difficulty=Difficulty.medium,
+        question_types=list(QuestionType),
+        part=(1, 1),
+    )
+    return count_tokens(template) + MAX_COMPLETION_TOKENS
+
+
+def split_material(document_texts: list[str]) -> list[str]:
+    """
+    Sections for question generation: at most GENERATION_MAX_SECTIONS,
+    grown beyond GENERATION_SECTION_TOKENS if needed, or the whole text when
+    it fits one. A section never outgrows the model's context window.
+    """
+    total_tokens = sum(count_tokens(text) for text in document_texts)
+    section_tokens = prompt_budget(
+        max(
+            settings.GENERATION_SECTION_TOKENS,
+            math.ceil(total_tokens / settings.GENERATION_MAX_SECTIONS),
+        ),
+        reserved=question_prompt_overhead(),
+    )
+    sections = split_into_sections(document_texts, section_tokens)
+    if len(sections) <= 1:
+        return ["\n".join(document_texts)]
+    return sections
+
+
+async def generate_questions_from_texts(
+    document_texts: list[str],
+    *,
+    num_questions: int,
+    difficulty: Difficulty | None = None,
+    question_types: list[QuestionType] | None = None,
+) -> list[QuestionCreate]:
+    """Generate questions from already fetched document texts."""
+    sections = split_material(document_texts)
+    difficulty = normalize_difficulty(difficulty)
+    question_types = normalize_question_types(question_types)
+
+    if len(sections) == 1 and num_questions <= settings.GENERATION_QUESTIONS_PER_CALL:
+        questions = await generate_section_questions(
+            sections[0],
+            num_questions=num_questions,
+            difficulty=difficulty,
+            question_types=question_types,
         )
+        return select_questions([questions], num_questions)
 
-    prompt = generate_questions_prompt(
-        combined_text,
+    logger.info(
+        f"Generating {num_questions} questions from "
+        f"{sum(len(text) for text in document_texts)} characters "
+        f"in {len(sections)} sections"
+    )
+    return await generate_questions_map_reduce(
+        sections,
         num_questions=num_questions,
-        difficulty=normalize_difficulty(difficulty),
-        question_types=normalize_question_types(question_types),
+        difficulty=difficulty,
+        question_types=question_types,
     )
 
+
+async def stream_questions_from_texts(
+    document_texts: list[str],
+    *,
+    num_questions: int,
+    difficulty: Difficulty | None = None,
+    question_types: list[QuestionType] | None = None,
+) -> AsyncIterator[QuestionCreate]:
+    """
+    Streaming `generate_questions_from_texts`: questions are yielded as
+    soon as any call completes them.
+
+    The calls are planned the same way and run concurrently, but questions
+    are taken first come, first served, skipping near-duplicates, until
+    `num_questions` have been yielded; the remaining calls are cancelled.
+    """
+    sections = split_material(document_texts)
+    difficulty = normalize_difficulty(difficulty)
+    question_types = normalize_question_types(question_types)
+    shards: list[tuple[str, int, tuple[int, int] | None]]
+    if len(sections) == 1 and num_questions <= settings.GENERATION_QUESTIONS_PER_CALL:
+        shards = [(sections[0], num_questions, None)]
+    else:
+        shards = plan_shards(sections, num_questions)
+    semaphore = asyncio.Semaphore(settings.GENERATION_CONCURRENCY)
+
+    async def stream_shard(
+        section: str, count: int, part: tuple[int, int] | None
+    ) -> AsyncIterator[QuestionCreate]:
+        async with semaphore:
+            async for question in stream_section_questions(
+                section,
+                num_questions=count,
+                difficulty=difficulty,
+                question_types=question_types,
+                part=part,
+            ):
+                yield question
+
+    selected_words: list[frozenset[str]] = []
+    questions = merge_streams([stream_shard(*shard) for shard in shards])
     try:
-        # async call to the API
-        llm_output = await structured_question_llm.ainvoke(prompt)
-        return parse_llm_output(llm_output)
-    except ValidationError as ve:
-        logger.error(f"Pydantic validation error: {ve}")
-        raise HTTPException(status_code=500, detail=f"LLM validation error: {ve}")
-    except Exception as e:
-        logger.error(f"Error generating questions from LLM: {e}")
-        raise HTTPException(
-            status_code=500, detail=f"Failed to generate questions: {e}"
+        async for question in questions:
+            words = question_words(question)
+            if is_near_duplicate(words, selected_words):
+                continue
+            selected_words.append(words)
+            yield question
+            if len(selected_words) == num_questions:
+                return
+    finally:
+        await questions.aclose()
+
+
+# ------------------------
+# Study digest LLM
+# ------------------------
+
+digest_llm = ChatOpenAI(
+    model=settings.LLM_MODEL,
+    temperature=0,
+    max_completion_tokens=settings.DIGEST_COMPLETION_TOKENS,
+    api_key=settings.OPENAI_API_KEY,  # type: ignore
+    callbacks=[token_usage],
+)
+structured_digest_llm = digest_llm.with_structured_output(DigestOutput)
+
+DIGEST_PROMPT_RULES = """
+You condense study material into a digest that exam questions will later be
+written from instead of the material itself.
+
+From the numbered chunks of material below, extract:
+- concepts: the key concepts, one short phrase each
+- definitions: every term the material defines, as "term: definition"
+- facts: the specific facts, figures, dates, causes and effects an exam could
+  ask about, one sentence each
+
+For every entry, list in chunks the numbers of the chunks it comes from.
+
+Rules (must follow):
+- Use ONLY the material; do NOT add outside knowledge
+- Keep every testable detail; drop examples, repetition and filler
+- Be concise: the digest must be far shorter than the material
+
+Material:
+"""
+
+
+def generate_digest_prompt(chunks: Sequence[tuple[int, str]]) -> str:
+    """Digest prompt over (number, text) chunks."""
+    return DIGEST_PROMPT_RULES + "\n\n".join(
+        f"[{number}] {text}" for number, text in chunks
+    )
+
+
+def render_digest(digest: DigestOutput) -> str:
+    """The digest as prompt text, without its chunk references."""
+    parts = [
+        f"{title}:\n" + "\n".join(f"- {entry.text}" for entry in entries)
+        for title, entries in (
+            ("Key concepts", digest.concepts),
+            ("Definitions", digest.definitions),
+            ("Facts", digest.facts),
         )
+        if entries
+    ]
+    return "\n\n".join(parts)
+
+
+def pack_chunks(token_counts: Sequence[int], max_tokens: int) -> list[list[int]]:
+    """Indices of consecutive chunks packed into sections of at most `max_tokens`."""
+    sections: list[list[int]] = []
+    current: list[int] = []
+    current_tokens = 0
+    for index, tokens in enumerate(token_counts):
+        if current and current_tokens + tokens > max_tokens:
+            sections.append(current)
+            current = []
+            current_tokens = 0
+        current.append(index)
+        current_tokens += tokens
+    if current:
+        sections.append(current)
+    return sections
+
+
+def merge_digest_entries(
+    entries: Sequence[DigestEntry], num_chunks: int
+) -> list[DigestEntry]:
+    """Drop repeated entries and references to chunks that do not exist."""
+    merged: dict[str, DigestEntry] = {}
+    for entry in entries:
+        chunks = [n for n in entry.chunks if 1 <= n <= num_chunks]
+        key = " ".join(entry.text.casefold().split())
+        if key in merged:
+            merged[key].chunks = sorted({*merged[key].chunks, *chunks})
+        else:
+            merged[key] = DigestEntry(text=entry.text.strip(), chunks=chunks)
+    return list(merged.values())
+
+
+async def build_study_digest(
+    chunk_ids: list[UUID],
+    chunk_texts: list[str],
+    token_counts: Sequence[int | None],
+) -> StudyDigest:
+    """
+    Digest of a document from its chunks, in document order.
+
+    The chunks are numbered from 1 and packed into sections of
+    DIGEST_SECTION_TOKENS, which are digested concurrently and merged. A
+    failed section is logged and skipped; only if every section fails is
+    the error raised.
+    """
+    counts = [
+        count if count is not None else count_tokens(text)
+        for text, count in zip(chunk_texts, token_counts, strict=True)
+    ]
+    sections = pack_chunks(
+        counts,
+        prompt_budget(
+            settings.DIGEST_SECTION_TOKENS,
+            reserved=count_tokens(DIGEST_PROMPT_RULES)
+            + settings.DIGEST_COMPLETION_TOKENS,
+        ),
+    )
+    semaphore = asyncio.Semaphore(settings.GENERATION_CONCURRENCY)
+
+    async def digest_section(indices: list[int]) -> DigestOutput:
+        prompt = generate_digest_prompt([(i + 1, chunk_texts[i]) for i in indices])
+        async with semaphore:
+            output = await structured_digest_llm.ainvoke(prompt)
+        return DigestOutput.model_validate(output)
+
+    results = await asyncio.gather(
+        *(digest_section(indices) for indices in sections), return_exceptions=True
+    )
+    digests = [r for r in results if not isinstance(r, BaseException)]
+    failures = [r for r in results if isinstance(r, BaseException)]
+    if failures and not digests:
+        raise failures[0]
+    if failures:
+        logger.warning(f"{len(failures)} of {len(results)} digest sections failed")
+
+    return StudyDigest(
+        chunk_ids=chunk_ids,
+        concepts=merge_digest_entries(
+            [e for d in digests for e in d.concepts], len(chunk_ids)
+        ),
+        definitions=merge_digest_entries(
+            [e for d in digests for e in d.definitions], len(chunk_ids)
+        ),
+        facts=merge_digest_entries(
+            [e for d in digests for e in d.facts], len(chunk_ids)
+        ),
+    )
 
 
 # ------------------------
@@ -207,16 +893,7 @@ async def generate_questions_from_documents(
 structured_explanation_llm = llm.with_structured_output(ExplanationOutput)
 
 
-def generate_explanation_prompt(
-    *,
-    question: str,
-    correct_answer: str,
-    user_answer: str,
-    context_chunks: list[str],
-) -> str:
-    context = "\n\n".join(context_chunks)
-
-    return f"""
+EXPLANATION_PROMPT_RULES = """
 You are a friendly but academic tutor helping a student learn from a mistake.
 
 Rules (must follow):
@@ -227,10 +904,15 @@ Rules (must follow):
 - Maintain an academic tone while being approachable and supportive
 - Use precise, scholarly language appropriate for educational content
 - Be encouraging but maintain intellectual rigor
+- Avoid introducing new facts
 
 Task:
 Explain why the student's answer is incorrect and what they should remember next time.
 
+Study material:
+"""
+EXPLANATION_PROMPT_REQUEST = """
+
 Question:
 {question}
 
@@ -240,47 +922,49 @@ Correct answer:
 Student answer:
 {user_answer}
 
-Study material:
-{context}
-
-
 Explain clearly using ONLY the material above.
-Avoid introducing new facts.
 """
 
 
-def normalize_uuid_list(values: list[str | UUID]) -> list[UUID]:
-    return [v if isinstance(v, UUID) else UUID(v) for v in values]
-
-
-async def generate_answer_explanation(
+def generate_explanation_prompt(
     *,
-    session: Session,
-    exam: Any,  # ideally Exam
     question: str,
     correct_answer: str,
     user_answer: str,
-) -> ExplanationOutput:
-    if not correct_answer:
-        raise ValueError("Cannot generate explanation without a correct answer")
+    context_chunks: list[str],
+) -> str:
+    return (
+        EXPLANATION_PROMPT_RULES
+        + "\n\n".join(context_chunks)
+        + EXPLANATION_PROMPT_REQUEST.format(
+            question=question,
+            correct_answer=correct_answer,
+            user_answer=user_answer,
+        )
+    )
 
-    source_doc_ids = normalize_uuid_list(exam.source_document_ids)
 
-    query_text = (
+def normalize_uuid_list(values: list[str | UUID]) -> list[UUID]:
+    return [v if isinstance(v, UUID) else UUID(v) for v in values]
+
+
+def build_explanation_query(
+    *, question: str, correct_answer: str, user_answer: str
+) -> str:
+    return (
         f"Question: {question}\n"
         f"Correct answer: {correct_answer}\n"
         f"Student answer: {user_answer}"
     )
 
-    query_embedding = embed_text(query_text)
-
-    context_chunks = retrieve_top_k_chunks(
-        session=session,
-        document_ids=source_doc_ids,
-        query_embedding=query_embedding,
-        k=4,
-    )
 
+async def explain_with_context(
+    *,
+    question: str,
+    correct_answer: str,
+    user_answer: str,
+    context_chunks: list[str],
+) -> ExplanationOutput:
     prompt = generate_explanation_prompt(
         question=question,
         correct_answer=correct_answer,
@@ -297,3 +981,157 @@ async def generate_answer_explanation(
             status_code=500,
             detail="Failed to generate answer explanation",
         )
+
+
+async def generate_answer_explanation(
+    *,
+    session: Session,
+    exam: Any,  # ideally Exam
+    question: str,
+    correct_answer: str,
+    user_answer: str,
+    question_id: UUID | None = None,
+) -> ExplanationOutput:
+    if not correct_answer:
+        raise ValueError("Cannot generate explanation without a correct answer")
+
+    candidates = (
+        load_linked_chunks(session, [question_id]).get(question_id)
+        if question_id is not None
+        else None
+    )
+    if not candidates:
+        source_doc_ids = normalize_uuid_list(exam.source_document_ids)
+        query_text = build_explanation_query(
+            question=question, correct_answer=correct_answer, user_answer=user_answer
+        )
+        [query_embedding] = embed_queries_cached(session, [query_text])
+        candidates = retrieve_top_k_chunks(
+            session=session,
+            document_ids=source_doc_ids,
+            query_embedding=query_embedding,
+            k=settings.EXPLANATION_CONTEXT_CANDIDATES,
+            mode=RetrievalMode(settings.RETRIEVAL_MODE),
+            query_text=query_text,
+        )
+        attach_embeddings(session, candidates)
+
+    return await explain_with_context(
+        question=question,
+        correct_answer=correct_answer,
+        user_answer=user_answer,
+        context_chunks=pack_explanation_context(candidates),
+    )
+
+
+@lru_cache
+def explanation_prompt_overhead() -> int:
+    """Tokens of an explanation prompt without its material, plus its completion."""
+    template = generate_explanation_prompt(
+        question="", correct_answer="", user_answer="", context_chunks=[]
+    )
+    return count_tokens(template) + MAX_COMPLETION_TOKENS
+
+
+def pack_explanation_context(candidates: list[RetrievedChunk]) -> list[str]:
+    return pack_context(
+        candidates,
+        k=settings.EXPLANATION_CONTEXT_CHUNKS,
+        max_tokens=prompt_budget(
+            settings.EXPLANATION_CONTEXT_TOKENS,
+            reserved=explanation_prompt_overhead(),
+        ),
+    )
+
+
+def retrieve_exam_contexts(
+    *,
+    session: Session,
+    exam_id: UUID,
+    document_ids: list[UUID],
+    query_embeddings: ArrayLike,
+    query_texts: list[str],
+    k: int,
+) -> list[list[RetrievedChunk]]:
+    """
+    Top-k context candidates per query, with their embeddings attached.
+
+    Vector mode is served from the in-process exam cache when possible;
+    the other modes always run in Postgres, where their indexes live.
+    """
+    mode = RetrievalMode(settings.RETRIEVAL_MODE)
+    if mode == RetrievalMode.vector and settings.VECTOR_CACHE_ENABLED:
+        matrix = get_exam_chunk_matrix(
+            session, exam_id=exam_id, document_ids=document_ids
+        )
+        if matrix is not None:
+            return matrix.top_k_batch(query_embeddings, k)
+
+    contexts = retrieve_top_k_chunks_batch(
+        session=session,
+        document_ids=document_ids,
+        query_embeddings=query_embeddings,
+        k=k,
+        mode=mode,
+        query_texts=query_texts,
+    )
+    attach_embeddings(session, [chunk for chunks in contexts for chunk in chunks])
+    return contexts
+
+
+async def generate_answer_explanations(
+    *,
+    session: Session,
+    exam: Any,  # ideally Exam
+    requests: list[ExplanationRequest],
+) -> list[ExplanationOutput]:
+    """
+    Explain several wrong answers from the same exam.
+
+    Questions linked to their supporting chunks at generation time take
+    their context from those links. The rest share one embedding request
+    and one retrieval statement; only the LLM calls remain per answer.
+    """
+    if not requests:
+        return []
+    if any(not r.correct_answer for r in requests):
+        raise ValueError("Cannot generate explanation without a correct answer")
+
+    linked = load_linked_chunks(
+        session, [r.question_id for r in requests if r.question_id is not None]
+    )
+    contexts: list[list[RetrievedChunk]] = [
+        linked.get(r.question_id, []) if r.question_id is not None else []
+        for r in requests
+    ]
+
+    unlinked = [i for i, candidates in enumerate(contexts) if not candidates]
+    if unlinked:
+        query_texts = [
+            build_explanation_query(
+                question=requests[i].question,
+                correct_answer=requests[i].correct_answer,
+                user_answer=requests[i].user_answer,
+            )
+            for i in unlinked
+        ]
+        retrieved = retrieve_exam_contexts(
+            session=session,
+            exam_id=exam.id,
+            document_ids=normalize_uuid_list(exam.source_document_ids),
+            query_embeddings=embed_queries_cached(session, query_texts),
+            query_texts=query_texts,
+            k=settings.EXPLANATION_CONTEXT_CANDIDATES,
+        )
+        for i, candidates in zip(unlinked, retrieved, strict=True):
+            contexts[i] = candidates
+
+    return [
+        await explain_with_context(
+            question=r.question,
+            correct_answer=r.correct_answer,
+            user_answer=r.user_answer,
+            context_chunks=pack_explanation_context(candidates),
+        )
+        for r, candidates in zip(requests, contexts, strict=True)
+    ]
@@ -0,0 +1,524 @@
+"""
+Per-document question bank.
+
+Questions generated for an exam are also kept in the bank, by source
+document, difficulty and type, so later exams on the same document can
+reuse them. An exam takes its share of questions from each document's
+bank, split evenly across the requested question types and least served
+first, and the LLM is only called for the types that fall short.
+A question is retired once it has been in QUESTION_BANK_MAX_SERVES exams,
+and after each exam the banks of popular documents that run low are
+topped up in the background.
+"""
+
+import asyncio
+import logging
+import math
+from collections.abc import AsyncIterator, Sequence
+from typing import Any
+from uuid import UUID
+
+from fastapi import HTTPException
+from sqlalchemy import func, insert, select, update
+from sqlmodel import Session
+
+from app.core.ai.clustering import representative_texts
+from app.core.ai.context import join_by_document
+from app.core.ai.embedding_cache import embed_queries_cached
+from app.core.ai.openai import (
+    QUESTION_PROMPT_VERSION,
+    generate_questions_from_texts,
+    generation_text,
+    is_near_duplicate,
+    merge_streams,
+    normalize_difficulty,
+    normalize_question_types,
+    question_words,
+    select_questions,
+    stream_questions_from_texts,
+)
+from app.core.ai.retrieval import retrieve_top_k_chunks_batch
+from app.core.config import settings
+from app.core.db import engine
+from app.models import (
+    BankQuestion,
+    Difficulty,
+    Document,
+    QuestionCreate,
+    QuestionType,
+    RetrievalMode,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def fetch_texts_by_document(
+    session: Session, document_ids: list[UUID], topics: list[str] | None = None
+) -> dict[UUID, str]:
+    """
+    Generation texts (digest or extracted text, see `generation_text`) of
+    the given documents, by id; documents without text are left out, and
+    if none has text yet, generation is refused with a 409.
+
+    Extracted texts longer together than GENERATION_CONTEXT_TOKENS are
+    replaced by representative excerpts (see `representative_texts`). With
+    `topics`, only the chunks retrieved for them are used (see
+    `fetch_topic_texts`), or the whole texts if none are retrieved (the
+    documents are not embedded yet, say).
+    """
+    if topics:
+        texts = fetch_topic_texts(session, document_ids, topics)
+        if texts:
+            return texts
+        logger.info("No chunks retrieved for the topics, using the whole documents")
+    stmt: Any = select(  # type: ignore[call-overload]
+        Document.id, Document.extracted_text, Document.digest
+    ).where(
+        Document.id.in_(document_ids),  # type: ignore[attr-defined]
+        Document.extracted_text.is_not(None),  # type: ignore[union-attr]
+        Document.extracted_text != "",
+    )
+    rows = session.execute(stmt).all()
+    if not rows:
+        raise HTTPException(
+            status_code=409, detail="The documents have no extracted text yet"
+        )
+    texts = {row.id: generation_text(row.extracted_text, row.digest) for row in rows}
+    if not settings.REPRESENTATIVE_CHUNKS_ENABLED:
+        return texts
+    extracted = [row.id for row in rows if texts[row.id] == row.extracted_text]
+    return representative_texts(session, texts, extracted)
+
+
+def fetch_topic_texts(
+    session: Session, document_ids: list[UUID], topics: list[str]
+) -> dict[UUID, str]:
+    """
+    The top TOPIC_CONTEXT_CHUNKS chunks of each topic, by document.
+
+    The topics are embedded and searched in one retrieval statement. A
+    document's chunks are joined in reading order, overlapping chunks
+    merged; documents without a retrieved chunk are left out.
+    """
+    retrieved = retrieve_top_k_chunks_batch(
+        session=session,
+        document_ids=document_ids,
+        query_embeddings=embed_queries_cached(session, topics),
+        k=settings.TOPIC_CONTEXT_CHUNKS,
+        mode=RetrievalMode(settings.RETRIEVAL_MODE),
+        query_texts=topics,
+    )
+    chunks = list(
+        {chunk.id: chunk for chunks in retrieved for chunk in chunks}.values()
+    )
+    texts = join_by_document(chunks)
+    logger.info(
+        f"Retrieved {len(chunks)} chunks of {len(texts)} documents "
+        f"for {len(topics)} topics"
+    )
+    return texts
+
+
+def _bank_filter(
+    document_id: UUID, difficulty: Difficulty, question_types: list[QuestionType]
+) -> list[Any]:
+    return [
+        BankQuestion.document_id == document_id,
+        BankQuestion.difficulty == difficulty.value,
+        BankQuestion.type.in_(question_types),  # type: ignore[attr-defined]
+        BankQuestion.prompt_version == QUESTION_PROMPT_VERSION,
+        BankQuestion.served_count < settings.QUESTION_BANK_MAX_SERVES,
+    ]
+
+
+def to_question_create(row: Any) -> QuestionCreate:
+    return QuestionCreate(
+        question=row.question,
+        type=row.type,
+        options=row.options,
+        correct_answer=row.correct_answer,
+    )
+
+
+def draw_bank_questions(
+    session: Session,
+    document_id: UUID,
+    count: int,
+    *,
+    difficulty: Difficulty,
+    question_types: list[QuestionType],
+) -> list[QuestionCreate]:
+    """
+    Take up to `count` questions from a document's bank, least served first.
+
+    The questions drawn are counted as served in the same statement; rows
+    locked by a concurrent draw are skipped. The caller commits.
+    """
+    drawn = (
+        select(BankQuestion.id)  # type: ignore[call-overload]
+        .where(*_bank_filter(document_id, difficulty, question_types))
+        .order_by(BankQuestion.served_count, func.random())
+        .limit(count)
+        .with_for_update(skip_locked=True)
+    )
+    stmt: Any = (
+        update(BankQuestion)
+        .where(BankQuestion.id.in_(drawn))  # type: ignore[attr-defined]
+        .values(served_count=BankQuestion.served_count + 1)
+        .returning(
+            BankQuestion.question,  # type: ignore[call-overload]
+            BankQuestion.type,
+            BankQuestion.options,
+            BankQuestion.correct_answer,
+        )
+    )
+    return [to_question_create(row) for row in session.execute(stmt)]
+
+
+def add_bank_questions(
+    session: Session,
+    document_id: UUID,
+    questions: list[QuestionCreate],
+    *,
+    difficulty: Difficulty,
+    served: bool,
+) -> list[QuestionCreate]:
+    """
+    Add questions to a document's bank, skipping near-duplicates of the
+    questions it holds, retired ones included. Returns the questions added;
+    the caller commits.
+    """
+    stmt: Any = select(
+        BankQuestion.question,  # type: ignore[call-overload]
+        BankQuestion.type,
+        BankQuestion.options,
+        BankQuestion.correct_answer,
+    ).where(
+        BankQuestion.document_id == document_id,
+        BankQuestion.difficulty == difficulty.value,
+        BankQuestion.prompt_version == QUESTION_PROMPT_VERSION,
+    )
+    existing = [to_question_create(row) for row in session.execute(stmt)]
+    # one list, so select_questions keeps the existing questions first
+    distinct = select_questions([existing + questions], len(existing) + len(questions))
+    added = distinct[len(existing) :]
+    if added:
+        session.execute(
+            insert(BankQuestion),
+            [
+                {
+                    "document_id": document_id,
+                    "difficulty": difficulty.value,
+                    "type": question.type,
+                    "question": question.question,
+                    "options": question.options,
+                    "correct_answer": question.correct_answer,
+                    "prompt_version": QUESTION_PROMPT_VERSION,
+                    "served_count": 1 if served else 0,
+                }
+                for question in added
+            ],
+        )
+    return added
+
+
+def split_questions(weights: Sequence[int], num_questions: int) -> list[int]:
+    """
+    Split `num_questions` in proportion to `weights`, summing exactly to it
+    (largest remainder; ties go to the earlier weight).
+    """
+    total = sum(weights)
+    if total == 0:
+        weights, total = [1] * len(weights), len(weights)
+    quotas = [num_questions * weight / total for weight in weights]
+    counts = [math.floor(quota) for quota in quotas]
+    by_remainder = sorted(range(len(weights)), key=lambda i: counts[i] - quotas[i])
+    for i in by_remainder[: num_questions - sum(counts)]:
+        counts[i] += 1
+    return counts
+
+
+def draw_exam_shares(
+    session: Session,
+    texts_by_document: dict[UUID, str],
+    *,
+    num_questions: int,
+    difficulty: Difficulty,
+    question_types: list[QuestionType],
+) -> tuple[dict[UUID, list[QuestionCreate]], dict[UUID, dict[QuestionType, int]]]:
+    """
+    Draw each document's share of an exam from its bank, in a transaction
+    of its own, split evenly across `question_types` so a bank stocked
+    with one type does not skew the exam. Returns the questions drawn and
+    each document's shortfall by type.
+    """
+    counts = split_questions(
+        [len(text) for text in texts_by_document.values()], num_questions
+    )
+    drawn: dict[UUID, list[QuestionCreate]] = {}
+    shortfalls: dict[UUID, dict[QuestionType, int]] = {}
+    with Session(session.get_bind()) as bank_session:
+        for document_id, count in zip(texts_by_document, counts, strict=True):
+            drawn[document_id] = []
+            type_counts = split_questions([1] * len(question_types), count)
+            for question_type, type_count in zip(
+                question_types, type_counts, strict=True
+            ):
+                if type_count == 0:
+                    continue
+                questions = draw_bank_questions(
+                    bank_session,
+                    document_id,
+                    type_count,
+                    difficulty=difficulty,
+                    question_types=[question_type],
+                )
+                drawn[document_id] += questions
+                if type_count > len(questions):
+                    shortfalls.setdefault(document_id, {})[question_type] = (
+                        type_count - len(questions)
+                    )
+        bank_session.commit()
+
+    logger.info(
+        f"Question bank: {sum(len(q) for q in drawn.values())} questions drawn, "
+        f"{sum(sum(s.values()) for s in shortfalls.values())} to generate"
+    )
+    return drawn, shortfalls
+
+
+async def generate_questions_banked(
+    session: Session,
+    texts_by_document: dict[UUID, str],
+    *,
+    num_questions: int,
+    difficulty: Difficulty | None = None,
+    question_types: list[QuestionType] | None = None,
+    use_bank: bool = True,
+) -> list[QuestionCreate]:
+    """
+    Questions for an exam, from the documents' banks first.
+
+    Each document's share follows its text length. Documents whose bank
+    falls short get an LLM call for the missing questions only, of the
+    types missing, run concurrently, and what is generated is added to
+    their banks. The bank
+    is read and written in short transactions of its own on `session`'s
+    engine, so nothing is locked while the LLM runs.
+
+    Without `use_bank`, e.g. for texts focused on topics, which hold only
+    part of each document, all questions are generated.
+    """
+    if not settings.QUESTION_BANK_ENABLED or not use_bank:
+        return await generate_questions_from_texts(
+            list(texts_by_document.values()),
+            num_questions=num_questions,
+            difficulty=difficulty,
+            question_types=question_types,
+        )
+
+    difficulty = normalize_difficulty(difficulty)
+    question_types = normalize_question_types(question_types)
+    drawn, shortfalls = draw_exam_shares(
+        session,
+        texts_by_document,
+        num_questions=num_questions,
+        difficulty=difficulty,
+        question_types=question_types,
+    )
+    if shortfalls:
+        generated = await asyncio.gather(
+            *(
+                generate_questions_from_texts(
+                    [texts_by_document[document_id]],
+                    num_questions=sum(shortfall.values()),
+                    difficulty=difficulty,
+                    question_types=list(shortfall),
+                )
+                for document_id, shortfall in shortfalls.items()
+            )
+        )
+        with Session(session.get_bind()) as bank_session:
+            for document_id, questions in zip(shortfalls, generated, strict=True):
+                add_bank_questions(
+                    bank_session,
+                    document_id,
+                    questions,
+                    difficulty=difficulty,
+                    served=True,
+                )
+                drawn[document_id] += questions
+            bank_session.commit()
+
+    return select_questions(list(drawn.values()), num_questions)
+
+
+async def stream_questions_banked(
+    session: Session,
+    texts_by_document: dict[UUID, str],
+    *,
+    num_questions: int,
+    difficulty: Difficulty | None = None,
+    question_types: list[QuestionType] | None = None,
+    use_bank: bool = True,
+) -> AsyncIterator[QuestionCreate]:
+    """
+    Streaming `generate_questions_banked`: questions drawn from the banks
+    are yielded at once, then the shortfall as the LLM generates it.
+
+    The shortfalls of all documents are streamed concurrently until the
+    exam is complete. The generated questions yielded join the banks when
+    the stream ends, also if it is closed early.
+    """
+    if not settings.QUESTION_BANK_ENABLED or not use_bank:
+        async for question in stream_questions_from_texts(
+            list(texts_by_document.values()),
+            num_questions=num_questions,
+            difficulty=difficulty,
+            question_types=question_types,
+        ):
+            yield question
+        return
+
+    difficulty = normalize_difficulty(difficulty)
+    question_types = normalize_question_types(question_types)
+    drawn, shortfalls = draw_exam_shares(
+        session,
+        texts_by_document,
+        num_questions=num_questions,
+        difficulty=difficulty,
+        question_types=question_types,
+    )
+    selected = select_questions(list(drawn.values()), num_questions)
+    for question in selected:
+        yield question
+    if not shortfalls:
+        return
+
+    async def stream_shortfall(
+        document_id: UUID, shortfall: dict[QuestionType, int]
+    ) -> AsyncIterator[tuple[UUID, QuestionCreate]]:
+        async for question in stream_questions_from_texts(
+            [texts_by_document[document_id]],
+            num_questions=sum(shortfall.values()),
+            difficulty=difficulty,
+            question_types=list(shortfall),
+        ):
+            yield document_id, question
+
+    selected_words = [question_words(question) for question in selected]
+    served: dict[UUID, list[QuestionCreate]] = {d: [] for d in shortfalls}
+    generated = merge_streams(
+        [stream_shortfall(*shortfall) for shortfall in shortfalls.items()]
+    )
+    try:
+        async for document_id, question in generated:
+            words = question_words(question)
+            if is_near_duplicate(words, selected_words):
+                continue
+            selected_words.append(words)
+            served[document_id].append(question)
+            yield question
+            if len(selected_words) == num_questions:
+                break
+    finally:
+        await generated.aclose()
+        with Session(session.get_bind()) as bank_session:
+            for document_id, questions in served.items():
+                add_bank_questions(
+                    bank_session,
+                    document_id,
+                    questions,
+                    difficulty=difficulty,
+                    served=True,
+                )
+            bank_session.commit()
+
+
+def bank_stock(
+    session: Session,
+    document_ids: list[UUID],
+    *,
+    difficulty: Difficulty,
+    question_types: list[QuestionType],
+) -> dict[UUID, tuple[int, int]]:
+    """Unretired questions and total serves of each document's bank."""
+    stmt: Any = (
+        select(  # type: ignore[call-overload]
+            BankQuestion.document_id,
+            func.count().filter(  # type: ignore[call-overload]
+                BankQuestion.served_count < settings.QUESTION_BANK_MAX_SERVES
+            ),
+            func.sum(BankQuestion.served_count),
+        )
+        .where(
+            BankQuestion.document_id.in_(document_ids),  # type: ignore[attr-defined]
+            BankQuestion.difficulty == difficulty.value,
+            BankQuestion.type.in_(question_types),  # type: ignore[attr-defined]
+            BankQuestion.prompt_version == QUESTION_PROMPT_VERSION,
+        )
+        .group_by(BankQuestion.document_id)
+    )
+    return {
+        document_id: (fresh, int(serves))
+        for document_id, fresh, serves in session.execute(stmt)
+    }
+
+
+async def top_up_question_banks(
+    document_ids: list[UUID],
+    difficulty: Difficulty | None = None,
+    question_types: list[QuestionType] | None = None,
+) -> None:
+    """
+    Background task: refill the banks of popular documents that run low.
+
+    A document is popular once its bank has been served
+    QUESTION_BANK_POPULAR_SERVES times; its bank is refilled to
+    QUESTION_BANK_MIN_STOCK unretired questions. Failures are logged.
+    """
+    if not settings.QUESTION_BANK_ENABLED:
+        return
+    difficulty = normalize_difficulty(difficulty)
+    question_types = normalize_question_types(question_types)
+    try:
+        with Session(engine) as session:
+            texts_by_document = fetch_texts_by_document(session, document_ids)
+            stock = bank_stock(
+                session,
+                list(texts_by_document),
+                difficulty=difficulty,
+                question_types=question_types,
+            )
+        wanted = {
+            document_id: settings.QUESTION_BANK_MIN_STOCK - fresh
+            for document_id, (fresh, serves) in stock.items()
+            if serves >= settings.QUESTION_BANK_POPULAR_SERVES
+            and fresh < settings.QUESTION_BANK_MIN_STOCK
+        }
+        if not wanted:
+            return
+        generated = await asyncio.gather(
+            *(
+                generate_questions_from_texts(
+                    [texts_by_document[document_id]],
+                    num_questions=count,
+                    difficulty=difficulty,
+                    question_types=question_types,
+                )
+                for document_id, count in wanted.items()
+            )
+        )
+        with Session(engine) as session:
+            for document_id, questions in zip(wanted, generated, strict=True):
+                added = add_bank_questions(
+                    session,
+                    document_id,
+                    questions,
+                    difficulty=difficulty,
+                    served=False,
+                )
+                logger.info(f"Topped up question bank of {document_id}: {len(added)}")
+            session.commit()
+    except Exception as e:
+        logger.warning(f"Failed to top up question banks of {document_ids}: {e}")
@@ -0,0 +1,93 @@
+import logging
+from uuid import UUID
+
+from sqlalchemy import delete, exists, insert, select
+from sqlmodel import Session
+
+from app.core.ai.embedding_cache import embed_queries_cached
+from app.core.ai.retrieval import retrieve_top_k_chunks_batch
+from app.core.config import settings
+from app.core.db import engine
+from app.models import DocumentChunk, Exam, Question, QuestionChunkLink, RetrievalMode
+
+logger = logging.getLogger(__name__)
+
+
+def build_question_query(question: Question) -> str:
+    return f"Question: {question.question}\nCorrect answer: {question.correct_answer}"
+
+
+def link_questions_to_chunks(
+    session: Session, *, questions: list[Question], document_ids: list[UUID]
+) -> int:
+    """
+    Store each question's top supporting chunks as `QuestionChunkLink` rows.
+
+    One embedding request and one batched retrieval cover all questions.
+    Existing links of these questions are replaced. Returns the number of
+    links written; the caller commits.
+    """
+    if not questions or not document_ids:
+        return 0
+    has_chunks = session.execute(
+        select(
+            exists().where(
+                DocumentChunk.document_id.in_(document_ids)  # type: ignore[attr-defined]
+            )
+        )
+    ).scalar_one()
+    if not has_chunks:
+        return 0
+
+    query_texts = [build_question_query(question) for question in questions]
+    results = retrieve_top_k_chunks_batch(
+        session=session,
+        document_ids=document_ids,
+        query_embeddings=embed_queries_cached(session, query_texts),
+        k=settings.EXPLANATION_CONTEXT_CANDIDATES,
+        mode=RetrievalMode(settings.RETRIEVAL_MODE),
+        query_texts=query_texts,
+    )
+    rows = [
+        {
+            "question_id": question.id,
+            "chunk_id": chunk.id,
+            "rank": rank,
+            "distance": chunk.distance,
+        }
+        for question, chunks in zip(questions, results, strict=True)
+        for rank, chunk in enumerate(chunks)
+    ]
+
+    session.execute(
+        delete(QuestionChunkLink).where(
+            QuestionChunkLink.question_id.in_([q.id for q in questions])  # type: ignore[attr-defined]
+        )
+    )
+    if rows:
+        session.execute(insert(QuestionChunkLink), rows)
+    return len(rows)
+
+
+def link_exam_questions(exam_id: UUID) -> None:
+    """
+    Background task run after exam generation.
+
+    Failures are only logged: explanations for unlinked questions fall back
+    to embedding and searching at grading time.
+    """
+    with Session(engine) as session:
+        try:
+            exam = session.get(Exam, exam_id)
+            if exam is None:
+                return
+            count = link_questions_to_chunks(
+                session,
+                questions=list(exam.questions),
+                document_ids=[UUID(str(i)) for i in exam.source_document_ids],
+            )
+            session.commit()
+            logger.info(f"Linked {count} chunks to the questions of exam {exam_id}")
+        except Exception as e:
+            session.rollback()
+            logger.warning(f"Failed to link chunks for exam {exam_id}: {e}")
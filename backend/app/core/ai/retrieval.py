@@ -1,30 +1,468 @@
+import logging
+from collections.abc import Sequence
 from typing import Any
 from uuid import UUID
 
-from sqlalchemy import select
-from sqlalchemy.sql import Select
+from numpy.typing import ArrayLike
+from pgvector.sqlalchemy import BIT  # type: ignore[import-untyped]
+from sqlalchemy import (
+    Integer,
+    String,
+    Text,
+    cast,
+    column,
+    func,
+    select,
+    text,
+    true,
+    values,
+)
+from sqlalchemy.dialects.postgresql import TSQUERY
+from sqlalchemy.sql import ColumnElement, Select
 from sqlmodel import Session
 
-from app.models import DocumentChunk
+from app.core.config import settings
+from app.core.vectors import EMBEDDING_DIM, Float32Vector, as_float32
+from app.models import DocumentChunk, QuestionChunkLink, RetrievalMode, RetrievedChunk
+
+logger = logging.getLogger(__name__)
 
 TOP_K = 4
+# pgvector rejects larger hnsw.ef_search values
+MAX_EF_SEARCH = 1000
+# Reciprocal rank fusion constant: score = sum(1 / (RRF_K + rank))
+RRF_K = 60
+# Each side of a hybrid search ranks this many candidates per result
+HYBRID_CANDIDATES_PER_RESULT = 5
+# hnsw.iterative_scan and hnsw.max_scan_tuples exist from this pgvector on
+ITERATIVE_SCAN_VERSION = (0, 8)
+# binary_quantize and Hamming distance on bit vectors exist from this pgvector on
+BINARY_QUANTIZE_VERSION = (0, 7)
+
+# pgvector version of each engine's database, looked up once
+_pgvector_versions: dict[Any, tuple[int, ...]] = {}
+# Engines whose binary mode has fallen back to vector mode
+_binary_fallbacks: set[Any] = set()
+
+
+def pgvector_version(session: Session) -> tuple[int, ...]:
+    """(major, minor) of the vector extension, or (0,) if it is not installed."""
+    bind = session.get_bind()
+    version = _pgvector_versions.get(bind)
+    if version is None:
+        extversion = session.execute(
+            text("SELECT extversion FROM pg_extension WHERE extname = 'vector'")
+        ).scalar_one_or_none()
+        version = (
+            tuple(int(part) for part in extversion.split(".")[:2])
+            if extversion
+            else (0,)
+        )
+        _pgvector_versions[bind] = version
+    return version
+
+
+def supported_mode(session: Session, mode: RetrievalMode) -> RetrievalMode:
+    """
+    `mode`, or vector mode if the database's pgvector cannot run it; the
+    fallback is logged once per engine.
+    """
+    if (
+        mode == RetrievalMode.binary
+        and pgvector_version(session) < BINARY_QUANTIZE_VERSION
+    ):
+        bind = session.get_bind()
+        if bind not in _binary_fallbacks:
+            _binary_fallbacks.add(bind)
+            logger.warning("Binary retrieval needs pgvector >= 0.7, using vector mode")
+        return RetrievalMode.vector
+    return mode
+
+
+def apply_vector_search_settings(
+    session: Session, *, k: int = TOP_K, ef_search: int | None = None
+) -> None:
+    """
+    Tune the HNSW scan for the current transaction (SET LOCAL semantics).
+
+    `hnsw.ef_search` bounds the candidate list and must be at least `k`.
+    With `hnsw.iterative_scan` the index keeps scanning when the
+    `document_id` filter discards candidates, so a selective filter still
+    returns `k` rows (pgvector >= 0.8). Small filtered sets are cheaper through the
+    `document_id` index plus an exact sort; the planner chooses by cost.
+    """
+    ef_search = min(max(ef_search or settings.HNSW_EF_SEARCH, k), MAX_EF_SEARCH)
+    params = {"ef_search": str(ef_search)}
+    configs = ["set_config('hnsw.ef_search', :ef_search, true)"]
+    # Iterative scans need pgvector >= 0.8; older versions reject the
+    # settings, so they are skipped there as with "off".
+    if (
+        settings.HNSW_ITERATIVE_SCAN != "off"
+        and pgvector_version(session) >= ITERATIVE_SCAN_VERSION
+    ):
+        params["iterative_scan"] = settings.HNSW_ITERATIVE_SCAN
+        params["max_scan_tuples"] = str(settings.HNSW_MAX_SCAN_TUPLES)
+        configs += [
+            "set_config('hnsw.iterative_scan', :iterative_scan, true)",
+            "set_config('hnsw.max_scan_tuples', :max_scan_tuples, true)",
+        ]
+    session.execute(text("SELECT " + ", ".join(configs)), params)
+
+
+def _candidate_count(k: int, mode: RetrievalMode, oversample: int | None = None) -> int:
+    if mode == RetrievalMode.hybrid:
+        return k * HYBRID_CANDIDATES_PER_RESULT
+    if mode == RetrievalMode.binary:
+        return k * (oversample or settings.BINARY_QUANTIZATION_OVERSAMPLE)
+    return k
+
+
+def _top_k(
+    mode: RetrievalMode,
+    query_vector: Any,
+    query_text: Any,
+    document_ids: list[UUID],
+    k: int,
+    oversample: int | None,
+) -> Select[Any]:
+    if mode == RetrievalMode.hybrid:
+        return _hybrid_top_k(query_vector, query_text, document_ids, k)
+    if mode == RetrievalMode.binary:
+        return _binary_top_k(query_vector, document_ids, k, oversample)
+    return _vector_top_k(query_vector, document_ids, k)
+
+
+def _vector_top_k(query_vector: Any, document_ids: list[UUID], k: int) -> Select[Any]:
+    distance = DocumentChunk.embedding.cosine_distance(  # type: ignore[union-attr]
+        query_vector
+    ).label("distance")
+    stmt: Select[Any] = (
+        select(  # type: ignore[call-overload]
+            DocumentChunk.id,
+            DocumentChunk.document_id,
+            DocumentChunk.text,
+            DocumentChunk.start_offset,
+            DocumentChunk.token_count,
+            distance,
+        )
+        .where(DocumentChunk.document_id.in_(document_ids))  # type: ignore
+        .order_by(distance)
+        .limit(k)
+    )
+    return stmt
+
+
+def binary_quantized(embedding: Any) -> ColumnElement[Any]:
+    """One bit per dimension (> 0); matches the expression index exactly."""
+    return cast(func.binary_quantize(embedding), BIT(EMBEDDING_DIM))
+
+
+def _binary_top_k(
+    query_vector: Any, document_ids: list[UUID], k: int, oversample: int | None
+) -> Select[Any]:
+    """
+    Two-stage search: Hamming prefilter, then exact cosine rerank.
+
+    The HNSW index over the binary-quantized embeddings is 32x smaller than
+    the float index, so it stays in memory on large tables. It yields
+    `k * oversample` candidates; only those are scored against the full
+    embeddings, and the best `k` by cosine distance are returned.
+    """
+    in_documents = DocumentChunk.document_id.in_(document_ids)  # type: ignore
+    if not isinstance(query_vector, ColumnElement):
+        query_vector = cast(query_vector, Float32Vector(EMBEDDING_DIM))
+    query_bits = func.binary_quantize(query_vector)
+    hamming = binary_quantized(DocumentChunk.embedding).op("<~>")(query_bits)
+    distance = DocumentChunk.embedding.cosine_distance(  # type: ignore[union-attr]
+        query_vector
+    )
+
+    candidates = (
+        select(  # type: ignore[call-overload]
+            DocumentChunk.id,
+            DocumentChunk.document_id,
+            DocumentChunk.text,
+            DocumentChunk.start_offset,
+            DocumentChunk.token_count,
+            distance.label("distance"),
+        )
+        .where(in_documents)
+        .order_by(hamming)
+        .limit(_candidate_count(k, RetrievalMode.binary, oversample))
+        .correlate_except(DocumentChunk)
+        .lateral("candidates")
+    )
+    stmt: Select[Any] = select(candidates).order_by(candidates.c.distance).limit(k)
+    return stmt
+
+
+def any_terms_tsquery(query_text: Any) -> ColumnElement[Any]:
+    """
+    Full-text query matching chunks that contain any of the query's terms.
+
+    `plainto_tsquery` requires every term; a question plus its answers rarely
+    appears whole in one chunk, so the terms are OR-ed and `ts_rank_cd`
+    rewards chunks that match more of them.
+    """
+    all_terms = cast(func.plainto_tsquery("english", query_text), String)
+    return cast(func.replace(all_terms, "&", "|"), TSQUERY)
+
+
+def _hybrid_top_k(
+    query_vector: Any, query_text: Any, document_ids: list[UUID], k: int
+) -> Select[Any]:
+    """
+    Fuse the vector and full-text rankings with reciprocal rank fusion.
+
+    Each side ranks `k * HYBRID_CANDIDATES_PER_RESULT` candidates through its
+    own index (HNSW and GIN); a chunk scores 1 / (RRF_K + rank) per list it
+    appears in. Everything runs as one statement.
+    """
+    candidates = _candidate_count(k, RetrievalMode.hybrid)
+    in_documents = DocumentChunk.document_id.in_(document_ids)  # type: ignore
+    distance = DocumentChunk.embedding.cosine_distance(  # type: ignore[union-attr]
+        query_vector
+    )
+
+    vector_hits = (
+        select(DocumentChunk.id, distance.label("distance"))  # type: ignore[call-overload]
+        .where(in_documents)
+        .order_by(distance)
+        .limit(candidates)
+        .correlate_except(DocumentChunk)
+        .lateral("vector_hits")
+    )
+    vector_ranked = select(
+        vector_hits.c.id,
+        func.row_number().over(order_by=vector_hits.c.distance).label("rank"),
+    ).lateral("vector_ranked")
+
+    tsquery = any_terms_tsquery(query_text)
+    lexical_score = func.ts_rank_cd(DocumentChunk.search_vector, tsquery)
+    lexical_hits = (
+        select(DocumentChunk.id, lexical_score.label("score"))  # type: ignore[call-overload]
+        .where(in_documents, DocumentChunk.search_vector.op("@@")(tsquery))  # type: ignore[union-attr]
+        .order_by(lexical_score.desc())
+        .limit(candidates)
+        .correlate_except(DocumentChunk)
+        .lateral("lexical_hits")
+    )
+    lexical_ranked = select(
+        lexical_hits.c.id,
+        func.row_number().over(order_by=lexical_hits.c.score.desc()).label("rank"),
+    ).lateral("lexical_ranked")
+
+    rrf_score = func.coalesce(
+        1.0 / (RRF_K + vector_ranked.c.rank), 0.0
+    ) + func.coalesce(1.0 / (RRF_K + lexical_ranked.c.rank), 0.0)
+    fused = (
+        select(
+            func.coalesce(vector_ranked.c.id, lexical_ranked.c.id).label("id"),
+            rrf_score.label("rrf_score"),
+        )
+        .select_from(
+            vector_ranked.join(
+                lexical_ranked, vector_ranked.c.id == lexical_ranked.c.id, full=True
+            )
+        )
+        .lateral("fused")
+    )
+
+    stmt: Select[Any] = (
+        select(  # type: ignore[call-overload]
+            DocumentChunk.id,
+            DocumentChunk.document_id,
+            DocumentChunk.text,
+            DocumentChunk.start_offset,
+            DocumentChunk.token_count,
+            distance.label("distance"),
+            fused.c.rrf_score,
+        )
+        .join(fused, fused.c.id == DocumentChunk.id)
+        .order_by(fused.c.rrf_score.desc(), distance)
+        .limit(k)
+    )
+    return stmt
 
 
 def retrieve_top_k_chunks(
     *,
     session: Session,
     document_ids: list[UUID],
-    query_embedding: list[float],
+    query_embedding: ArrayLike,
     k: int = TOP_K,
-) -> list[str]:
+    ef_search: int | None = None,
+    min_similarity: float | None = None,
+    mode: RetrievalMode = RetrievalMode.vector,
+    query_text: str | None = None,
+    oversample: int | None = None,
+) -> list[RetrievedChunk]:
+    """
+    Return the `k` best chunks for a query.
+
+    In vector mode chunks are ordered by cosine distance to
+    `query_embedding`; in hybrid mode by the fused vector and full-text
+    rank, which also needs `query_text`. Binary mode reranks
+    `k * oversample` Hamming-distance candidates by cosine distance
+    (`oversample` defaults to BINARY_QUANTIZATION_OVERSAMPLE). Only the columns needed downstream
+    are selected, so the 1536-float embeddings are never sent over the wire
+    or deserialised. Chunks below `min_similarity` (1 - cosine distance) are
+    dropped after the search. Binary mode falls back to vector mode where
+    pgvector predates 0.7 (see `supported_mode`).
+    """
+    if mode == RetrievalMode.hybrid and not query_text:
+        raise ValueError("Hybrid retrieval requires query_text")
+    mode = supported_mode(session, mode)
+
+    apply_vector_search_settings(
+        session, k=_candidate_count(k, mode, oversample), ef_search=ef_search
+    )
+
+    stmt = _top_k(
+        mode, as_float32(query_embedding), query_text or "", document_ids, k, oversample
+    )
+
+    chunks = [
+        RetrievedChunk(
+            id=row.id,
+            document_id=row.document_id,
+            text=row.text,
+            distance=row.distance,
+            start_offset=row.start_offset,
+            token_count=row.token_count,
+        )
+        for row in session.execute(stmt).all()
+    ]
+    if min_similarity is not None:
+        chunks = [chunk for chunk in chunks if chunk.similarity >= min_similarity]
+    return chunks
+
+
+def retrieve_top_k_chunks_batch(
+    *,
+    session: Session,
+    document_ids: list[UUID],
+    query_embeddings: ArrayLike,
+    k: int = TOP_K,
+    ef_search: int | None = None,
+    mode: RetrievalMode = RetrievalMode.vector,
+    query_texts: list[str] | None = None,
+    oversample: int | None = None,
+) -> list[list[RetrievedChunk]]:
+    """
+    Top-k search for several queries in one round trip.
+
+    The queries go in as a VALUES list and each one drives its own
+    LATERAL top-k subquery, so every query still gets an index-ordered
+    search. Hybrid mode needs one entry in `query_texts` per embedding.
+    Results are returned in the order of `query_embeddings`.
+    """
+    embeddings = as_float32(query_embeddings)
+    if embeddings.size == 0:
+        return []
+    if mode == RetrievalMode.hybrid and (
+        query_texts is None or len(query_texts) != len(embeddings)
+    ):
+        raise ValueError("Hybrid retrieval requires one query text per embedding")
+    mode = supported_mode(session, mode)
+
+    apply_vector_search_settings(
+        session, k=_candidate_count(k, mode, oversample), ef_search=ef_search
+    )
+
+    queries = values(
+        column("query_index", Integer),
+        column("embedding", Float32Vector()),
+        column("query_text", Text),
+        name="queries",
+    ).data(
+        [
+            (i, embedding, query_texts[i] if query_texts else "")
+            for i, embedding in enumerate(embeddings)
+        ]
+    )
+    query_vector: ColumnElement[Any] = cast(
+        queries.c.embedding, Float32Vector(embeddings.shape[1])
+    )
+    top_k = _top_k(
+        mode, query_vector, queries.c.query_text, document_ids, k, oversample
+    ).lateral("top_k")
+    rank: ColumnElement[Any] = (
+        top_k.c.rrf_score.desc() if mode == RetrievalMode.hybrid else top_k.c.distance
+    )
     stmt: Select[Any] = (
-        select(DocumentChunk)
-        .where(DocumentChunk.document_id.in_(document_ids))  # type: ignore
-        .order_by(
-            DocumentChunk.embedding.cosine_distance(query_embedding)  # type: ignore
+        select(queries.c.query_index, top_k)
+        .select_from(queries.join(top_k, true()))
+        .order_by(queries.c.query_index, rank)
+    )
+
+    results: list[list[RetrievedChunk]] = [[] for _ in embeddings]
+    for row in session.execute(stmt).all():
+        results[row.query_index].append(
+            RetrievedChunk(
+                id=row.id,
+                document_id=row.document_id,
+                text=row.text,
+                distance=row.distance,
+                start_offset=row.start_offset,
+                token_count=row.token_count,
+            )
         )
-        .limit(k)
+    return results
+
+
+def attach_embeddings(session: Session, chunks: Sequence[RetrievedChunk]) -> None:
+    """Load the embeddings of `chunks` that lack one, in one query."""
+    missing = {chunk.id for chunk in chunks if chunk.embedding is None}
+    if not missing:
+        return
+    stmt: Any = select(DocumentChunk.id, DocumentChunk.embedding).where(  # type: ignore[call-overload]
+        DocumentChunk.id.in_(missing)  # type: ignore[attr-defined]
     )
+    embeddings = {row.id: row.embedding for row in session.execute(stmt).all()}
+    for chunk in chunks:
+        if chunk.embedding is None:
+            chunk.embedding = embeddings.get(chunk.id)
 
-    result = session.execute(stmt).scalars().all()
-    return [chunk.text for chunk in result]
+
+def load_linked_chunks(
+    session: Session, question_ids: Sequence[UUID]
+) -> dict[UUID, list[RetrievedChunk]]:
+    """
+    The chunks linked to each question at generation time, closest first.
+
+    A primary-key lookup through `QuestionChunkLink`; embeddings are
+    included so the context packer can run MMR. Questions without links
+    are missing from the result.
+    """
+    if not question_ids:
+        return {}
+    stmt: Any = (
+        select(  # type: ignore[call-overload]
+            QuestionChunkLink.question_id,
+            QuestionChunkLink.distance,
+            DocumentChunk.id,
+            DocumentChunk.document_id,
+            DocumentChunk.text,
+            DocumentChunk.start_offset,
+            DocumentChunk.token_count,
+            DocumentChunk.embedding,
+        )
+        .join(DocumentChunk, DocumentChunk.id == QuestionChunkLink.chunk_id)
+        .where(QuestionChunkLink.question_id.in_(question_ids))  # type: ignore[attr-defined]
+        .order_by(QuestionChunkLink.question_id, QuestionChunkLink.rank)
+    )
+    linked: dict[UUID, list[RetrievedChunk]] = {}
+    for row in session.execute(stmt).all():
+        linked.setdefault(row.question_id, []).append(
+            RetrievedChunk(
+                id=row.id,
+                document_id=row.document_id,
+                text=row.text,
+                distance=row.distance,
+                start_offset=row.start_offset,
+                token_count=row.token_count,
+                embedding=row.embedding,
+            )
+        )
+    return linked
@@ -0,0 +1,165 @@
+"""
+Token accounting for LLM prompts.
+
+Prompt budgets are counted with the model's own tokenizer (tiktoken),
+loaded once per process. tiktoken downloads an encoding the first time it
+is used; where that fails, counts fall back to an estimate of four
+characters a token rather than failing, and the download is tried again
+after ENCODING_RETRY_SECONDS.
+"""
+
+import logging
+import threading
+import time
+from collections.abc import Mapping
+from typing import Any
+
+import tiktoken
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.outputs import LLMResult
+
+from app.core.config import settings
+from app.models import LLMTokenStats
+
+logger = logging.getLogger(__name__)
+
+# Context windows (prompt and completion tokens) of the chat models in use
+CONTEXT_WINDOWS = {
+    "gpt-4o": 128_000,
+    "gpt-4o-mini": 128_000,
+    "gpt-4.1": 1_047_576,
+    "gpt-4.1-mini": 1_047_576,
+    "gpt-3.5-turbo": 16_385,
+}
+# Assumed for a model missing above
+DEFAULT_CONTEXT_WINDOW = 8_192
+# Encoding of models tiktoken does not know
+DEFAULT_ENCODING = "o200k_base"
+CHARS_PER_TOKEN = 4
+# Seconds before loading a tokenizer that failed to load is tried again
+ENCODING_RETRY_SECONDS = 300
+
+# Loaded tokenizers by model, and when loading the others last failed
+_encodings: dict[str, tiktoken.Encoding] = {}
+_encoding_failures: dict[str, float] = {}
+
+
+def get_encoding(model: str) -> tiktoken.Encoding | None:
+    """
+    The tokenizer of `model`, or None if it cannot be loaded. Only loaded
+    tokenizers are kept, so a transient failure is not remembered for good.
+    """
+    encoding = _encodings.get(model)
+    if encoding is not None:
+        return encoding
+    failed_at = _encoding_failures.get(model)
+    if failed_at is not None and time.monotonic() - failed_at < ENCODING_RETRY_SECONDS:
+        return None
+    try:
+        try:
+            name = tiktoken.encoding_name_for_model(model)
+        except KeyError:
+            name = DEFAULT_ENCODING
+        encoding = tiktoken.get_encoding(name)
+    except Exception as e:
+        _encoding_failures[model] = time.monotonic()
+        logger.warning(f"No tokenizer for {model}, estimating token counts: {e}")
+        return None
+    _encodings[model] = encoding
+    _encoding_failures.pop(model, None)
+    return encoding
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count for English text (about four characters a token)."""
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def count_tokens(text: str, model: str | None = None) -> int:
+    """Tokens of `text` for `model` (default LLM_MODEL)."""
+    encoding = get_encoding(model or settings.LLM_MODEL)
+    if encoding is None:
+        return estimate_tokens(text)
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def split_by_tokens(
+    text: str, max_tokens: int, model: str | None = None
+) -> list[tuple[str, int]]:
+    """Cut `text` into pieces of at most `max_tokens` tokens, with their counts."""
+    encoding = get_encoding(model or settings.LLM_MODEL)
+    if encoding is None:
+        step = max_tokens * CHARS_PER_TOKEN
+        pieces = [text[start : start + step] for start in range(0, len(text), step)]
+        return [(piece, estimate_tokens(piece)) for piece in pieces]
+    tokens = encoding.encode(text, disallowed_special=())
+    return [
+        (encoding.decode(piece), len(piece))
+        for piece in (
+            tokens[start : start + max_tokens]
+            for start in range(0, len(tokens), max_tokens)
+        )
+    ]
+
+
+def truncate_to_tokens(text: str, max_tokens: int, model: str | None = None) -> str:
+    """The longest prefix of `text` within `max_tokens` tokens."""
+    if max_tokens <= 0:
+        return ""
+    pieces = split_by_tokens(text, max_tokens, model)
+    return pieces[0][0] if pieces else ""
+
+
+def prompt_budget(max_tokens: int, *, reserved: int, model: str | None = None) -> int:
+    """
+    Tokens a prompt may spend on material: `max_tokens`, or less if the
+    model's context window cannot hold that besides the `reserved` tokens of
+    the prompt template and the completion.
+    """
+    window = CONTEXT_WINDOWS.get(model or settings.LLM_MODEL, DEFAULT_CONTEXT_WINDOW)
+    return max(0, min(max_tokens, window - reserved))
+
+
+class TokenUsageLogger(BaseCallbackHandler):
+    """
+    Logs the prompt, cached prompt and completion tokens of every LLM call,
+    and keeps totals for this worker.
+
+    Cached tokens are the prompt prefix the provider served from its
+    prompt cache, billed and processed at a fraction of the cost.
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+        self._lock = threading.Lock()
+        self._stats = LLMTokenStats()
+
+    def on_llm_end(self, response: LLMResult, **_: Any) -> None:
+        for generations in response.generations:
+            for generation in generations:
+                message = getattr(generation, "message", None)
+                usage = getattr(message, "usage_metadata", None)
+                if usage:
+                    self.record(usage)
+
+    def record(self, usage: Mapping[str, Any]) -> None:
+        prompt_tokens = usage.get("input_tokens", 0)
+        completion_tokens = usage.get("output_tokens", 0)
+        cached_tokens = (usage.get("input_token_details") or {}).get("cache_read") or 0
+        logger.info(
+            f"LLM call used {prompt_tokens} prompt ({cached_tokens} cached) and "
+            f"{completion_tokens} completion tokens"
+        )
+        with self._lock:
+            self._stats.calls += 1
+            self._stats.prompt_tokens += prompt_tokens
+            self._stats.cached_prompt_tokens += cached_tokens
+            self._stats.completion_tokens += completion_tokens
+
+    def stats(self) -> LLMTokenStats:
+        with self._lock:
+            return self._stats.model_copy()
+
+
+# Attached to the chat model, so every call is counted
+token_usage = TokenUsageLogger()
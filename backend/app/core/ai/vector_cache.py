@@ -0,0 +1,199 @@
+import logging
+from collections.abc import Iterable
+from datetime import datetime
+from typing import Any
+from uuid import UUID
+
+import numpy as np
+from numpy.typing import ArrayLike, NDArray
+from sqlalchemy import func, select
+from sqlmodel import Session
+
+from app.core.cache import LRUCache
+from app.core.config import settings
+from app.core.vectors import EMBEDDING_DIM, as_float32, fetch_binary
+from app.models import Document, RetrievedChunk
+
+logger = logging.getLogger(__name__)
+
+# The `updated_at` of each of a set of documents; a deleted document is
+# missing, so any change to the set's chunks changes its versions.
+DocumentVersions = frozenset[tuple[UUID, datetime]]
+
+
+class ChunkMatrix:
+    """
+    The chunks of one exam's source documents, held in memory.
+
+    Embeddings are stacked into a C-contiguous float32 matrix with unit-norm
+    rows, so cosine similarity against a query is one matrix-vector product.
+    """
+
+    def __init__(
+        self,
+        *,
+        source_document_ids: Iterable[UUID],
+        chunk_ids: list[UUID],
+        document_ids: list[UUID],
+        texts: list[str],
+        start_offsets: list[int | None],
+        token_counts: list[int | None],
+        embeddings: NDArray[np.float32],
+        versions: DocumentVersions = frozenset(),
+    ) -> None:
+        self.chunk_ids = chunk_ids
+        self.document_ids = document_ids
+        self.texts = texts
+        self.start_offsets = start_offsets
+        self.token_counts = token_counts
+        self.source_document_ids = frozenset(source_document_ids)
+        self.versions = versions
+        self.matrix = normalize_rows(embeddings)
+
+    def __len__(self) -> int:
+        return len(self.chunk_ids)
+
+    @property
+    def nbytes(self) -> int:
+        # The matrix dominates; texts are counted roughly.
+        return int(self.matrix.nbytes) + sum(len(t) for t in self.texts)
+
+    def top_k(self, query_embedding: ArrayLike, k: int) -> list[RetrievedChunk]:
+        return self.top_k_batch(np.atleast_2d(as_float32(query_embedding)), k)[0]
+
+    def top_k_batch(
+        self, query_embeddings: ArrayLike, k: int
+    ) -> list[list[RetrievedChunk]]:
+        embeddings = as_float32(query_embeddings)
+        if embeddings.size == 0:
+            return []
+        if len(self) == 0:
+            return [[] for _ in embeddings]
+
+        queries = normalize_rows(embeddings)
+        # (n_chunks, n_queries) cosine similarities in one product
+        similarities = self.matrix @ queries.T
+        k = min(k, len(self))
+
+        results: list[list[RetrievedChunk]] = []
+        for column in similarities.T:
+            top = np.argpartition(-column, k - 1)[:k]
+            top = top[np.argsort(-column[top])]
+            results.append([self._chunk(int(i), float(column[i])) for i in top])
+        return results
+
+    def _chunk(self, index: int, similarity: float) -> RetrievedChunk:
+        return RetrievedChunk(
+            id=self.chunk_ids[index],
+            document_id=self.document_ids[index],
+            text=self.texts[index],
+            distance=1.0 - similarity,
+            start_offset=self.start_offsets[index],
+            token_count=self.token_counts[index],
+            embedding=self.matrix[index],
+        )
+
+
+def normalize_rows(matrix: NDArray[np.float32]) -> NDArray[np.float32]:
+    matrix = np.atleast_2d(np.asarray(matrix, dtype=np.float32))
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    normalized: NDArray[np.float32] = np.ascontiguousarray(
+        matrix / np.maximum(norms, np.float32(1e-12)), dtype=np.float32
+    )
+    return normalized
+
+
+def document_versions(session: Session, document_ids: list[UUID]) -> DocumentVersions:
+    """
+    Version stamp of the documents' chunks, checked by the worker-local
+    caches on every lookup: invalidation only reaches the worker that
+    changed a document, the stamp reaches them all.
+    """
+    stmt: Any = select(Document.id, Document.updated_at).where(  # type: ignore[call-overload]
+        Document.id.in_(document_ids)  # type: ignore[attr-defined]
+    )
+    return frozenset((row.id, row.updated_at) for row in session.execute(stmt).all())
+
+
+def load_chunk_matrix(
+    session: Session, document_ids: list[UUID], versions: DocumentVersions = frozenset()
+) -> ChunkMatrix:
+    # Binary results: each embedding arrives as 6 KiB of raw float32 rather
+    # than ~20 KB of text parsed one float at a time.
+    rows = fetch_binary(
+        session,
+        "SELECT id, document_id, text, start_offset, token_count, embedding "
+        "FROM documentchunk "
+        "WHERE document_id = ANY(%s) AND embedding IS NOT NULL",
+        [document_ids],
+    )
+    embeddings = (
+        np.vstack([row.embedding for row in rows])
+        if rows
+        else np.empty((0, EMBEDDING_DIM), dtype=np.float32)
+    )
+    return ChunkMatrix(
+        source_document_ids=document_ids,
+        chunk_ids=[row.id for row in rows],
+        document_ids=[row.document_id for row in rows],
+        texts=[row.text for row in rows],
+        start_offsets=[row.start_offset for row in rows],
+        token_counts=[row.token_count for row in rows],
+        embeddings=embeddings,
+        versions=versions,
+    )
+
+
+def estimate_matrix_bytes(session: Session, document_ids: list[UUID]) -> int:
+    stmt: Any = select(func.coalesce(func.sum(Document.chunk_count), 0)).where(
+        Document.id.in_(document_ids)  # type: ignore[attr-defined]
+    )
+    return int(session.execute(stmt).scalar_one()) * EMBEDDING_DIM * 4
+
+
+# Keyed by exam id: everyone taking the same exam shares one matrix.
+_exam_matrices: LRUCache[UUID, ChunkMatrix] = LRUCache(
+    max_bytes=settings.VECTOR_CACHE_MAX_BYTES,
+    ttl_seconds=settings.VECTOR_CACHE_TTL_SECONDS,
+    sizeof=lambda matrix: matrix.nbytes,
+)
+
+
+def get_exam_chunk_matrix(
+    session: Session, *, exam_id: UUID, document_ids: list[UUID]
+) -> ChunkMatrix | None:
+    """
+    Return the cached chunk matrix for an exam, loading it on a miss or
+    when a source document has changed since (see `document_versions`).
+
+    Returns None when the exam's chunks would not fit the cache budget, so
+    the caller falls back to searching in Postgres.
+    """
+    versions = document_versions(session, document_ids)
+    matrix = _exam_matrices.get(exam_id)
+    if matrix is not None and matrix.versions == versions:
+        return matrix
+
+    if estimate_matrix_bytes(session, document_ids) > settings.VECTOR_CACHE_MAX_BYTES:
+        _exam_matrices.pop(exam_id)
+        return None
+
+    matrix = load_chunk_matrix(session, document_ids, versions)
+    _exam_matrices.set(exam_id, matrix)
+    logger.info(
+        f"Cached {len(matrix)} chunk vectors for exam {exam_id} "
+        f"({matrix.nbytes / 1024 / 1024:.1f} MiB)"
+    )
+    return matrix
+
+
+def invalidate_document(document_id: UUID | str) -> None:
+    """Drop every cached exam matrix built from `document_id`."""
+    document_uuid = document_id if isinstance(document_id, UUID) else UUID(document_id)
+    _exam_matrices.discard_where(
+        lambda _, matrix: document_uuid in matrix.source_document_ids
+    )
+
+
+def invalidate_exam(exam_id: UUID) -> None:
+    _exam_matrices.pop(exam_id)
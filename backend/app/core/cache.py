@@ -0,0 +1,143 @@
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Callable, Hashable
+from typing import Generic, TypeVar
+
+from sqlalchemy import text
+from sqlmodel import Session
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+
+class LRUCache(Generic[K, V]):
+    """
+    Thread-safe, worker-local LRU cache.
+
+    Bounded by entry count (`max_items`), by total size (`max_bytes`, with
+    `sizeof` giving each value's size) or both. Entries older than
+    `ttl_seconds` are treated as missing. A value larger than `max_bytes`
+    on its own is not stored.
+    """
+
+    def __init__(
+        self,
+        *,
+        max_items: int | None = None,
+        max_bytes: int | None = None,
+        ttl_seconds: float | None = None,
+        sizeof: Callable[[V], int] | None = None,
+    ) -> None:
+        if max_bytes is not None and sizeof is None:
+            raise ValueError("max_bytes requires a sizeof function")
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._sizeof = sizeof
+        self._entries: OrderedDict[K, tuple[V, int, float]] = OrderedDict()
+        self._nbytes = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: object) -> bool:
+        return key in self._entries
+
+    @property
+    def nbytes(self) -> int:
+        return self._nbytes
+
+    def get(self, key: K) -> V | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, _, stored_at = entry
+            if self._expired(stored_at):
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: K, value: V) -> bool:
+        """Store `value`; returns False if it can never fit the budget."""
+        size = self._sizeof(value) if self._sizeof else 0
+        if self.max_bytes is not None and size > self.max_bytes:
+            return False
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, size, time.monotonic())
+            self._nbytes += size
+            self._evict()
+        return True
+
+    def pop(self, key: K) -> V | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._remove(key)
+            return entry[0]
+
+    def discard_where(self, predicate: Callable[[K, V], bool]) -> int:
+        """Remove every entry matching `predicate`; returns how many."""
+        with self._lock:
+            keys = [k for k, (v, _, _) in self._entries.items() if predicate(k, v)]
+            for key in keys:
+                self._remove(key)
+            return len(keys)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._nbytes = 0
+
+    def _expired(self, stored_at: float) -> bool:
+        return (
+            self.ttl_seconds is not None
+            and time.monotonic() - stored_at > self.ttl_seconds
+        )
+
+    def _remove(self, key: K) -> None:
+        _, size, _ = self._entries.pop(key)
+        self._nbytes -= size
+
+    def _evict(self) -> None:
+        while self._entries and (
+            (self.max_items is not None and len(self._entries) > self.max_items)
+            or (self.max_bytes is not None and self._nbytes > self.max_bytes)
+        ):
+            self._remove(next(iter(self._entries)))
+
+
+class EveryNth:
+    """
+    Thread-safe, worker-local schedule for work done on one call in `n`,
+    starting with the first, such as pruning a shared cache table.
+    """
+
+    def __init__(self, n: int) -> None:
+        self.n = max(1, n)
+        self._calls = 0
+        self._lock = threading.Lock()
+
+    def due(self) -> bool:
+        with self._lock:
+            due = self._calls % self.n == 0
+            self._calls += 1
+            return due
+
+
+def try_transaction_lock(session: Session, name: str) -> bool:
+    """
+    Take the Postgres advisory lock `name` until the session's transaction
+    ends; False, without waiting, if another transaction holds it.
+    """
+    return bool(
+        session.execute(
+            text("SELECT pg_try_advisory_xact_lock(hashtext(:name))"), {"name": name}
+        ).scalar_one()
+    )
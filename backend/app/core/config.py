@@ -61,6 +61,96 @@ class Settings(BaseSettings):
     S3_BUCKET: str = "test-bucket"
 
     OPENAI_API_KEY: str = ""
+    # Chat model; prompts are budgeted with its tokenizer and context window
+    LLM_MODEL: str = "gpt-4o-mini"
+
+    # pgvector HNSW search tuning, applied per retrieval query (SET LOCAL)
+    HNSW_EF_SEARCH: int = 100
+    HNSW_ITERATIVE_SCAN: Literal["off", "strict_order", "relaxed_order"] = (
+        "strict_order"
+    )
+    HNSW_MAX_SCAN_TUPLES: int = 20_000
+    # Chunk retrieval for answer explanations (see models.RetrievalMode)
+    RETRIEVAL_MODE: Literal["vector", "hybrid", "binary"] = "vector"
+    # Binary mode reranks k * oversample Hamming candidates (needs pgvector >= 0.7)
+    BINARY_QUANTIZATION_OVERSAMPLE: int = 8
+
+    # Explanation context: candidates retrieved, then packed (MMR) to a token budget
+    EXPLANATION_CONTEXT_CANDIDATES: int = 12
+    EXPLANATION_CONTEXT_CHUNKS: int = 4
+    EXPLANATION_CONTEXT_TOKENS: int = 600
+
+    # Worker-local cache of per-exam chunk embedding matrices
+    VECTOR_CACHE_ENABLED: bool = True
+    VECTOR_CACHE_MAX_BYTES: int = 256 * 1024 * 1024
+    VECTOR_CACHE_TTL_SECONDS: int = 60 * 60
+
+    # Query embeddings: a worker-local LRU in front of a table shared by all workers
+    QUERY_EMBEDDING_CACHE_ENABLED: bool = True
+    QUERY_EMBEDDING_CACHE_LOCAL_ITEMS: int = 2048
+    QUERY_EMBEDDING_CACHE_MAX_ROWS: int = 100_000
+    QUERY_EMBEDDING_CACHE_TTL_SECONDS: int = 30 * 24 * 60 * 60
+    # Expired and surplus rows are pruned on one store in this many, per worker
+    QUERY_EMBEDDING_CACHE_PRUNE_EVERY: int = 100
+
+    # Question generation over material longer than one prompt (map-reduce):
+    # sections are generated concurrently, oversampled, then deduplicated.
+    # A call asks for at most GENERATION_QUESTIONS_PER_CALL questions, which
+    # fit the model's 500 completion tokens; larger requests are sharded.
+    # Sections hold up to SECTION_TOKENS tokens of text, more if the material
+    # needs more than MAX_SECTIONS of them.
+    GENERATION_SECTION_TOKENS: int = 4_000
+    GENERATION_MAX_SECTIONS: int = 8
+    GENERATION_CONCURRENCY: int = 16
+    GENERATION_OVERSAMPLE: float = 1.5
+    GENERATION_QUESTIONS_PER_CALL: int = 5
+    # Invalid question items are dropped; this many follow-up calls then ask
+    # only for the questions they cost.
+    GENERATION_SALVAGE_FOLLOW_UPS: int = 1
+    # Material longer than GENERATION_CONTEXT_TOKENS is represented by
+    # excerpts: chunks chosen by k-means over their embeddings, in proportion
+    # to document size (see app.core.ai.clustering).
+    REPRESENTATIVE_CHUNKS_ENABLED: bool = True
+    GENERATION_CONTEXT_TOKENS: int = 24_000
+    # A topic-focused exam is generated from the top chunks of each topic
+    TOPIC_CONTEXT_CHUNKS: int = 6
+
+    # Opt-in study digest built per document after extraction: key concepts,
+    # definitions and facts citing their chunks, at the cost of LLM calls on
+    # every upload. Chunks are digested in sections of DIGEST_SECTION_TOKENS;
+    # questions are generated from the digest instead of the full text when
+    # GENERATION_USE_DIGESTS is also set.
+    DIGEST_ENABLED: bool = False
+    DIGEST_SECTION_TOKENS: int = 6_000
+    DIGEST_COMPLETION_TOKENS: int = 1_000
+    GENERATION_USE_DIGESTS: bool = False
+
+    # Generated exams, reused for the same documents and parameters: "exact"
+    # returns the cached questions, "pool" samples from the questions of
+    # several generations once there are POOL_FACTOR times as many as asked
+    EXAM_CACHE_ENABLED: bool = True
+    EXAM_CACHE_POLICY: Literal["exact", "pool"] = "exact"
+    EXAM_CACHE_POOL_FACTOR: float = 2.0
+    EXAM_CACHE_MAX_ROWS: int = 10_000
+    EXAM_CACHE_TTL_SECONDS: int = 7 * 24 * 60 * 60
+    # Expired and surplus entries are pruned on one store in this many, per worker
+    EXAM_CACHE_PRUNE_EVERY: int = 20
+    # Opt-in: generate the default exam of each new document into the cache
+    # as soon as it is ready, spending an LLM call on an exam nobody may take
+    EXAM_PREGENERATION_ENABLED: bool = False
+
+    # Per-document question bank: exams draw questions from it before the
+    # LLM is called. A question is retired after MAX_SERVES exams; banks of
+    # documents served POPULAR_SERVES times are kept at MIN_STOCK questions.
+    QUESTION_BANK_ENABLED: bool = True
+    QUESTION_BANK_MAX_SERVES: int = 20
+    QUESTION_BANK_MIN_STOCK: int = 20
+    QUESTION_BANK_POPULAR_SERVES: int = 10
+
+    # Exams generated in the background (POST /exams/generate?async=true):
+    # jobs running at once per worker, and how long one may take
+    EXAM_JOB_CONCURRENCY: int = 4
+    EXAM_JOB_TIMEOUT_SECONDS: int = 10 * 60
 
     @computed_field  # type: ignore[prop-decorator]
     @property
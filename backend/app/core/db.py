@@ -1,12 +1,21 @@
+from typing import Any
+
+from sqlalchemy import event
 from sqlmodel import Session, create_engine, select
 
 from app import crud
 from app.core.config import settings
+from app.core.vectors import register_vector_adapters
 from app.models import User, UserCreate
 
 engine = create_engine(str(settings.SQLALCHEMY_DATABASE_URI))
 
 
+@event.listens_for(engine, "connect")
+def _register_vector_adapters(dbapi_connection: Any, _: Any) -> None:
+    register_vector_adapters(dbapi_connection)
+
+
 # make sure all SQLModel models are imported (app.models) before initializing DB
 # otherwise, SQLModel might fail to initialize relationships properly
 # for more details: https://github.com/fastapi/full-stack-fastapi-template/issues/28
@@ -0,0 +1,178 @@
+"""
+Exam generation, in the request or as a background job.
+
+`POST /exams/generate?async=true` records an `ExamGenerationJob` and
+returns at once; `run_exam_generation_job` then generates the exam after
+the response is sent, at most EXAM_JOB_CONCURRENCY jobs at a time per
+worker. Either way the exam and its questions are committed in one
+transaction once generation has succeeded, so a failed generation leaves
+no exam behind; a job records the exam, or the error, in that same
+transaction.
+
+FastAPI background tasks and a per-process semaphore are not a worker
+pool: jobs live in the process that accepted them, and a restart loses
+the ones queued or running there. A running job is failed as lost once
+it has run for twice EXAM_JOB_TIMEOUT_SECONDS (see `expire_lost_job`);
+the outcome of a job is only recorded while it is still running, so an
+expired job stays failed. A queued job waits for a slot however long the
+queue is, and is not expired.
+"""
+
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Any
+from uuid import UUID
+
+from fastapi import HTTPException
+from sqlalchemy import update
+from sqlmodel import Session
+
+from app import crud
+from app.core.ai.exam_cache import generate_questions_cached
+from app.core.ai.question_bank import top_up_question_banks
+from app.core.ai.question_links import link_exam_questions
+from app.core.config import settings
+from app.core.db import engine
+from app.models import (
+    Exam,
+    ExamCreate,
+    ExamGenerationJob,
+    ExamJobStatus,
+    GenerateQuestionsPublic,
+)
+
+logger = logging.getLogger(__name__)
+
+_job_slots = asyncio.Semaphore(settings.EXAM_JOB_CONCURRENCY)
+
+
+def generated_exam_in(payload: GenerateQuestionsPublic) -> ExamCreate:
+    return ExamCreate(
+        title=payload.title,
+        description="generated exam",
+        duration_minutes=30,
+        is_published=False,
+        source_document_ids=[str(doc_id) for doc_id in payload.document_ids],
+        difficulty=payload.difficulty if payload.difficulty else None,
+        question_types=payload.question_types if payload.question_types else [],
+    )
+
+
+async def generate_exam_questions(
+    session: Session, payload: GenerateQuestionsPublic, owner_id: UUID
+) -> Exam:
+    """
+    Generate questions, then add the exam with its questions to the session.
+
+    Nothing is added if generation fails; the caller commits.
+    """
+    questions = await generate_questions_cached(
+        session,
+        payload.document_ids,
+        num_questions=payload.num_questions if payload.num_questions else 5,
+        difficulty=payload.difficulty if payload.difficulty else None,
+        question_types=payload.question_types if payload.question_types else None,
+        topics=payload.topics,
+    )
+    return crud.add_exam_with_questions(
+        session=session,
+        exam_in=generated_exam_in(payload),
+        owner_id=owner_id,
+        source_document_ids=[str(doc_id) for doc_id in payload.document_ids],
+        questions=questions,
+    )
+
+
+async def after_exam_generated(exam_id: UUID, payload: GenerateQuestionsPublic) -> None:
+    """Link the questions to their chunks and top up the question banks."""
+    await asyncio.to_thread(link_exam_questions, exam_id)
+    await top_up_question_banks(
+        payload.document_ids, payload.difficulty, payload.question_types or None
+    )
+
+
+async def run_exam_generation_job(job_id: UUID) -> None:
+    """Background task: generate the exam of a queued job and record the outcome."""
+    async with _job_slots:
+        with Session(engine) as session:
+            job = session.get(ExamGenerationJob, job_id)
+            if job is None or job.status != ExamJobStatus.queued:
+                return
+            job.status = ExamJobStatus.running
+            job.started_at = datetime.now(timezone.utc)
+            session.add(job)
+            session.commit()
+            payload = GenerateQuestionsPublic.model_validate(job.request)
+            owner_id = job.owner_id
+
+            exam_id: UUID | None = None
+            outcome: dict[str, object]
+            try:
+                exam = await asyncio.wait_for(
+                    generate_exam_questions(session, payload, owner_id),
+                    timeout=settings.EXAM_JOB_TIMEOUT_SECONDS,
+                )
+                exam_id = exam.id
+                outcome = {"status": ExamJobStatus.succeeded, "exam_id": exam_id}
+            except Exception as e:
+                logger.error(f"Exam generation job {job_id} failed: {e}")
+                session.rollback()
+                if isinstance(e, HTTPException):
+                    error = str(e.detail)
+                elif isinstance(e, TimeoutError):
+                    error = "Exam generation timed out"
+                else:
+                    error = str(e)
+                outcome = {"status": ExamJobStatus.failed, "error": error}
+            if not finish_running_job(session, job_id, **outcome):
+                # Expired meanwhile (see `expire_lost_job`): drop the exam too
+                logger.warning(f"Exam generation job {job_id} expired while running")
+                session.rollback()
+                return
+            session.commit()
+
+    if exam_id is not None:
+        await after_exam_generated(exam_id, payload)
+
+
+def finish_running_job(session: Session, job_id: UUID, **values: object) -> bool:
+    """
+    Record the outcome of a job that is still running, in the session's
+    transaction. False if it is no longer running.
+    """
+    stmt: Any = (
+        update(ExamGenerationJob)
+        .where(
+            ExamGenerationJob.id == job_id,  # type: ignore[arg-type]
+            ExamGenerationJob.status == ExamJobStatus.running,  # type: ignore[arg-type]
+        )
+        .values(finished_at=datetime.now(timezone.utc), **values)
+        .returning(ExamGenerationJob.id)  # type: ignore[call-overload]
+    )
+    return session.execute(stmt).first() is not None
+
+
+def expire_lost_job(session: Session, job: ExamGenerationJob) -> ExamGenerationJob:
+    """
+    Fail a job still running long past the timeout, e.g. because its worker
+    restarted, so clients polling it get an answer.
+
+    The deadline counts from when the job started, not from when it was
+    queued; queued jobs are left alone.
+    """
+    if job.status != ExamJobStatus.running or job.started_at is None:
+        return job
+    started_at = job.started_at.replace(tzinfo=job.started_at.tzinfo or timezone.utc)
+    deadline = started_at + timedelta(seconds=2 * settings.EXAM_JOB_TIMEOUT_SECONDS)
+    if datetime.now(timezone.utc) < deadline:
+        return job
+    if finish_running_job(
+        session,
+        job.id,
+        status=ExamJobStatus.failed,
+        error="Exam generation job was lost",
+    ):
+        session.commit()
+    session.refresh(job)
+    return job
@@ -1,31 +1,78 @@
+import logging
+from typing import Any
+
+import numpy as np
 from langchain_text_splitters import CharacterTextSplitter
-from sqlmodel import Session
+from numpy.typing import NDArray
+from sqlmodel import Session, select
 
+from app.core.ai.clustering import (
+    invalidate_document as invalidate_document_clusters,
+)
 from app.core.ai.embeddings import get_embeddings_model
+from app.core.ai.openai import build_study_digest
+from app.core.ai.tokens import count_tokens
+from app.core.ai.vector_cache import invalidate_document
+from app.core.config import settings
 from app.core.db import engine
 from app.core.s3 import extract_text_from_s3_file
+from app.core.vectors import as_float32
 from app.models import Document, DocumentChunk, DocumentStatus
 
+logger = logging.getLogger(__name__)
+
 embeddings_model = get_embeddings_model()
 
 
-def save_chunks_to_db(session: Session, document_id: str, chunks: list[str]) -> None:
+def save_chunks_to_db(
+    session: Session,
+    document_id: str,
+    chunks: list[str],
+    source_text: str | None = None,
+) -> None:
     """
     Saves the text chunks to the database.
     """
     embeddings = embed_chunks(chunks)
+    offsets = (
+        find_chunk_offsets(source_text, chunks)
+        if source_text is not None
+        else [None] * len(chunks)
+    )
 
-    for chunk, embedding in zip(chunks, embeddings, strict=False):
+    for chunk, embedding, offset in zip(chunks, embeddings, offsets, strict=False):
         session.add(
             DocumentChunk(
                 document_id=document_id,
                 text=chunk,
                 size=len(chunk),
+                start_offset=offset,
+                token_count=count_tokens(chunk),
                 embedding=embedding,
             )
         )
 
 
+def find_chunk_offsets(text: str, chunks: list[str]) -> list[int | None]:
+    """
+    Locates each chunk in the source text, in order.
+
+    Chunks overlap, so each search starts just after the previous match.
+    A chunk that can't be found verbatim (e.g. whitespace was normalised)
+    gets None and doesn't move the cursor.
+    """
+    offsets: list[int | None] = []
+    cursor = 0
+    for chunk in chunks:
+        index = text.find(chunk, cursor)
+        if index == -1:
+            offsets.append(None)
+            continue
+        offsets.append(index)
+        cursor = index + 1
+    return offsets
+
+
 def perform_fixed_size_chunking(
     text: str, chunk_size: int = 1000, chunk_overlap: int = 200
 ) -> list[str]:
@@ -53,8 +100,8 @@ def perform_fixed_size_chunking(
     return chunks
 
 
-def embed_chunks(chunks: list[str]) -> list[list[float]]:
-    return embeddings_model.embed_documents(chunks)
+def embed_chunks(chunks: list[str]) -> NDArray[np.float32]:
+    return as_float32(embeddings_model.embed_documents(chunks))
 
 
 def extract_text_and_save_to_db(s3_key: str, document_id: str) -> None:
@@ -72,7 +119,7 @@ def extract_text_and_save_to_db(s3_key: str, document_id: str) -> None:
             text = extract_text_from_s3_file(key=s3_key)
             chunks = perform_fixed_size_chunking(text)
 
-            save_chunks_to_db(session, document_id, chunks)
+            save_chunks_to_db(session, document_id, chunks, source_text=text)
 
             document.extracted_text = text
             document.chunk_count = len(chunks)
@@ -80,6 +127,8 @@ def extract_text_and_save_to_db(s3_key: str, document_id: str) -> None:
 
             session.add(document)
             session.commit()
+            invalidate_document(document_id)
+            invalidate_document_clusters(document_id)
 
         except Exception as e:
             session.rollback()
@@ -88,3 +137,46 @@ def extract_text_and_save_to_db(s3_key: str, document_id: str) -> None:
             session.add(document)
             session.commit()
             raise
+
+
+async def build_document_digest(document_id: str) -> None:
+    """
+    Background task after extraction: digest the document's chunks (see
+    `build_study_digest`) and store the digest on the document.
+
+    The LLM runs outside any transaction. A failure is only logged;
+    questions are then generated from the extracted text.
+    """
+    if not settings.DIGEST_ENABLED:
+        return
+    try:
+        with Session(engine) as session:
+            document = session.get(Document, document_id)
+            if not document or document.status != DocumentStatus.ready:
+                return
+            # Only the columns digested, not the embeddings
+            stmt: Any = (
+                select(  # type: ignore[call-overload]
+                    DocumentChunk.id, DocumentChunk.text, DocumentChunk.token_count
+                )
+                .where(DocumentChunk.document_id == document.id)
+                .order_by(DocumentChunk.start_offset.nulls_last())  # type: ignore[union-attr]
+            )
+            chunks = session.execute(stmt).all()
+            chunk_ids = [chunk.id for chunk in chunks]
+            chunk_texts = [chunk.text for chunk in chunks]
+            token_counts = [chunk.token_count for chunk in chunks]
+        if not chunks:
+            return
+
+        digest = await build_study_digest(chunk_ids, chunk_texts, token_counts)
+
+        with Session(engine) as session:
+            document = session.get(Document, document_id)
+            if not document:
+                return
+            document.digest = digest.model_dump(mode="json")
+            session.add(document)
+            session.commit()
+    except Exception as e:
+        logger.warning(f"Failed to build digest of document {document_id}: {e}")
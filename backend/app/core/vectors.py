@@ -0,0 +1,72 @@
+"""
+Embedding vectors as NumPy float32 arrays, in memory and on the wire.
+
+pgvector's psycopg adapters are registered on every connection of the app
+engine, so `Float32Vector` values are sent in pgvector's binary format and
+vector results load straight into float32 arrays. Ordinary queries still
+get results as text; `fetch_binary` asks for binary results, for bulk reads
+of embedding columns.
+"""
+
+from typing import Any, cast
+
+import numpy as np
+import psycopg
+from numpy.typing import ArrayLike, NDArray
+from pgvector.psycopg import register_vector  # type: ignore[import-untyped]
+from pgvector.sqlalchemy import Vector  # type: ignore[import-untyped]
+from psycopg.rows import namedtuple_row
+from psycopg.types import TypeInfo
+from sqlmodel import Session
+
+EMBEDDING_DIM = 1536
+
+
+def as_float32(embeddings: ArrayLike) -> NDArray[np.float32]:
+    """View `embeddings` as a float32 array, copying only if needed."""
+    return np.asarray(embeddings, dtype=np.float32)
+
+
+class Float32Vector(Vector):  # type: ignore[misc]
+    """
+    pgvector column type that binds and returns float32 arrays.
+
+    Values are handed to psycopg as arrays so its binary dumper encodes
+    them; connections without the adapters registered cannot bind them.
+    """
+
+    cache_ok = True
+
+    def bind_processor(self, dialect: Any) -> Any:
+        def process(value: Any) -> Any:
+            if value is None:
+                return None
+            array = as_float32(value)
+            if self.dim is not None and array.shape != (self.dim,):
+                raise ValueError(f"expected {self.dim} dimensions, not {array.shape}")
+            return array
+
+        return process
+
+
+def register_vector_adapters(dbapi_connection: Any) -> None:
+    """Register pgvector's adapters, unless the extension is not installed yet."""
+    if TypeInfo.fetch(dbapi_connection, "vector") is not None:
+        register_vector(dbapi_connection)
+    # TypeInfo.fetch opened a transaction; the pool expects an idle connection
+    dbapi_connection.rollback()
+
+
+def fetch_binary(session: Session, query: str, params: Any = None) -> list[Any]:
+    """
+    Run raw SQL in `session`'s transaction with results in binary format.
+
+    Only for columns psycopg has binary loaders for (numbers, text, uuid,
+    timestamps, vector); rows are named tuples.
+    """
+    dbapi_connection = cast(
+        psycopg.Connection[Any], session.connection().connection.dbapi_connection
+    )
+    with dbapi_connection.cursor(binary=True, row_factory=namedtuple_row) as cursor:
+        cursor.execute(query, params)
+        return cursor.fetchall()
@@ -1,23 +1,32 @@
+import base64
+import json
+import re
 from datetime import datetime, timezone
 from typing import Any
 from uuid import UUID
 
+from sqlalchemy import REAL, cast, func, literal, tuple_
 from sqlmodel import Session, select
 
-from app.core.ai.openai import generate_answer_explanation
+from app.core.ai.openai import generate_answer_explanations
 from app.core.security import get_password_hash, verify_password
 from app.models import (
     Answer,
     AnswerExplanation,
     AnswerUpdate,
     Document,
+    DocumentChunk,
     DocumentCreate,
     DocumentPublic,
+    DocumentSearchHit,
     Exam,
     ExamAttempt,
     ExamAttemptCreate,
     ExamCreate,
+    ExamGenerationJob,
     ExamPublic,
+    ExplanationRequest,
+    GenerateQuestionsPublic,
     Question,
     QuestionCreate,
     QuestionPublic,
@@ -83,6 +92,113 @@ def create_document(
     return DocumentPublic.model_validate(db_document)
 
 
+# Private-use characters mark matches in ts_headline output; they are
+# stripped again and returned as character ranges.
+HIGHLIGHT_START = "\ue000"
+HIGHLIGHT_STOP = "\ue001"
+HEADLINE_OPTIONS = (
+    f"StartSel={HIGHLIGHT_START}, StopSel={HIGHLIGHT_STOP}, "
+    'MaxWords=35, MinWords=15, MaxFragments=2, FragmentDelimiter=" ... "'
+)
+
+
+def encode_search_cursor(rank: float, chunk_id: UUID) -> str:
+    return base64.urlsafe_b64encode(json.dumps([rank, str(chunk_id)]).encode()).decode()
+
+
+def decode_search_cursor(cursor: str) -> tuple[float, UUID]:
+    """Raises ValueError for a cursor not made by `encode_search_cursor`."""
+    try:
+        rank, chunk_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return float(rank), UUID(chunk_id)
+    except (TypeError, ValueError) as e:
+        raise ValueError("Invalid search cursor") from e
+
+
+def split_highlights(headline: str) -> tuple[str, list[tuple[int, int]]]:
+    """Strip highlight markers, returning the text and the marked ranges."""
+    snippet = ""
+    highlights: list[tuple[int, int]] = []
+    start = 0
+    for piece in re.split(f"({HIGHLIGHT_START}|{HIGHLIGHT_STOP})", headline):
+        if piece == HIGHLIGHT_START:
+            start = len(snippet)
+        elif piece == HIGHLIGHT_STOP:
+            highlights.append((start, len(snippet)))
+        else:
+            snippet += piece
+    return snippet, highlights
+
+
+def search_document_chunks(
+    *,
+    session: Session,
+    owner_id: UUID,
+    query: str,
+    limit: int,
+    after: tuple[float, UUID] | None = None,
+) -> list[DocumentSearchHit]:
+    """
+    Full-text search over the chunks of `owner_id`'s documents.
+
+    Hits are ordered by `ts_rank_cd`, ties broken by chunk id, and paged by
+    keyset: `after` is the (rank, chunk id) of the last hit already seen.
+    Matching uses the GIN index on `DocumentChunk.search_vector`; snippets
+    are only built for the rows of the requested page.
+    """
+    tsquery = func.websearch_to_tsquery("english", query)
+    rank = func.ts_rank_cd(DocumentChunk.search_vector, tsquery)
+    page: Any = (
+        select(  # type: ignore[call-overload]
+            DocumentChunk.id,
+            DocumentChunk.document_id,
+            DocumentChunk.text,
+            Document.filename,
+            rank.label("rank"),
+        )
+        .join(Document, Document.id == DocumentChunk.document_id)
+        .where(
+            Document.owner_id == owner_id,
+            DocumentChunk.search_vector.op("@@")(tsquery),  # type: ignore[union-attr]
+        )
+    )
+    if after is not None:
+        after_rank, after_id = after
+        page = page.where(
+            tuple_(rank, DocumentChunk.id)  # type: ignore[arg-type]
+            < tuple_(cast(after_rank, REAL), literal(after_id))
+        )
+    page = (
+        page.order_by(rank.desc(), DocumentChunk.id.desc())  # type: ignore[attr-defined]
+        .limit(limit)
+        .subquery()
+    )
+    stmt: Any = select(  # type: ignore[call-overload]
+        page.c.id,
+        page.c.document_id,
+        page.c.filename,
+        page.c.rank,
+        func.ts_headline("english", page.c.text, tsquery, HEADLINE_OPTIONS).label(
+            "headline"
+        ),
+    ).order_by(page.c.rank.desc(), page.c.id.desc())
+
+    hits = []
+    for row in session.execute(stmt).all():
+        snippet, highlights = split_highlights(row.headline)
+        hits.append(
+            DocumentSearchHit(
+                document_id=row.document_id,
+                filename=row.filename,
+                chunk_id=row.id,
+                rank=row.rank,
+                snippet=snippet,
+                highlights=highlights,
+            )
+        )
+    return hits
+
+
 # -------------------- Exams --------------------
 
 
@@ -134,6 +250,52 @@ def create_exam(
     return ExamPublic.model_validate(db_exam)
 
 
+def add_exam_with_questions(
+    *,
+    session: Session,
+    exam_in: ExamCreate,
+    owner_id: UUID,
+    source_document_ids: list[str],
+    questions: list[QuestionCreate],
+) -> Exam:
+    """Add an exam and its questions to the session; the caller commits."""
+    db_exam = Exam(
+        title=exam_in.title,
+        description=exam_in.description,
+        duration_minutes=exam_in.duration_minutes,
+        is_published=exam_in.is_published,
+        owner_id=owner_id,
+        source_document_ids=source_document_ids,
+        difficulty=exam_in.difficulty,
+        question_types=exam_in.question_types,
+    )
+    session.add(db_exam)
+    session.add_all(
+        Question(
+            question=q.question,
+            correct_answer=q.correct_answer,
+            type=q.type,
+            options=q.options or [],
+            exam_id=db_exam.id,
+        )
+        for q in questions
+    )
+    return db_exam
+
+
+# -------------------- Exam generation jobs --------------------
+
+
+def create_exam_generation_job(
+    *, session: Session, payload: GenerateQuestionsPublic, owner_id: UUID
+) -> ExamGenerationJob:
+    job = ExamGenerationJob(owner_id=owner_id, request=payload.model_dump(mode="json"))
+    session.add(job)
+    session.commit()
+    session.refresh(job)
+    return job
+
+
 # -------------------- Exam Attempts --------------------
 
 
@@ -241,6 +403,8 @@ async def generate_explanations_for_incorrect_answers(
     exam: Exam,
     answers: list[Answer],
 ) -> None:
+    pending: list[Answer] = []
+    requests: list[ExplanationRequest] = []
     for answer in answers:
         if answer.is_correct:
             continue
@@ -250,14 +414,23 @@ async def generate_explanations_for_incorrect_answers(
         if not question.correct_answer or not answer.response:
             continue
 
-        explanation = await generate_answer_explanation(
-            session=session,
-            exam=exam,
-            question=question.question,
-            correct_answer=question.correct_answer,
-            user_answer=answer.response,
+        pending.append(answer)
+        requests.append(
+            ExplanationRequest(
+                question_id=question.id,
+                question=question.question,
+                correct_answer=question.correct_answer,
+                user_answer=answer.response,
+            )
         )
 
+    explanations = await generate_answer_explanations(
+        session=session,
+        exam=exam,
+        requests=requests,
+    )
+
+    for answer, explanation in zip(pending, explanations, strict=True):
         answer.explanation = AnswerExplanation(
             explanation=explanation.explanation,
             key_takeaway=explanation.key_takeaway,
@@ -1,16 +1,18 @@
 import uuid
 from datetime import datetime, timezone
 from enum import Enum
-from typing import Optional
+from typing import Any, Optional
 from uuid import UUID
 
-from pgvector.sqlalchemy import Vector  # type: ignore[import-untyped]
 from pydantic import BaseModel as PydanticBaseModel
 from pydantic import EmailStr, model_validator
-from sqlalchemy import Column, String, Text
+from sqlalchemy import Column, Computed, Index, String, Text
 from sqlalchemy import Enum as SQLAEnum
+from sqlalchemy.dialects.postgresql import TSVECTOR
 from sqlmodel import JSON, Field, ForeignKey, Relationship, SQLModel
 
+from app.core.vectors import EMBEDDING_DIM, Float32Vector
+
 
 # Shared properties
 class UserBase(SQLModel):
@@ -105,6 +107,44 @@ class Exam(ExamBase, table=True):
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
 
+class ExamJobStatus(str, Enum):
+    queued = "queued"
+    running = "running"
+    succeeded = "succeeded"
+    failed = "failed"
+
+
+class ExamGenerationJob(SQLModel, table=True):
+    """An exam generated in the background (`POST /exams/generate?async=true`)."""
+
+    id: uuid.UUID = Field(default_factory=uuid.uuid4, primary_key=True)
+    owner_id: uuid.UUID = Field(foreign_key="user.id", ondelete="CASCADE", index=True)
+    status: ExamJobStatus = Field(
+        default=ExamJobStatus.queued, sa_column=Column(String, nullable=False)
+    )
+    # The GenerateQuestionsPublic payload
+    request: dict[str, Any] = Field(sa_column=Column(JSON, nullable=False))
+    # Set together with status "succeeded", in the transaction creating the exam
+    exam_id: uuid.UUID | None = Field(
+        default=None, foreign_key="exam.id", ondelete="SET NULL"
+    )
+    error: str | None = Field(default=None, sa_column=Column(Text))
+    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    # When a worker took the job off the queue
+    started_at: datetime | None = None
+    finished_at: datetime | None = None
+
+
+class ExamGenerationJobPublic(SQLModel):
+    id: uuid.UUID
+    status: ExamJobStatus
+    exam_id: uuid.UUID | None
+    error: str | None
+    created_at: datetime
+    started_at: datetime | None
+    finished_at: datetime | None
+
+
 class ExamPublic(ExamBase):
     id: uuid.UUID
     owner_id: uuid.UUID
@@ -149,6 +189,12 @@ class DocumentStatus(str, Enum):
     failed = "failed"
 
 
+class RetrievalMode(str, Enum):
+    vector = "vector"  # cosine distance over the HNSW index
+    hybrid = "hybrid"  # vector + full-text results fused by reciprocal rank
+    binary = "binary"  # Hamming prefilter on binary-quantized vectors + rerank
+
+
 class QuestionBase(SQLModel):
     question: str = Field(sa_column=Column(Text, nullable=False))
 
@@ -174,6 +220,47 @@ class Question(QuestionBase, table=True):
     )
 
 
+class QuestionChunkLink(SQLModel, table=True):
+    """A chunk supporting a question, found when the exam was generated."""
+
+    question_id: uuid.UUID = Field(
+        foreign_key="question.id", primary_key=True, ondelete="CASCADE"
+    )
+    chunk_id: uuid.UUID = Field(
+        foreign_key="documentchunk.id", primary_key=True, ondelete="CASCADE", index=True
+    )
+    rank: int = Field(ge=0)  # 0 = closest
+    distance: float  # cosine distance between question and chunk
+
+
+class BankQuestion(SQLModel, table=True):
+    """A generated question kept for reuse in later exams on its document."""
+
+    __table_args__ = (
+        Index(
+            "ix_bankquestion_document_difficulty_type",
+            "document_id",
+            "difficulty",
+            "type",
+        ),
+    )
+
+    id: uuid.UUID = Field(default_factory=uuid.uuid4, primary_key=True)
+    document_id: uuid.UUID = Field(foreign_key="document.id", ondelete="CASCADE")
+    difficulty: Difficulty = Field(sa_column=Column(String, nullable=False))
+    type: QuestionType = Field(
+        sa_column=Column(SQLAEnum(QuestionType, native_enum=True), nullable=False)
+    )
+    question: str = Field(sa_column=Column(Text, nullable=False))
+    options: list[str] = Field(sa_column=Column(JSON, nullable=False))
+    correct_answer: str | None = Field(default=None, sa_column=Column(Text))
+    # QUESTION_PROMPT_VERSION of the prompt that generated it
+    prompt_version: int
+    # Exams it has been drawn into; it is retired at QUESTION_BANK_MAX_SERVES
+    served_count: int = 0
+    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+
+
 # Define response model for a question
 class QuestionPublic(QuestionBase):
     id: uuid.UUID
@@ -195,6 +282,13 @@ class GenerateQuestionsBase(SQLModel):
 class GenerateQuestionsPublic(GenerateQuestionsBase):
     document_ids: list[uuid.UUID]
     title: str = Field(min_length=1, max_length=255)
+    # Focus the exam: generate only from the chunks retrieved for these topics
+    topics: list[str] = Field(default_factory=list, max_length=10)
+
+    @model_validator(mode="after")
+    def strip_topics(self) -> "GenerateQuestionsPublic":
+        self.topics = [topic.strip() for topic in self.topics if topic.strip()]
+        return self
 
 
 class ExamAttemptBase(SQLModel):
@@ -234,6 +328,14 @@ class ExplanationOutput(PydanticBaseModel):
     suggested_review: str
 
 
+class ExplanationRequest(PydanticBaseModel):
+    question: str
+    correct_answer: str
+    user_answer: str
+    # Lets the explanation reuse the question's precomputed context links
+    question_id: UUID | None = None
+
+
 class AnswerPublic(AnswerBase):
     id: uuid.UUID
     question_id: uuid.UUID
@@ -335,7 +437,7 @@ class Document(DocumentBase, table=True):
     id: uuid.UUID = Field(default_factory=uuid.uuid4, primary_key=True)
 
     owner_id: uuid.UUID = Field(
-        foreign_key="user.id", nullable=False, ondelete="CASCADE"
+        foreign_key="user.id", nullable=False, ondelete="CASCADE", index=True
     )
     owner: User | None = Relationship(back_populates="documents")
 
@@ -353,10 +455,20 @@ class Document(DocumentBase, table=True):
 
     chunks: list["DocumentChunk"] = Relationship(back_populates="document")
     chunk_count: int = 0
+    # StudyDigest built after extraction; None until then or if it failed
+    digest: dict[str, Any] | None = Field(
+        default=None, sa_column=Column(JSON, nullable=True)
+    )
     processing_error: str | None = Field(
         default=None,
         sa_column=Column(Text, nullable=True),
     )
+    # Bumped by every update, e.g. re-extraction; in-process caches of the
+    # document's chunks compare it to tell whether they are stale
+    updated_at: datetime = Field(
+        default_factory=lambda: datetime.now(timezone.utc),
+        sa_column_kwargs={"onupdate": lambda: datetime.now(timezone.utc)},
+    )
 
 
 class DocumentPublic(DocumentBase):
@@ -374,20 +486,117 @@ class DocumentsPublic(SQLModel):
     count: int
 
 
+class DocumentSearchHit(SQLModel):
+    document_id: uuid.UUID
+    filename: str
+    chunk_id: uuid.UUID
+    rank: float  # ts_rank_cd of the chunk, higher is better
+    snippet: str  # plain-text excerpt of the chunk around the matches
+    # (start, end) character ranges of matched terms within `snippet`
+    highlights: list[tuple[int, int]]
+
+
+class DocumentSearchResults(SQLModel):
+    data: list[DocumentSearchHit]
+    # Pass as `cursor` to fetch the next page; None on the last page
+    next_cursor: str | None = None
+
+
 class DocumentChunkBase(SQLModel):
     text: str
     # TODO: vectorize for RAG
-    embedding: list[float] | None = Field(default=None, sa_column=Column(Vector(1536)))
+    embedding: Any = Field(  # float32 array of EMBEDDING_DIM
+        default=None, sa_column=Column(Float32Vector(EMBEDDING_DIM))
+    )
 
 
 class DocumentChunk(DocumentChunkBase, table=True):
     id: uuid.UUID = Field(default_factory=uuid.uuid4, primary_key=True)
     document_id: uuid.UUID = Field(
-        foreign_key="document.id", nullable=False, ondelete="CASCADE"
+        foreign_key="document.id", nullable=False, ondelete="CASCADE", index=True
     )
     document: Document | None = Relationship(back_populates="chunks")
     size: int = Field(ge=0)  # Number of characters in the chunk
+    # Character offset of the chunk in Document.extracted_text (None if unknown)
+    start_offset: int | None = Field(default=None, ge=0)
+    # Tokens of `text` for the LLM, counted at ingest (None for older chunks)
+    token_count: int | None = Field(default=None, ge=0)
     type: str | None = "fixed-size"
+    # Maintained by Postgres from `text`; used by lexical and hybrid retrieval
+    search_vector: str | None = Field(
+        default=None,
+        sa_column=Column(
+            TSVECTOR, Computed("to_tsvector('english', text)", persisted=True)
+        ),
+    )
+
+
+class RetrievedChunk(SQLModel):
+    """
+    Projection returned by retrieval.
+
+    The embedding is only attached when a caller needs it (see
+    `retrieval.attach_embeddings`) and is never serialised.
+    """
+
+    id: uuid.UUID
+    document_id: uuid.UUID
+    text: str
+    distance: float  # cosine distance to the query, 0 = identical
+    start_offset: int | None = None
+    token_count: int | None = None
+    embedding: Any = Field(default=None, exclude=True, repr=False)
+
+    @property
+    def similarity(self) -> float:
+        return 1.0 - self.distance
+
+
+class QueryEmbedding(SQLModel, table=True):
+    """Embedding of a normalised retrieval query, shared by all workers."""
+
+    # sha256 of the embedding model and the normalised query text
+    key: str = Field(primary_key=True, max_length=64)
+    embedding: Any = Field(
+        sa_column=Column(Float32Vector(EMBEDDING_DIM), nullable=False)
+    )
+    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    last_used_at: datetime = Field(
+        default_factory=lambda: datetime.now(timezone.utc), index=True
+    )
+
+
+class GeneratedExamCache(SQLModel, table=True):
+    """Questions generated for a set of documents and exam parameters."""
+
+    # sha256 of the document texts' hashes, exam parameters, prompt and model
+    key: str = Field(primary_key=True, max_length=64)
+    questions: list[dict[str, Any]] = Field(sa_column=Column(JSON, nullable=False))
+    hits: int = 0
+    misses: int = 0
+    # LLM time spent on the misses that generated these questions
+    generation_seconds: float = 0.0
+    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    last_used_at: datetime = Field(
+        default_factory=lambda: datetime.now(timezone.utc), index=True
+    )
+
+
+class ExamCacheStats(SQLModel):
+    entries: int
+    hits: int
+    misses: int
+    seconds_saved: float
+
+
+class LLMTokenStats(SQLModel):
+    """Token usage of the LLM calls made by one worker since it started."""
+
+    calls: int = 0
+    prompt_tokens: int = 0
+    # Prompt tokens served from the provider's prompt cache
+    cached_prompt_tokens: int = 0
+    completion_tokens: int = 0
 
 
 # Generic message
@@ -461,6 +670,25 @@ class QuestionOutput(PydanticBaseModel):
     questions: list[QuestionItem]
 
 
+class DigestEntry(PydanticBaseModel):
+    text: str
+    # Numbers of the chunks the entry comes from, as numbered in the prompt
+    chunks: list[int]
+
+
+class DigestOutput(PydanticBaseModel):
+    concepts: list[DigestEntry]
+    # "term: definition"
+    definitions: list[DigestEntry]
+    facts: list[DigestEntry]
+
+
+class StudyDigest(DigestOutput):
+    """Compact digest of a document; chunk n is `chunk_ids[n - 1]`."""
+
+    chunk_ids: list[UUID]
+
+
 # Fix forward references for all Pydantic/SQLModel models
 AnswerUpdate.model_rebuild()
 ExamAttemptUpdate.model_rebuild()
@@ -0,0 +1,106 @@
+"""
+Benchmark: float HNSW search vs. binary-quantized prefilter + exact rerank.
+
+Recall@k is measured against the exact top-k (brute force over the stored
+embeddings) for a range of oversampling factors. Memory is reported as the
+on-disk size of each HNSW index, which is what has to stay cached in RAM
+for the search to be fast. Needs pgvector >= 0.7 and a migrated database.
+
+    python -m benchmarks.binary_quantization --documents 8 --chunks 2500
+"""
+
+import argparse
+import logging
+import statistics
+import sys
+import time
+
+from sqlalchemy import text
+from sqlmodel import Session
+
+from app.core.ai.retrieval import retrieve_top_k_chunks
+from app.core.ai.vector_cache import load_chunk_matrix
+from app.core.db import engine
+from app.models import RetrievalMode
+from benchmarks.corpus import create_corpus, drop_corpus, query_embeddings
+
+logging.basicConfig(level=logging.INFO, format="%(message)s")
+logger = logging.getLogger(__name__)
+
+FLOAT_INDEX = "ix_documentchunk_embedding_hnsw"
+BINARY_INDEX = "ix_documentchunk_embedding_bq_hnsw"
+
+
+def index_size_mib(session: Session, index: str) -> float | None:
+    size = session.execute(
+        text("SELECT pg_relation_size(to_regclass(:index))"), {"index": index}
+    ).scalar_one()
+    return None if size is None else size / 1024 / 1024
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--documents", type=int, default=8)
+    parser.add_argument("--chunks", type=int, default=2500, help="per document")
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--oversample", type=int, nargs="+", default=[1, 2, 4, 8, 16])
+    args = parser.parse_args()
+
+    with Session(engine) as session:
+        if index_size_mib(session, BINARY_INDEX) is None:
+            logger.error(
+                f"{BINARY_INDEX} is missing; run the migrations on pgvector >= 0.7"
+            )
+            sys.exit(1)
+
+        drop_corpus(session)
+        corpus = create_corpus(
+            session, num_documents=args.documents, chunks_per_document=args.chunks
+        )
+        try:
+            session.execute(text("ANALYZE documentchunk"))
+            matrix = load_chunk_matrix(session, corpus.document_ids)
+            queries = [q.tolist() for q in query_embeddings(args.queries)]
+            exact = [
+                {chunk.id for chunk in matrix.top_k(query, args.k)} for query in queries
+            ]
+
+            runs = [(RetrievalMode.vector, None)] + [
+                (RetrievalMode.binary, oversample) for oversample in args.oversample
+            ]
+            rows = []
+            for mode, oversample in runs:
+                latencies, recalls = [], []
+                for query, truth in zip(queries, exact, strict=True):
+                    start = time.perf_counter()
+                    chunks = retrieve_top_k_chunks(
+                        session=session,
+                        document_ids=corpus.document_ids,
+                        query_embedding=query,
+                        k=args.k,
+                        mode=mode,
+                        oversample=oversample,
+                    )
+                    latencies.append((time.perf_counter() - start) * 1000)
+                    session.rollback()
+                    recalls.append(len(truth & {c.id for c in chunks}) / args.k)
+                label = mode.value if oversample is None else f"binary x{oversample}"
+                rows.append(
+                    (label, statistics.median(latencies), statistics.fmean(recalls))
+                )
+
+            float_mib = index_size_mib(session, FLOAT_INDEX) or 0.0
+            binary_mib = index_size_mib(session, BINARY_INDEX) or 0.0
+        finally:
+            drop_corpus(session)
+
+    logger.info(f"{corpus.num_chunks} chunks, k={args.k}, {args.queries} queries")
+    logger.info(f"index size: float {float_mib:.1f} MiB, binary {binary_mib:.1f} MiB")
+    logger.info(f"{'mode':<14}{'p50 ms':>10}{'recall@k':>10}")
+    for label, p50, recall in rows:
+        logger.info(f"{label:<14}{p50:>10.2f}{recall:>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
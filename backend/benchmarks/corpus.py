@@ -0,0 +1,173 @@
+"""
+Synthetic corpus for retrieval benchmarks.
+
+Embeddings are deterministic for a given seed: each chunk is a noisy copy of
+one of `num_topics` random unit vectors, which gives the clustered structure
+real document embeddings have. Everything is owned by a dedicated benchmark
+user so `drop_corpus` can remove it with one cascading delete.
+"""
+
+import uuid
+from dataclasses import dataclass, field
+
+import numpy as np
+from numpy.typing import NDArray
+from sqlalchemy import delete, insert
+from sqlmodel import Session, select
+
+from app.core.security import get_password_hash
+from app.models import Document, DocumentChunk, DocumentStatus, User
+
+EMBEDDING_DIM = 1536
+BENCHMARK_EMAIL = "retrieval-benchmark@example.com"
+
+WORDS = (
+    "entropy enthalpy osmosis mitosis meiosis photosynthesis derivative integral "
+    "vector matrix eigenvalue theorem lemma proof hypothesis variance regression "
+    "catalyst equilibrium momentum velocity inertia torque voltage current "
+    "resistance capacitor allele genotype phenotype enzyme substrate protein"
+).split()
+
+
+@dataclass
+class Corpus:
+    owner_id: uuid.UUID
+    document_ids: list[uuid.UUID]
+    num_chunks: int
+    # Topic each chunk was generated from, the ground truth for recall
+    chunk_topics: dict[uuid.UUID, int] = field(default_factory=dict)
+
+
+def unit_rows(matrix: NDArray[np.float32]) -> NDArray[np.float32]:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    unit: NDArray[np.float32] = (matrix / np.maximum(norms, 1e-12)).astype(np.float32)
+    return unit
+
+
+def topic_centers(
+    num_topics: int, *, dim: int = EMBEDDING_DIM, seed: int = 0
+) -> NDArray[np.float32]:
+    rng = np.random.default_rng(seed)
+    return unit_rows(rng.standard_normal((num_topics, dim), dtype=np.float32))
+
+
+def synthetic_embeddings(
+    n: int,
+    *,
+    centers: NDArray[np.float32],
+    noise: float = 0.6,
+    seed: int = 1,
+) -> tuple[NDArray[np.float32], NDArray[np.int64]]:
+    """Return `n` unit embeddings and the topic each one was drawn from."""
+    rng = np.random.default_rng(seed)
+    topics = rng.integers(0, len(centers), size=n)
+    # Scaled so `noise` is the expected norm of the jitter, not per dimension.
+    jitter = rng.standard_normal((n, centers.shape[1]), dtype=np.float32)
+    jitter *= noise / np.sqrt(centers.shape[1])
+    return unit_rows(centers[topics] + jitter), topics
+
+
+def topic_terms(topic: int) -> list[str]:
+    return [WORDS[topic % len(WORDS)], WORDS[(topic * 7 + 3) % len(WORDS)]]
+
+
+def synthetic_text(rng: np.random.Generator, topic: int, words: int = 150) -> str:
+    tokens = rng.choice(WORDS, size=words).tolist()
+    # Every tenth word is one of the topic's key terms, so lexical search has
+    # something to find.
+    terms = topic_terms(topic)
+    for i in range(0, words, 10):
+        tokens[i] = terms[(i // 10) % len(terms)]
+    return " ".join(tokens)
+
+
+def get_or_create_owner(session: Session) -> User:
+    user = session.exec(select(User).where(User.email == BENCHMARK_EMAIL)).first()
+    if user:
+        return user
+    user = User(
+        email=BENCHMARK_EMAIL,
+        hashed_password=get_password_hash(uuid.uuid4().hex),
+        is_active=False,
+    )
+    session.add(user)
+    session.commit()
+    session.refresh(user)
+    return user
+
+
+def create_corpus(
+    session: Session,
+    *,
+    num_documents: int,
+    chunks_per_document: int,
+    num_topics: int = 32,
+    seed: int = 0,
+    batch_size: int = 1000,
+    first_document: int = 0,
+) -> Corpus:
+    """
+    Insert `num_documents` documents of synthetic chunks.
+
+    Documents are numbered from `first_document`, so a corpus can be grown
+    in steps and still get the embeddings a single call would have made.
+    """
+    owner = get_or_create_owner(session)
+    centers = topic_centers(num_topics, seed=seed)
+    rng = np.random.default_rng(seed + first_document)
+    document_ids: list[uuid.UUID] = []
+    chunk_topics: dict[uuid.UUID, int] = {}
+
+    for d in range(first_document, first_document + num_documents):
+        document = Document(
+            filename=f"benchmark-{d}.txt",
+            owner_id=owner.id,
+            status=DocumentStatus.ready,
+            chunk_count=chunks_per_document,
+        )
+        session.add(document)
+        session.flush()
+        document_ids.append(document.id)
+
+        embeddings, topics = synthetic_embeddings(
+            chunks_per_document, centers=centers, seed=seed + d + 1
+        )
+        for start in range(0, chunks_per_document, batch_size):
+            rows = []
+            for i in range(start, min(start + batch_size, chunks_per_document)):
+                chunk_id = uuid.uuid4()
+                chunk_topics[chunk_id] = int(topics[i])
+                text = synthetic_text(rng, int(topics[i]))
+                rows.append(
+                    {
+                        "id": chunk_id,
+                        "document_id": document.id,
+                        "text": text,
+                        "size": len(text),
+                        "start_offset": i * 800,
+                        "embedding": embeddings[i],
+                    }
+                )
+            session.execute(insert(DocumentChunk), rows)
+        session.commit()
+
+    return Corpus(
+        owner_id=owner.id,
+        document_ids=document_ids,
+        num_chunks=num_documents * chunks_per_document,
+        chunk_topics=chunk_topics,
+    )
+
+
+def drop_corpus(session: Session) -> None:
+    # Documents and chunks go with the owner through ON DELETE CASCADE.
+    session.execute(delete(User).where(User.email == BENCHMARK_EMAIL))  # type: ignore[arg-type]
+    session.commit()
+
+
+def query_embeddings(
+    n: int, *, num_topics: int = 32, seed: int = 0
+) -> NDArray[np.float32]:
+    centers = topic_centers(num_topics, seed=seed)
+    embeddings, _ = synthetic_embeddings(n, centers=centers, seed=seed + 10_000)
+    return embeddings
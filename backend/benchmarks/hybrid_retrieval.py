@@ -0,0 +1,124 @@
+"""
+Benchmark: vector-only vs. hybrid (vector + full-text, RRF) retrieval.
+
+Each query targets one topic: its text holds that topic's key terms, but its
+embedding is pulled towards a second, distracting topic, the way a wrong
+answer drags an explanation query off course. Recall@k counts retrieved
+chunks that belong to the target topic.
+
+    python -m benchmarks.hybrid_retrieval --documents 4 --chunks 500
+"""
+
+import argparse
+import logging
+import statistics
+import time
+
+import numpy as np
+from sqlmodel import Session
+
+from app.core.ai.retrieval import retrieve_top_k_chunks
+from app.core.db import engine
+from app.models import RetrievalMode
+from benchmarks.corpus import (
+    Corpus,
+    create_corpus,
+    drop_corpus,
+    topic_centers,
+    topic_terms,
+    unit_rows,
+)
+
+logging.basicConfig(level=logging.INFO, format="%(message)s")
+logger = logging.getLogger(__name__)
+
+NUM_TOPICS = 32
+
+
+def distracted_queries(
+    n: int, *, distraction: float, seed: int = 0
+) -> list[tuple[int, list[float], str]]:
+    """Return (target topic, embedding, text) for `n` queries."""
+    centers = topic_centers(NUM_TOPICS, seed=seed)
+    rng = np.random.default_rng(seed + 20_000)
+    queries = []
+    for _ in range(n):
+        target, distractor = rng.choice(NUM_TOPICS, size=2, replace=False)
+        mixed = (1 - distraction) * centers[target] + distraction * centers[distractor]
+        embedding = unit_rows(mixed[np.newaxis, :])[0]
+        text = "why is " + " and ".join(topic_terms(int(target))) + " wrong"
+        queries.append((int(target), embedding.tolist(), text))
+    return queries
+
+
+def measure(
+    session: Session,
+    corpus: Corpus,
+    queries: list[tuple[int, list[float], str]],
+    *,
+    mode: RetrievalMode,
+    k: int,
+) -> dict[str, float]:
+    latencies, recalls = [], []
+    for target, embedding, text in queries:
+        start = time.perf_counter()
+        chunks = retrieve_top_k_chunks(
+            session=session,
+            document_ids=corpus.document_ids,
+            query_embedding=embedding,
+            k=k,
+            mode=mode,
+            query_text=text,
+        )
+        latencies.append((time.perf_counter() - start) * 1000)
+        session.rollback()
+        hits = sum(corpus.chunk_topics.get(chunk.id) == target for chunk in chunks)
+        recalls.append(hits / k)
+    return {
+        "p50_ms": statistics.median(latencies),
+        "p95_ms": statistics.quantiles(latencies, n=20)[-1],
+        "recall": statistics.fmean(recalls),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--documents", type=int, default=4)
+    parser.add_argument("--chunks", type=int, default=500, help="per document")
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--k", type=int, default=8)
+    parser.add_argument(
+        "--distraction",
+        type=float,
+        default=0.5,
+        help="weight of the distracting topic in each query embedding",
+    )
+    args = parser.parse_args()
+
+    queries = distracted_queries(args.queries, distraction=args.distraction)
+    with Session(engine) as session:
+        drop_corpus(session)
+        corpus = create_corpus(
+            session,
+            num_documents=args.documents,
+            chunks_per_document=args.chunks,
+            num_topics=NUM_TOPICS,
+        )
+        try:
+            results = {
+                mode.value: measure(session, corpus, queries, mode=mode, k=args.k)
+                for mode in RetrievalMode
+            }
+        finally:
+            drop_corpus(session)
+
+    logger.info(f"{corpus.num_chunks} chunks, k={args.k}, {args.queries} queries")
+    logger.info(f"{'mode':<8}{'p50 ms':>10}{'p95 ms':>10}{'recall@k':>10}")
+    for name, r in results.items():
+        logger.info(
+            f"{name:<8}{r['p50_ms']:>10.2f}{r['p95_ms']:>10.2f}{r['recall']:>10.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
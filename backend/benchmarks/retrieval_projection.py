@@ -0,0 +1,118 @@
+"""
+Micro-benchmark: full-entity retrieval vs. the lean column projection.
+
+The legacy query loads `DocumentChunk` entities, so every row's embedding is
+sent over the wire and parsed into a NumPy array only to be dropped. The lean
+query (`retrieve_top_k_chunks`) selects id, text, offsets and the distance.
+
+    python -m benchmarks.retrieval_projection --documents 4 --chunks 500
+"""
+
+import argparse
+import logging
+import statistics
+import time
+import tracemalloc
+from collections.abc import Callable
+from typing import Any
+from uuid import UUID
+
+from sqlalchemy import select
+from sqlmodel import Session
+
+from app.core.ai.retrieval import retrieve_top_k_chunks
+from app.core.db import engine
+from app.models import DocumentChunk
+from benchmarks.corpus import create_corpus, drop_corpus, query_embeddings
+
+logging.basicConfig(level=logging.INFO, format="%(message)s")
+logger = logging.getLogger(__name__)
+
+
+def legacy_retrieve(
+    session: Session, document_ids: list[UUID], query: list[float], k: int
+) -> list[str]:
+    stmt: Any = (
+        select(DocumentChunk)
+        .where(DocumentChunk.document_id.in_(document_ids))  # type: ignore
+        .order_by(DocumentChunk.embedding.cosine_distance(query))  # type: ignore
+        .limit(k)
+    )
+    return [chunk.text for chunk in session.execute(stmt).scalars().all()]
+
+
+def lean_retrieve(
+    session: Session, document_ids: list[UUID], query: list[float], k: int
+) -> list[str]:
+    chunks = retrieve_top_k_chunks(
+        session=session, document_ids=document_ids, query_embedding=query, k=k
+    )
+    return [chunk.text for chunk in chunks]
+
+
+def measure(
+    fn: Callable[[Session, list[UUID], list[float], int], list[str]],
+    session: Session,
+    document_ids: list[UUID],
+    queries: list[list[float]],
+    k: int,
+) -> dict[str, float]:
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        fn(session, document_ids, query, k)
+        latencies.append((time.perf_counter() - start) * 1000)
+        session.rollback()
+        session.expunge_all()
+
+    tracemalloc.start()
+    peaks = []
+    for query in queries:
+        tracemalloc.reset_peak()
+        before, _ = tracemalloc.get_traced_memory()
+        fn(session, document_ids, query, k)
+        _, peak = tracemalloc.get_traced_memory()
+        peaks.append(peak - before)
+        session.rollback()
+        session.expunge_all()
+    tracemalloc.stop()
+
+    return {
+        "p50_ms": statistics.median(latencies),
+        "mean_ms": statistics.fmean(latencies),
+        "peak_kib": statistics.fmean(peaks) / 1024,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--documents", type=int, default=4)
+    parser.add_argument("--chunks", type=int, default=500, help="per document")
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--k", type=int, default=20)
+    args = parser.parse_args()
+
+    with Session(engine) as session:
+        drop_corpus(session)
+        corpus = create_corpus(
+            session, num_documents=args.documents, chunks_per_document=args.chunks
+        )
+        queries = [q.tolist() for q in query_embeddings(args.queries)]
+        try:
+            results = {
+                name: measure(fn, session, corpus.document_ids, queries, args.k)
+                for name, fn in (("legacy", legacy_retrieve), ("lean", lean_retrieve))
+            }
+        finally:
+            drop_corpus(session)
+
+    logger.info(f"{corpus.num_chunks} chunks, k={args.k}, {args.queries} queries")
+    logger.info(f"{'query':<8}{'p50 ms':>10}{'mean ms':>10}{'peak KiB':>12}")
+    for name, r in results.items():
+        logger.info(
+            f"{name:<8}{r['p50_ms']:>10.2f}{r['mean_ms']:>10.2f}{r['peak_kib']:>12.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,352 @@
+"""
+Benchmark suite: retrieval latency, recall and index cost as the corpus grows.
+
+For each corpus scale the corpus is grown to that many chunks. Then, for each
+HNSW build setting (m, ef_construction), the indexes are rebuilt and their
+build time and size recorded, and the query workload is run in every
+retrieval mode and for every ef_search value. Latency is reported as
+p50/p95/p99. Recall@k is measured against the exact top-k, which is computed
+by streaming the embeddings through NumPy so it stays within memory at 10M
+chunks.
+
+The HNSW indexes are dropped while chunks are loaded and rebuilt with the
+migration's settings at the end, so the suite refuses to run unless
+ENVIRONMENT is "local" or --allow-reindex is given. HNSW_ITERATIVE_SCAN and
+friends are read from the environment as usual.
+
+    python -m benchmarks.retrieval_suite --scales 10000 100000 1000000
+"""
+
+import argparse
+import json
+import logging
+import time
+from dataclasses import asdict, dataclass
+from uuid import UUID
+
+import numpy as np
+from numpy.typing import NDArray
+from sqlalchemy import select, text
+from sqlmodel import Session
+
+from app.core.ai.retrieval import retrieve_top_k_chunks
+from app.core.config import settings
+from app.core.db import engine
+from app.models import DocumentChunk, RetrievalMode
+from benchmarks.corpus import (
+    create_corpus,
+    drop_corpus,
+    synthetic_embeddings,
+    topic_centers,
+    topic_terms,
+    unit_rows,
+)
+
+logging.basicConfig(level=logging.INFO, format="%(message)s")
+logger = logging.getLogger(__name__)
+
+NUM_TOPICS = 32
+# Index definitions from the migrations, and the settings they build with
+FLOAT_INDEX = ("ix_documentchunk_embedding_hnsw", "embedding vector_cosine_ops")
+BINARY_INDEX = (
+    "ix_documentchunk_embedding_bq_hnsw",
+    "(binary_quantize(embedding)::bit(1536)) bit_hamming_ops",
+)
+DEFAULT_M = 16
+DEFAULT_EF_CONSTRUCTION = 64
+
+
+@dataclass
+class IndexBuild:
+    scale: int
+    index: str
+    m: int
+    ef_construction: int
+    seconds: float
+    size_mib: float
+
+
+@dataclass
+class WorkloadResult:
+    scale: int
+    m: int
+    ef_construction: int
+    mode: str
+    ef_search: int
+    p50_ms: float
+    p95_ms: float
+    p99_ms: float
+    recall: float
+
+
+def supports_binary(session: Session) -> bool:
+    version = session.execute(
+        text("SELECT extversion FROM pg_extension WHERE extname = 'vector'")
+    ).scalar_one()
+    return tuple(int(part) for part in version.split(".")[:2]) >= (0, 7)
+
+
+def drop_index(session: Session, index: tuple[str, str]) -> None:
+    session.execute(text(f"DROP INDEX IF EXISTS {index[0]}"))
+    session.commit()
+
+
+def build_index(
+    session: Session, index: tuple[str, str], *, m: int, ef_construction: int
+) -> tuple[float, float]:
+    """(Re)build an HNSW index; returns build seconds and size in MiB."""
+    name, expression = index
+    drop_index(session, index)
+    start = time.perf_counter()
+    session.execute(
+        text(
+            f"CREATE INDEX {name} ON documentchunk USING hnsw ({expression}) "
+            f"WITH (m = {m}, ef_construction = {ef_construction})"
+        )
+    )
+    session.commit()
+    seconds = time.perf_counter() - start
+    size = session.execute(
+        text("SELECT pg_relation_size(to_regclass(:name))"), {"name": name}
+    ).scalar_one()
+    return seconds, size / 1024 / 1024
+
+
+def workload(n: int, *, seed: int = 0) -> tuple[NDArray[np.float32], list[str]]:
+    """Query embeddings, each near one topic, with text naming that topic."""
+    centers = topic_centers(NUM_TOPICS, seed=seed)
+    embeddings, topics = synthetic_embeddings(n, centers=centers, seed=seed + 10_000)
+    texts = [" ".join(topic_terms(int(topic))) for topic in topics]
+    return embeddings, texts
+
+
+def exact_top_k(
+    session: Session,
+    *,
+    document_ids: list[UUID],
+    queries: NDArray[np.float32],
+    k: int,
+    batch_size: int = 50_000,
+) -> list[set[UUID]]:
+    """Exact cosine top-k per query, streaming `batch_size` chunks at a time."""
+    queries = unit_rows(queries)
+    best_scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+    best_ids = np.full((len(queries), k), None, dtype=object)
+    stmt = (
+        select(DocumentChunk.id, DocumentChunk.embedding)  # type: ignore[call-overload]
+        .where(DocumentChunk.document_id.in_(document_ids))  # type: ignore[attr-defined]
+        .execution_options(yield_per=batch_size)
+    )
+    for rows in session.execute(stmt).partitions():
+        ids = np.array([row.id for row in rows], dtype=object)
+        similarities = queries @ unit_rows(np.vstack([r.embedding for r in rows])).T
+        scores = np.hstack([best_scores, similarities])
+        candidates = np.hstack([best_ids, np.broadcast_to(ids, similarities.shape)])
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        best_scores = np.take_along_axis(scores, top, axis=1)
+        best_ids = np.take_along_axis(candidates, top, axis=1)
+    session.rollback()
+    return [{i for i in row if i is not None} for row in best_ids]
+
+
+def run_workload(
+    session: Session,
+    *,
+    document_ids: list[UUID],
+    queries: NDArray[np.float32],
+    texts: list[str],
+    exact: list[set[UUID]],
+    mode: RetrievalMode,
+    ef_search: int,
+    k: int,
+    warmup: int,
+) -> tuple[list[float], float]:
+    """Latencies in ms (warm-up queries excluded) and mean recall@k."""
+    latencies, recalls = [], []
+    for i, (query, query_text, truth) in enumerate(
+        zip(queries, texts, exact, strict=True)
+    ):
+        start = time.perf_counter()
+        chunks = retrieve_top_k_chunks(
+            session=session,
+            document_ids=document_ids,
+            query_embedding=query.tolist(),
+            k=k,
+            mode=mode,
+            query_text=query_text,
+            ef_search=ef_search,
+        )
+        elapsed = (time.perf_counter() - start) * 1000
+        session.rollback()
+        if i >= warmup:
+            latencies.append(elapsed)
+        recalls.append(len(truth & {c.id for c in chunks}) / len(truth))
+    return latencies, float(np.mean(recalls))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--scales", type=int, nargs="+", default=[10_000, 100_000])
+    parser.add_argument("--chunks-per-document", type=int, default=5000)
+    parser.add_argument(
+        "--filter-documents",
+        type=int,
+        default=0,
+        help="search only this many documents, as an exam does (0 = all)",
+    )
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--warmup", type=int, default=10)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument(
+        "--modes",
+        nargs="+",
+        choices=[mode.value for mode in RetrievalMode],
+        default=[mode.value for mode in RetrievalMode],
+    )
+    parser.add_argument("--ef-search", type=int, nargs="+", default=[40, 100, 200])
+    parser.add_argument(
+        "--index",
+        nargs="+",
+        default=[f"{DEFAULT_M}:{DEFAULT_EF_CONSTRUCTION}"],
+        help="HNSW build settings as m:ef_construction",
+    )
+    parser.add_argument("--maintenance-work-mem", help="e.g. 2GB, for index builds")
+    parser.add_argument("--json", help="also write the results to this file")
+    parser.add_argument(
+        "--allow-reindex",
+        action="store_true",
+        help="drop and rebuild the HNSW indexes outside a local environment",
+    )
+    args = parser.parse_args()
+    if settings.ENVIRONMENT != "local" and not args.allow_reindex:
+        parser.error(
+            f"this drops and rebuilds the HNSW indexes of the {settings.ENVIRONMENT} "
+            "database; pass --allow-reindex to run it anyway"
+        )
+
+    index_settings = [tuple(int(v) for v in s.split(":")) for s in args.index]
+    modes = [RetrievalMode(mode) for mode in args.modes]
+    builds: list[IndexBuild] = []
+    results: list[WorkloadResult] = []
+
+    with Session(engine) as session:
+        indexes = [FLOAT_INDEX]
+        if supports_binary(session):
+            indexes.append(BINARY_INDEX)
+        elif RetrievalMode.binary in modes:
+            logger.warning("pgvector < 0.7: skipping binary mode")
+            modes.remove(RetrievalMode.binary)
+        if args.maintenance_work_mem:
+            session.execute(
+                text("SELECT set_config('maintenance_work_mem', :value, false)"),
+                {"value": args.maintenance_work_mem},
+            )
+
+        drop_corpus(session)
+        for index in indexes:
+            drop_index(session, index)
+        document_ids: list[UUID] = []
+        try:
+            for scale in sorted(args.scales):
+                wanted = max(1, scale // args.chunks_per_document)
+                start = time.perf_counter()
+                corpus = create_corpus(
+                    session,
+                    num_documents=wanted - len(document_ids),
+                    chunks_per_document=args.chunks_per_document,
+                    num_topics=NUM_TOPICS,
+                    first_document=len(document_ids),
+                )
+                document_ids += corpus.document_ids
+                session.execute(text("ANALYZE documentchunk"))
+                session.commit()
+                num_chunks = len(document_ids) * args.chunks_per_document
+                logger.info(
+                    f"\n{num_chunks} chunks "
+                    f"(+{corpus.num_chunks} loaded in {time.perf_counter() - start:.1f} s)"
+                )
+
+                searched = document_ids[: args.filter_documents or None]
+                queries, texts = workload(args.queries)
+                start = time.perf_counter()
+                exact = exact_top_k(
+                    session, document_ids=searched, queries=queries, k=args.k
+                )
+                logger.info(f"exact top-k in {time.perf_counter() - start:.1f} s")
+
+                for m, ef_construction in index_settings:
+                    for index in indexes:
+                        seconds, size_mib = build_index(
+                            session, index, m=m, ef_construction=ef_construction
+                        )
+                        builds.append(
+                            IndexBuild(
+                                num_chunks,
+                                index[0],
+                                m,
+                                ef_construction,
+                                seconds,
+                                size_mib,
+                            )
+                        )
+                        logger.info(
+                            f"m={m} ef_construction={ef_construction} {index[0]}: "
+                            f"built in {seconds:.1f} s, {size_mib:.1f} MiB"
+                        )
+
+                    logger.info(
+                        f"{'mode':<8}{'ef_search':>10}{'p50 ms':>9}{'p95 ms':>9}"
+                        f"{'p99 ms':>9}{'recall@k':>10}"
+                    )
+                    for mode in modes:
+                        for ef_search in args.ef_search:
+                            latencies, recall = run_workload(
+                                session,
+                                document_ids=searched,
+                                queries=queries,
+                                texts=texts,
+                                exact=exact,
+                                mode=mode,
+                                ef_search=ef_search,
+                                k=args.k,
+                                warmup=args.warmup,
+                            )
+                            p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+                            results.append(
+                                WorkloadResult(
+                                    num_chunks,
+                                    m,
+                                    ef_construction,
+                                    mode.value,
+                                    ef_search,
+                                    float(p50),
+                                    float(p95),
+                                    float(p99),
+                                    recall,
+                                )
+                            )
+                            logger.info(
+                                f"{mode.value:<8}{ef_search:>10}{p50:>9.2f}"
+                                f"{p95:>9.2f}{p99:>9.2f}{recall:>10.3f}"
+                            )
+        finally:
+            drop_corpus(session)
+            for index in indexes:
+                build_index(
+                    session, index, m=DEFAULT_M, ef_construction=DEFAULT_EF_CONSTRUCTION
+                )
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(
+                {
+                    "index_builds": [asdict(b) for b in builds],
+                    "workloads": [asdict(r) for r in results],
+                },
+                f,
+                indent=2,
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+Benchmark: embeddings as Python float lists with text transfer vs. float32
+arrays with pgvector's binary format.
+
+Reports the memory held per embedding in each representation and the
+insert and fetch throughput of both wire formats. The transfers use an
+unindexed temporary table, so HNSW maintenance does not hide the cost of
+encoding and parsing.
+
+    python -m benchmarks.vector_transfer --chunks 5000
+"""
+
+import argparse
+import logging
+import time
+import tracemalloc
+from collections.abc import Callable
+from typing import Any
+
+import numpy as np
+from pgvector import Vector  # type: ignore[import-untyped]
+from sqlmodel import Session
+
+from app.core.db import engine
+from app.core.vectors import EMBEDDING_DIM
+
+logging.basicConfig(level=logging.INFO, format="%(message)s")
+logger = logging.getLogger(__name__)
+
+INSERT = "INSERT INTO benchmark_vectors (embedding) VALUES ({placeholder})"
+FETCH = "SELECT embedding FROM benchmark_vectors"
+
+
+def bytes_per_embedding(make: Callable[[], Any], n: int) -> float:
+    tracemalloc.start()
+    held = [make() for _ in range(n)]
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del held
+    return size / n
+
+
+def timed(action: Callable[[], Any]) -> float:
+    start = time.perf_counter()
+    action()
+    return time.perf_counter() - start
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--chunks", type=int, default=5000)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    embeddings = rng.standard_normal((args.chunks, EMBEDDING_DIM), dtype=np.float32)
+
+    list_bytes = bytes_per_embedding(lambda: embeddings[0].tolist(), 1000)
+    array_bytes = bytes_per_embedding(lambda: embeddings[0].copy(), 1000)
+
+    with Session(engine) as session:
+        connection: Any = session.connection().connection.dbapi_connection
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"CREATE TEMPORARY TABLE benchmark_vectors (embedding vector({EMBEDDING_DIM}))"
+            )
+            # Before: vectors formatted as text, then parsed by the server
+            insert_text = timed(
+                lambda: cursor.executemany(
+                    INSERT.format(placeholder="%s::vector"),
+                    [(Vector._to_db(e),) for e in embeddings],
+                )
+            )
+            cursor.execute("TRUNCATE benchmark_vectors")
+            # After: float32 arrays through pgvector's binary dumper
+            insert_binary = timed(
+                lambda: cursor.executemany(
+                    INSERT.format(placeholder="%b"), [(e,) for e in embeddings]
+                )
+            )
+
+        def fetch(binary: bool) -> None:
+            with connection.cursor(binary=binary) as cursor:
+                cursor.execute(FETCH)
+                cursor.fetchall()
+
+        fetch_text = timed(lambda: fetch(False))
+        fetch_binary = timed(lambda: fetch(True))
+        session.rollback()
+
+    def rate(seconds: float) -> str:
+        return f"{args.chunks / seconds:>12,.0f}/s"
+
+    logger.info(f"{args.chunks} embeddings of {EMBEDDING_DIM} dimensions")
+    logger.info(f"{'':<16}{'text + list':>16}{'binary + float32':>18}")
+    logger.info(
+        f"{'memory/chunk':<16}{list_bytes / 1024:>13.1f} KiB{array_bytes / 1024:>15.1f} KiB"
+    )
+    logger.info(f"{'insert':<16}{rate(insert_text):>16}{rate(insert_binary):>18}")
+    logger.info(f"{'fetch':<16}{rate(fetch_text):>16}{rate(fetch_binary):>18}")
+
+
+if __name__ == "__main__":
+    main()
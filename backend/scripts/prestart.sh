@@ -6,8 +6,8 @@ set -x
 # Let the DB start
 python app/backend_pre_start.py
 
-# Run migrations
-# alembic upgrade head  # DISABLED: Using direct table creation instead
-
-# Create initial data in DB
+# Create tables and initial data in DB
 python app/initial_data.py
+
+# Run migrations (columns and indexes on tables created above)
+alembic upgrade head
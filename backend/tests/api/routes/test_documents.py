@@ -5,8 +5,11 @@ from unittest.mock import patch
 from fastapi.testclient import TestClient
 from sqlmodel import Session
 
+from app import crud
 from app.core.config import settings
+from app.models import DocumentChunk
 from tests.utils.document import create_random_document  # type: ignore
+from tests.utils.utils import random_lower_string
 
 
 def skip_test_create_document_real_s3(
@@ -559,3 +562,97 @@ def test_update_document_status_preserved(
     content = response.json()
     assert content["filename"] == "updated.pdf"
     assert content["status"] == "ready"  # Status should be preserved (READY)
+
+
+def add_search_chunks(db: Session, document_id: uuid.UUID, texts: list[str]) -> None:
+    db.add_all(
+        [
+            DocumentChunk(document_id=document_id, text=text, size=len(text))
+            for text in texts
+        ]
+    )
+    db.commit()
+
+
+def test_search_documents(
+    client: TestClient, superuser_token_headers: dict[str, str], db: Session
+) -> None:
+    superuser = crud.get_user_by_email(session=db, email=settings.FIRST_SUPERUSER)
+    assert superuser
+    term = f"zyx{random_lower_string()[:8]}"
+    own = create_random_document(db, superuser)
+    add_search_chunks(
+        db,
+        own.id,
+        [f"The {term} appears once here.", f"{term} and {term} appear twice."],
+    )
+    other = create_random_document(db)
+    add_search_chunks(db, other.id, [f"Someone else's {term}."])
+
+    response = client.get(
+        f"{settings.API_V1_STR}/documents/search",
+        headers=superuser_token_headers,
+        params={"q": term},
+    )
+
+    assert response.status_code == 200
+    content = response.json()
+    assert [hit["document_id"] for hit in content["data"]] == [str(own.id)] * 2
+    assert content["data"][0]["rank"] >= content["data"][1]["rank"]
+    assert content["data"][0]["filename"] == own.filename
+    hit = content["data"][0]
+    start, end = hit["highlights"][0]
+    assert hit["snippet"][start:end] == term
+    assert content["next_cursor"] is None
+
+
+def test_search_documents_keyset_pagination(
+    client: TestClient, superuser_token_headers: dict[str, str], db: Session
+) -> None:
+    superuser = crud.get_user_by_email(session=db, email=settings.FIRST_SUPERUSER)
+    assert superuser
+    term = f"zyx{random_lower_string()[:8]}"
+    document = create_random_document(db, superuser)
+    add_search_chunks(db, document.id, [f"{term} chunk {i}" for i in range(3)])
+
+    seen: list[str] = []
+    cursor = None
+    for _ in range(3):
+        params = {"q": term, "limit": 2} | ({"cursor": cursor} if cursor else {})
+        response = client.get(
+            f"{settings.API_V1_STR}/documents/search",
+            headers=superuser_token_headers,
+            params=params,
+        )
+        assert response.status_code == 200
+        content = response.json()
+        seen += [hit["chunk_id"] for hit in content["data"]]
+        cursor = content["next_cursor"]
+        if cursor is None:
+            break
+
+    assert len(seen) == 3
+    assert len(set(seen)) == 3
+
+
+def test_search_documents_invalid_cursor(
+    client: TestClient, superuser_token_headers: dict[str, str]
+) -> None:
+    response = client.get(
+        f"{settings.API_V1_STR}/documents/search",
+        headers=superuser_token_headers,
+        params={"q": "entropy", "cursor": "not-a-cursor"},
+    )
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Invalid cursor"
+
+
+def test_search_documents_requires_query(
+    client: TestClient, superuser_token_headers: dict[str, str]
+) -> None:
+    response = client.get(
+        f"{settings.API_V1_STR}/documents/search",
+        headers=superuser_token_headers,
+        params={"q": ""},
+    )
+    assert response.status_code == 422
@@ -1,13 +1,31 @@
+import json
 import uuid
+from collections.abc import AsyncIterator
+from datetime import datetime, timedelta, timezone
+from typing import Any
 from unittest.mock import patch
 
+import pytest
+from fastapi import HTTPException
 from fastapi.testclient import TestClient
-from sqlmodel import Session
+from sqlmodel import Session, select
 
+from app import crud
 from app.core.config import settings
-from app.models import Difficulty, QuestionCreate, QuestionType
+from app.core.db import engine
+from app.core.exam_jobs import expire_lost_job, run_exam_generation_job
+from app.models import (
+    Difficulty,
+    Exam,
+    ExamGenerationJob,
+    ExamJobStatus,
+    GenerateQuestionsPublic,
+    QuestionCreate,
+    QuestionType,
+)
 from tests.utils.document import create_random_documents
 from tests.utils.exam import create_random_exam
+from tests.utils.user import create_random_user
 
 
 def test_generate_exam(
@@ -33,7 +51,7 @@ def test_generate_exam(
     payload = {"document_ids": document_ids, "title": "Test Exam"}
 
     with patch(
-        "app.api.routes.exams.generate_questions_from_documents",
+        "app.core.exam_jobs.generate_questions_cached",
         return_value=mock_questions,
     ) as mock_generate:
         response = client.post(
@@ -48,6 +66,7 @@ def test_generate_exam(
         assert call_args[1]["num_questions"] == 5  # default
         assert call_args[1]["difficulty"] is None  # default
         assert call_args[1]["question_types"] is None  # default
+        assert call_args[1]["topics"] == []  # default
 
     # Response should now contain ExamPublic object with id and owner_id
     assert response.status_code == 200, "Unexpected response status code"
@@ -87,10 +106,11 @@ def test_generate_exam_with_customization(
         "num_questions": 7,
         "difficulty": "hard",
         "question_types": ["multiple_choice"],
+        "topics": [" osmosis ", ""],
     }
 
     with patch(
-        "app.api.routes.exams.generate_questions_from_documents",
+        "app.core.exam_jobs.generate_questions_cached",
         return_value=mock_questions,
     ) as mock_generate:
         response = client.post(
@@ -108,6 +128,7 @@ def test_generate_exam_with_customization(
     assert call_args[1]["num_questions"] == 7
     assert call_args[1]["difficulty"] == Difficulty.hard
     assert call_args[1]["question_types"] == [QuestionType.multiple_choice]
+    assert call_args[1]["topics"] == ["osmosis"]
 
     # Verify exam was created with correct title
     assert content["title"] == "Customized Test Exam", "Exam title should match payload"
@@ -141,7 +162,7 @@ def test_generate_exam_with_partial_customization(
     }
 
     with patch(
-        "app.api.routes.exams.generate_questions_from_documents",
+        "app.core.exam_jobs.generate_questions_cached",
         return_value=mock_questions,
     ) as mock_generate:
         response = client.post(
@@ -203,6 +224,347 @@ def skip_test_generate_exam_real(
     ), f"Number of questions in exam should match generated questions. content: {content}"
 
 
+def test_generate_exam_failure_leaves_no_exam(
+    client: TestClient, superuser_token_headers: dict[str, str], db: Session
+) -> None:
+    """Test that a failed generation does not leave an empty exam behind."""
+    documents = create_random_documents(db)
+    title = f"Failed exam {uuid.uuid4()}"
+
+    with patch(
+        "app.core.exam_jobs.generate_questions_cached",
+        side_effect=HTTPException(status_code=500, detail="Failed to generate"),
+    ):
+        response = client.post(
+            f"{settings.API_V1_STR}/exams/generate",
+            headers=superuser_token_headers,
+            json={"document_ids": [str(doc.id) for doc in documents], "title": title},
+        )
+
+    assert response.status_code == 500
+    assert db.exec(select(Exam).where(Exam.title == title)).first() is None
+
+
+def test_generate_exam_async(
+    client: TestClient, superuser_token_headers: dict[str, str], db: Session
+) -> None:
+    """Test that an async generation returns a job whose result is the exam."""
+    documents = create_random_documents(db)
+    mock_questions = [
+        QuestionCreate(
+            question=f"Generated question {i}",
+            correct_answer="some answer",
+            type=QuestionType.multiple_choice,
+            options=["option1", "option2", "option3"],
+        )
+        for i in range(1, 4)
+    ]
+
+    with patch(
+        "app.core.exam_jobs.generate_questions_cached",
+        return_value=mock_questions,
+    ):
+        response = client.post(
+            f"{settings.API_V1_STR}/exams/generate?async=true",
+            headers=superuser_token_headers,
+            json={
+                "document_ids": [str(doc.id) for doc in documents],
+                "title": "Async Exam",
+            },
+        )
+
+    assert response.status_code == 202
+    job = response.json()
+    assert job["status"] == ExamJobStatus.queued
+    assert job["exam_id"] is None
+
+    # The test client runs background tasks before returning
+    response = client.get(
+        f"{settings.API_V1_STR}/exams/jobs/{job['id']}",
+        headers=superuser_token_headers,
+    )
+    assert response.status_code == 200
+    job = response.json()
+    assert job["status"] == ExamJobStatus.succeeded
+    assert job["finished_at"] is not None
+
+    response = client.get(
+        f"{settings.API_V1_STR}/exams/jobs/{job['id']}/result",
+        headers=superuser_token_headers,
+    )
+    assert response.status_code == 200
+    content = response.json()
+    assert content["id"] == job["exam_id"]
+    assert content["title"] == "Async Exam"
+    assert len(content["questions"]) == 3
+
+
+def test_generate_exam_async_failure(
+    client: TestClient, superuser_token_headers: dict[str, str], db: Session
+) -> None:
+    """Test that a failed job records its error and creates no exam."""
+    documents = create_random_documents(db)
+    title = f"Failed async exam {uuid.uuid4()}"
+
+    with patch(
+        "app.core.exam_jobs.generate_questions_cached",
+        side_effect=HTTPException(status_code=500, detail="Failed to generate"),
+    ):
+        response = client.post(
+            f"{settings.API_V1_STR}/exams/generate?async=true",
+            headers=superuser_token_headers,
+            json={"document_ids": [str(doc.id) for doc in documents], "title": title},
+        )
+
+    assert response.status_code == 202
+    job_id = response.json()["id"]
+    response = client.get(
+        f"{settings.API_V1_STR}/exams/jobs/{job_id}",
+        headers=superuser_token_headers,
+    )
+    job = response.json()
+    assert job["status"] == ExamJobStatus.failed
+    assert job["error"] == "Failed to generate"
+
+    response = client.get(
+        f"{settings.API_V1_STR}/exams/jobs/{job_id}/result",
+        headers=superuser_token_headers,
+    )
+    assert response.status_code == 409
+    assert db.exec(select(Exam).where(Exam.title == title)).first() is None
+
+
+def test_read_exam_generation_result_of_unfinished_job(
+    client: TestClient, superuser_token_headers: dict[str, str], db: Session
+) -> None:
+    """Test that polling the result of a queued or running job is a 409."""
+    superuser = crud.get_user_by_email(session=db, email=settings.FIRST_SUPERUSER)
+    assert superuser is not None
+    job = crud.create_exam_generation_job(
+        session=db,
+        payload=GenerateQuestionsPublic(document_ids=[], title="Unfinished"),
+        owner_id=superuser.id,
+    )
+
+    for status in (ExamJobStatus.queued, ExamJobStatus.running):
+        job.status = status
+        db.add(job)
+        db.commit()
+        response = client.get(
+            f"{settings.API_V1_STR}/exams/jobs/{job.id}/result",
+            headers=superuser_token_headers,
+        )
+
+        assert response.status_code == 409
+        assert response.json()["detail"] == f"Job is {status.value}"
+
+
+def test_read_exam_generation_job_expires_only_long_running_jobs(
+    client: TestClient, superuser_token_headers: dict[str, str], db: Session
+) -> None:
+    """Test that a job is lost by how long it runs, not how long it queued."""
+    superuser = crud.get_user_by_email(session=db, email=settings.FIRST_SUPERUSER)
+    assert superuser is not None
+    long_ago = datetime.now(timezone.utc) - timedelta(
+        seconds=3 * settings.EXAM_JOB_TIMEOUT_SECONDS
+    )
+    queued, running = (
+        crud.create_exam_generation_job(
+            session=db,
+            payload=GenerateQuestionsPublic(document_ids=[], title="Old job"),
+            owner_id=superuser.id,
+        )
+        for _ in range(2)
+    )
+    queued.created_at = long_ago
+    running.created_at = long_ago
+    running.status = ExamJobStatus.running
+    running.started_at = long_ago
+    db.add_all([queued, running])
+    db.commit()
+
+    statuses = [
+        client.get(
+            f"{settings.API_V1_STR}/exams/jobs/{job.id}",
+            headers=superuser_token_headers,
+        ).json()
+        for job in (queued, running)
+    ]
+
+    assert statuses[0]["status"] == ExamJobStatus.queued
+    assert statuses[1]["status"] == ExamJobStatus.failed
+    assert statuses[1]["error"] == "Exam generation job was lost"
+
+
+@pytest.mark.asyncio
+async def test_run_exam_generation_job_keeps_expired_job_failed(db: Session) -> None:
+    """Test that a job expired while running is not finished after all."""
+    superuser = crud.get_user_by_email(session=db, email=settings.FIRST_SUPERUSER)
+    assert superuser is not None
+    title = f"Expired job {uuid.uuid4()}"
+    job = crud.create_exam_generation_job(
+        session=db,
+        payload=GenerateQuestionsPublic(document_ids=[], title=title),
+        owner_id=superuser.id,
+    )
+
+    async def generate_until_expired(*_: Any, **__: Any) -> list[QuestionCreate]:
+        with Session(engine) as session:
+            running = session.get(ExamGenerationJob, job.id)
+            assert running and running.status == ExamJobStatus.running
+            assert running.started_at is not None
+            running.started_at -= timedelta(
+                seconds=3 * settings.EXAM_JOB_TIMEOUT_SECONDS
+            )
+            expire_lost_job(session, running)
+        return []
+
+    with patch(
+        "app.core.exam_jobs.generate_questions_cached",
+        side_effect=generate_until_expired,
+    ):
+        await run_exam_generation_job(job.id)
+
+    db.refresh(job)
+    assert job.status == ExamJobStatus.failed
+    assert job.error == "Exam generation job was lost"
+    assert db.exec(select(Exam).where(Exam.title == title)).first() is None
+
+
+def test_read_exam_generation_job_not_enough_permissions(
+    client: TestClient, normal_user_token_headers: dict[str, str], db: Session
+) -> None:
+    """Test that users cannot read other users' jobs."""
+    owner = create_random_user(db)
+    job = crud.create_exam_generation_job(
+        session=db,
+        payload=GenerateQuestionsPublic(document_ids=[], title="Not yours"),
+        owner_id=owner.id,
+    )
+
+    response = client.get(
+        f"{settings.API_V1_STR}/exams/jobs/{job.id}",
+        headers=normal_user_token_headers,
+    )
+
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Not enough permissions"
+
+
+def parse_sse(body: str) -> list[tuple[str, Any]]:
+    events = []
+    for block in body.strip().split("\n\n"):
+        event, data = block.split("\n")
+        events.append(
+            (event.removeprefix("event: "), json.loads(data[len("data: ") :]))
+        )
+    return events
+
+
+def test_generate_exam_stream(
+    client: TestClient, superuser_token_headers: dict[str, str], db: Session
+) -> None:
+    """Test that questions are saved and streamed one by one."""
+    documents = create_random_documents(db)
+    mock_questions = [
+        QuestionCreate(
+            question=f"Streamed question {i}",
+            correct_answer="A",
+            type=QuestionType.multiple_choice,
+            options=["A", "B", "C"],
+        )
+        for i in range(3)
+    ]
+
+    async def fake_stream(*_: Any, **__: Any) -> AsyncIterator[QuestionCreate]:
+        for question in mock_questions:
+            yield question
+
+    with patch(
+        "app.api.routes.exams.stream_questions_banked", side_effect=fake_stream
+    ) as mock_stream:
+        response = client.post(
+            f"{settings.API_V1_STR}/exams/generate/stream",
+            headers=superuser_token_headers,
+            json={
+                "document_ids": [str(doc.id) for doc in documents],
+                "title": "Streamed Exam",
+                "num_questions": 3,
+            },
+        )
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    events = parse_sse(response.text)
+    assert [event for event, _ in events] == [
+        "exam",
+        "question",
+        "question",
+        "question",
+        "done",
+    ]
+    exam = events[0][1]
+    assert exam["title"] == "Streamed Exam"
+    assert mock_stream.call_args.kwargs["num_questions"] == 3
+    assert [data["question"] for _, data in events[1:4]] == [
+        q.question for q in mock_questions
+    ]
+    assert events[-1][1] == {"exam_id": exam["id"], "count": 3}
+
+    saved = client.get(
+        f"{settings.API_V1_STR}/exams/{exam['id']}", headers=superuser_token_headers
+    ).json()
+    assert sorted(q["question"] for q in saved["questions"]) == [
+        q.question for q in mock_questions
+    ]
+
+
+def test_generate_exam_stream_error_before_first_question(
+    client: TestClient, superuser_token_headers: dict[str, str], db: Session
+) -> None:
+    """Test that a failed generation is reported and its empty exam removed."""
+    documents = create_random_documents(db)
+
+    async def failing_stream(*_: Any, **__: Any) -> AsyncIterator[QuestionCreate]:
+        raise HTTPException(status_code=500, detail="Failed to generate questions")
+        yield
+
+    with patch(
+        "app.api.routes.exams.stream_questions_banked", side_effect=failing_stream
+    ):
+        response = client.post(
+            f"{settings.API_V1_STR}/exams/generate/stream",
+            headers=superuser_token_headers,
+            json={"document_ids": [str(doc.id) for doc in documents], "title": "X"},
+        )
+
+    events = parse_sse(response.text)
+    assert [event for event, _ in events] == ["exam", "error"]
+    assert events[1][1] == {"detail": "Failed to generate questions"}
+    assert db.get(Exam, uuid.UUID(events[0][1]["id"])) is None
+
+
+def test_generate_exam_stream_documents_not_ready(
+    client: TestClient, superuser_token_headers: dict[str, str], db: Session
+) -> None:
+    """Test that an exam is only created once its texts are fetched."""
+    documents = create_random_documents(db)
+    title = f"Not ready {uuid.uuid4()}"
+
+    with patch(
+        "app.api.routes.exams.fetch_texts_by_document",
+        side_effect=HTTPException(status_code=409, detail="Not ready"),
+    ):
+        response = client.post(
+            f"{settings.API_V1_STR}/exams/generate/stream",
+            headers=superuser_token_headers,
+            json={"document_ids": [str(doc.id) for doc in documents], "title": title},
+        )
+
+    assert response.status_code == 409
+    assert db.exec(select(Exam).where(Exam.title == title)).first() is None
+
+
 def test_read_exam(
     client: TestClient, superuser_token_headers: dict[str, str], db: Session
 ) -> None:
@@ -1,4 +1,5 @@
 from collections.abc import Generator
+from unittest.mock import patch
 
 import pytest
 from fastapi.testclient import TestClient
@@ -32,6 +33,16 @@ def _rollback_after_test(db: Session) -> Generator[None, None, None]:
     db.rollback()
 
 
+@pytest.fixture
+def estimated_token_counts() -> Generator[None, None, None]:
+    """
+    Count 4 characters a token, whether or not tiktoken can load its encodings,
+    for tests whose figures assume the estimate.
+    """
+    with patch("app.core.ai.tokens.get_encoding", return_value=None):
+        yield
+
+
 @pytest.fixture(scope="module")
 def client() -> Generator[TestClient, None, None]:
     with TestClient(app) as c:
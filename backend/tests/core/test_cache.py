@@ -0,0 +1,89 @@
+from unittest.mock import patch
+
+import pytest
+from sqlmodel import Session
+
+from app.core.cache import EveryNth, LRUCache, try_transaction_lock
+
+
+def test_lru_cache_evicts_least_recently_used() -> None:
+    cache: LRUCache[str, int] = LRUCache(max_items=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1  # "b" is now the oldest
+    cache.set("c", 3)
+
+    assert "b" not in cache
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+
+
+def test_lru_cache_byte_budget() -> None:
+    cache: LRUCache[str, bytes] = LRUCache(max_bytes=10, sizeof=len)
+    cache.set("a", b"12345")
+    cache.set("b", b"12345")
+    cache.set("c", b"123")
+
+    assert "a" not in cache
+    assert cache.nbytes == 8
+
+
+def test_lru_cache_rejects_oversized_value() -> None:
+    cache: LRUCache[str, bytes] = LRUCache(max_bytes=4, sizeof=len)
+
+    assert cache.set("a", b"12345") is False
+    assert len(cache) == 0
+
+
+def test_lru_cache_max_bytes_requires_sizeof() -> None:
+    with pytest.raises(ValueError):
+        LRUCache(max_bytes=10)
+
+
+def test_lru_cache_ttl_expiry() -> None:
+    cache: LRUCache[str, int] = LRUCache(ttl_seconds=60)
+    with patch("app.core.cache.time.monotonic", return_value=1000.0):
+        cache.set("a", 1)
+    with patch("app.core.cache.time.monotonic", return_value=1030.0):
+        assert cache.get("a") == 1
+    with patch("app.core.cache.time.monotonic", return_value=1061.0):
+        assert cache.get("a") is None
+    assert len(cache) == 0
+
+
+def test_lru_cache_discard_where() -> None:
+    cache: LRUCache[str, int] = LRUCache()
+    for key, value in [("a", 1), ("b", 2), ("c", 3)]:
+        cache.set(key, value)
+
+    removed = cache.discard_where(lambda _, value: value % 2 == 1)
+
+    assert removed == 2
+    assert "b" in cache
+    assert len(cache) == 1
+
+
+def test_every_nth_is_due_on_first_call_then_every_n() -> None:
+    schedule = EveryNth(3)
+
+    assert [schedule.due() for _ in range(7)] == [
+        True,
+        False,
+        False,
+        True,
+        False,
+        False,
+        True,
+    ]
+
+
+def test_try_transaction_lock_is_exclusive_until_commit(db: Session) -> None:
+    with Session(db.get_bind()) as other:
+        assert try_transaction_lock(other, "test lock")
+        assert not try_transaction_lock(db, "test lock")
+        assert try_transaction_lock(db, "other lock")
+        db.rollback()
+        other.commit()
+
+    assert try_transaction_lock(db, "test lock")
+    db.rollback()
@@ -0,0 +1,230 @@
+import uuid
+from collections.abc import Generator
+from unittest.mock import patch
+
+import numpy as np
+import pytest
+from sqlmodel import Session, delete
+
+from app.core.ai import clustering
+from app.core.ai.clustering import (
+    get_chunk_clusters,
+    invalidate_document,
+    kmeans,
+    representative_texts,
+    select_excerpts,
+    selection_order,
+    share_budget,
+)
+from app.core.ai.vector_cache import load_chunk_matrix
+from app.core.config import settings
+from app.core.vectors import EMBEDDING_DIM
+from app.models import Document, DocumentChunk, RetrievedChunk
+from tests.utils.document import create_random_document
+
+
+@pytest.fixture(autouse=True)
+def empty_cache() -> Generator[None, None, None]:
+    clustering._document_set_clusters.clear()
+    yield
+    clustering._document_set_clusters.clear()
+
+
+def near(axis: int, seed: int, dim: int = EMBEDDING_DIM) -> np.ndarray:
+    """A unit vector close to the `axis` basis vector."""
+    noise = np.random.default_rng(seed).normal(0, 0.1 / np.sqrt(dim), dim)
+    vector = noise.astype(np.float32)
+    vector[axis] += 1.0
+    return vector / np.linalg.norm(vector)
+
+
+def make_chunk(
+    text: str, document_id: uuid.UUID, start_offset: int, token_count: int = 3
+) -> RetrievedChunk:
+    return RetrievedChunk(
+        id=uuid.uuid4(),
+        document_id=document_id,
+        text=text,
+        distance=0.0,
+        start_offset=start_offset,
+        token_count=token_count,
+    )
+
+
+def test_kmeans_separates_blobs_deterministically() -> None:
+    points = np.vstack([near(axis, seed, 8) for axis in range(3) for seed in range(4)])
+
+    centroids, labels = kmeans(points, 3)
+    _, again = kmeans(points, 3)
+
+    assert centroids.shape == (3, 8)
+    assert [len(set(labels[i : i + 4])) for i in (0, 4, 8)] == [1, 1, 1]
+    assert len(set(labels)) == 3
+    np.testing.assert_array_equal(labels, again)
+
+
+def test_kmeans_caps_clusters_at_points() -> None:
+    points = np.vstack([near(0, 0, 4), near(1, 1, 4)])
+
+    centroids, labels = kmeans(points, 5)
+
+    assert len(centroids) == 2
+    assert sorted(labels) == [0, 1]
+
+
+def test_selection_order_is_round_robin_nearest_first() -> None:
+    labels = np.array([0, 0, 1, 1, 0], dtype=np.intp)
+    distances = np.array([0.3, 0.1, 0.2, 0.4, 0.5], dtype=np.float32)
+
+    assert selection_order(labels, distances).tolist() == [1, 2, 0, 3, 4]
+
+
+def test_share_budget_is_proportional() -> None:
+    small, large = uuid.uuid4(), uuid.uuid4()
+
+    assert share_budget({small: 100, large: 300}, 40) == {small: 10, large: 30}
+
+
+def test_select_excerpts_respects_budgets_and_reading_order() -> None:
+    first, second = uuid.uuid4(), uuid.uuid4()
+    chunks = [
+        make_chunk("delta", first, 20),
+        make_chunk("zeta", second, 0),
+        make_chunk("alpha beta", first, 0),
+        make_chunk("beta gamma", first, 6),
+        make_chunk("eta", second, 10),
+    ]
+
+    excerpts = select_excerpts(chunks, {first: 9, second: 3})
+
+    # "alpha beta" and "beta gamma" overlap and are merged; "delta" is apart
+    assert excerpts == {first: "alpha beta gamma\n\ndelta", second: "zeta"}
+
+
+def test_representative_texts_keeps_material_within_budget(db: Session) -> None:
+    document = create_random_document(db)
+    texts = {document.id: "Short material"}
+
+    with patch("app.core.ai.clustering.get_chunk_clusters") as clusters:
+        assert representative_texts(db, texts, [document.id]) == texts
+
+    clusters.assert_not_called()
+
+
+def add_chunks(db: Session, document_id: uuid.UUID, axes: list[int]) -> list[str]:
+    texts = [f"Topic {axis} passage {i}" for i, axis in enumerate(axes)]
+    db.add_all(
+        [
+            DocumentChunk(
+                document_id=document_id,
+                text=text,
+                size=len(text),
+                start_offset=100 * i,
+                token_count=3,
+                embedding=near(axis, i),
+            )
+            for i, (text, axis) in enumerate(zip(texts, axes, strict=True))
+        ]
+    )
+    db.commit()
+    return texts
+
+
+def test_representative_texts_cover_every_document_and_topic(db: Session) -> None:
+    first = create_random_document(db)
+    second = create_random_document(db)
+    add_chunks(db, first.id, [0, 0, 1, 1])
+    add_chunks(db, second.id, [2, 2, 2, 2])
+    digested = uuid.uuid4()
+    texts = {
+        first.id: "x" * 80,
+        second.id: "y" * 80,
+        digested: "Key concepts:\n- Osmosis",
+    }
+
+    with (
+        patch.object(settings, "GENERATION_CONTEXT_TOKENS", 20),
+        patch.object(clustering, "TOKENS_PER_CLUSTER", 5),
+        patch(
+            "app.core.ai.clustering.load_chunk_matrix", wraps=load_chunk_matrix
+        ) as load,
+    ):
+        result = representative_texts(db, texts, [first.id, second.id])
+        again = representative_texts(db, texts, [first.id, second.id])
+
+    load.assert_called_once()
+    assert again == result
+    # The digest is kept; sized by their chunks' 12 tokens, each document's
+    # share of 20 tokens is 7 or 8: two chunks, one from each of its topics
+    assert result[digested] == texts[digested]
+    assert result[first.id].count("Topic 0") == 1
+    assert result[first.id].count("Topic 1") == 1
+    assert result[second.id].count("Topic 2") == 2
+
+
+@pytest.mark.usefixtures("estimated_token_counts")
+def test_representative_texts_cut_documents_without_embeddings(db: Session) -> None:
+    document = create_random_document(db)
+    texts = {document.id: "word " * 100}
+
+    with patch.object(settings, "GENERATION_CONTEXT_TOKENS", 20):
+        result = representative_texts(db, texts, [document.id])
+
+    assert texts[document.id].startswith(result[document.id])
+    assert len(result[document.id]) == 80
+
+
+def test_representative_texts_cut_documents_too_large_to_cluster(
+    db: Session,
+) -> None:
+    document = create_random_document(db)
+    add_chunks(db, document.id, [0, 1, 2])
+    texts = {document.id: "word " * 100}
+
+    with (
+        patch.object(settings, "GENERATION_CONTEXT_TOKENS", 4),
+        patch("app.core.ai.clustering.estimate_matrix_bytes", return_value=1 << 40),
+        patch("app.core.ai.clustering.load_chunk_matrix") as load,
+    ):
+        result = representative_texts(db, texts, [document.id])
+
+    load.assert_not_called()
+    assert texts[document.id].startswith(result[document.id])
+
+
+def test_get_chunk_clusters_recluster_changed_documents(db: Session) -> None:
+    """Test that a change made elsewhere (another worker) is picked up."""
+    document = create_random_document(db)
+    add_chunks(db, document.id, [0, 1])
+
+    first = get_chunk_clusters(db, [document.id], 2)
+    assert first is get_chunk_clusters(db, [document.id], 2)
+
+    # Re-extracted by another worker: this worker's cache is not invalidated
+    with Session(db.get_bind()) as other:
+        other.execute(
+            delete(DocumentChunk).where(
+                DocumentChunk.document_id == document.id,
+                DocumentChunk.start_offset > 0,
+            )
+        )
+        changed = other.get(Document, document.id)
+        assert changed
+        changed.chunk_count = 1
+        other.add(changed)
+        other.commit()
+
+    assert len(first.chunks) == 2
+    assert len(get_chunk_clusters(db, [document.id], 2).chunks) == 1
+
+
+def test_invalidate_document_drops_its_document_sets() -> None:
+    kept, dropped = uuid.uuid4(), uuid.uuid4()
+    empty = clustering.ChunkClusters(chunks=[], num_clusters=0)
+    clustering._document_set_clusters.set((frozenset([kept]), 1), empty)
+    clustering._document_set_clusters.set((frozenset([kept, dropped]), 1), empty)
+
+    invalidate_document(str(dropped))
+
+    assert (frozenset([kept]), 1) in clustering._document_set_clusters
+    assert len(clustering._document_set_clusters) == 1
@@ -0,0 +1,138 @@
+import uuid
+
+import numpy as np
+import pytest
+
+from app.core.ai.context import (
+    join_by_document,
+    merge_overlapping,
+    mmr_select,
+    pack_context,
+    trim_to_budget,
+)
+from app.core.ai.tokens import count_tokens
+from app.models import RetrievedChunk
+
+
+def make_chunk(
+    text: str,
+    *,
+    start_offset: int | None = None,
+    document_id: uuid.UUID | None = None,
+    embedding: list[float] | None = None,
+    distance: float = 0.1,
+    token_count: int | None = None,
+) -> RetrievedChunk:
+    return RetrievedChunk(
+        id=uuid.uuid4(),
+        document_id=document_id or uuid.uuid4(),
+        text=text,
+        distance=distance,
+        start_offset=start_offset,
+        token_count=token_count,
+        embedding=None if embedding is None else np.asarray(embedding, np.float32),
+    )
+
+
+EMBEDDINGS = np.array(
+    [[1.0, 0.0, 0.0], [0.98, 0.2, 0.0], [0.5, 0.0, 0.866]], dtype=np.float32
+)
+RELEVANCE = [0.909, 0.911, 0.805]
+
+
+def test_mmr_select_skips_near_duplicates() -> None:
+    assert mmr_select(RELEVANCE, EMBEDDINGS, 2) == [1, 2]
+
+
+def test_mmr_select_lambda_one_is_top_k() -> None:
+    assert mmr_select(RELEVANCE, EMBEDDINGS, 2, lambda_=1.0) == [1, 0]
+
+
+def test_mmr_select_empty() -> None:
+    assert mmr_select([], np.empty((0, 1), dtype=np.float32), 3) == []
+
+
+def test_merge_overlapping_joins_neighbours() -> None:
+    document_id = uuid.uuid4()
+    text = "abcdefghijklmnopqrstuvwxyz"
+    chunks = [
+        make_chunk(text[10:20], start_offset=10, document_id=document_id),
+        make_chunk(text[0:14], start_offset=0, document_id=document_id),
+        make_chunk("elsewhere", start_offset=10),
+    ]
+
+    passages = merge_overlapping(chunks)
+
+    assert [p.text for p in passages] == [text[0:20], "elsewhere"]
+    assert passages[0].rank == 0
+
+
+def test_merge_overlapping_keeps_chunks_without_offsets() -> None:
+    document_id = uuid.uuid4()
+    chunks = [
+        make_chunk("first", document_id=document_id),
+        make_chunk("second", document_id=document_id),
+    ]
+
+    assert [p.text for p in merge_overlapping(chunks)] == ["first", "second"]
+
+
+@pytest.mark.usefixtures("estimated_token_counts")
+def test_trim_to_budget_cuts_last_passage_on_word_boundary() -> None:
+    passages = merge_overlapping([make_chunk("word " * 40), make_chunk("other " * 100)])
+
+    texts = trim_to_budget(passages, max_tokens=100)
+
+    assert texts[0] == "word " * 40
+    assert sum(count_tokens(t) for t in texts) <= 100
+    assert texts[1].startswith("other") and not texts[1].endswith("othe")
+
+
+@pytest.mark.usefixtures("estimated_token_counts")
+def test_trim_to_budget_drops_tiny_remainder() -> None:
+    passages = merge_overlapping([make_chunk("a" * 380), make_chunk("b" * 400)])
+
+    assert trim_to_budget(passages, max_tokens=100) == ["a" * 380]
+
+
+def test_trim_to_budget_uses_stored_token_counts() -> None:
+    passages = merge_overlapping(
+        [make_chunk("dense text", token_count=90), make_chunk("next " * 10)]
+    )
+
+    # 10 tokens are left after the first chunk's stored 90: too few for a cut
+    assert trim_to_budget(passages, max_tokens=100) == ["dense text"]
+
+
+def test_pack_context_without_embeddings_keeps_retrieval_order() -> None:
+    chunks = [make_chunk("one"), make_chunk("two"), make_chunk("three")]
+
+    assert pack_context(chunks, k=2, max_tokens=100) == ["one", "two"]
+
+
+def test_pack_context_prefers_diverse_chunks() -> None:
+    chunks = [
+        make_chunk("duplicate", embedding=[1.0, 0.0, 0.0], distance=0.091),
+        make_chunk("closest", embedding=[0.98, 0.2, 0.0], distance=0.089),
+        make_chunk("different", embedding=[0.5, 0.0, 0.866], distance=0.195),
+    ]
+
+    assert pack_context(chunks, k=2, max_tokens=100) == [
+        "closest",
+        "different",
+    ]
+
+
+def test_join_by_document_merges_in_reading_order() -> None:
+    first, second = uuid.uuid4(), uuid.uuid4()
+    chunks = [
+        make_chunk("delta", start_offset=20, document_id=first),
+        make_chunk("zeta", start_offset=0, document_id=second),
+        make_chunk("alpha beta", start_offset=0, document_id=first),
+        make_chunk("beta gamma", start_offset=6, document_id=first),
+    ]
+
+    assert join_by_document(chunks) == {
+        first: "alpha beta gamma\n\ndelta",
+        second: "zeta",
+    }
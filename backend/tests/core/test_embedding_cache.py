@@ -0,0 +1,201 @@
+from collections.abc import Generator
+from datetime import datetime, timedelta, timezone
+from unittest.mock import MagicMock, patch
+
+import numpy as np
+import pytest
+from numpy.typing import NDArray
+from sqlalchemy import text, update
+from sqlmodel import Session, delete, func, select
+
+from app.core.ai import embedding_cache
+from app.core.ai.embedding_cache import (
+    embed_queries_cached,
+    normalize_query_text,
+    prune_query_embeddings,
+    query_embedding_key,
+)
+from app.core.cache import EveryNth, try_transaction_lock
+from app.core.config import settings
+from app.models import QueryEmbedding
+
+
+@pytest.fixture(autouse=True)
+def empty_cache(db: Session) -> Generator[None, None, None]:
+    embedding_cache._local_embeddings.clear()
+    db.execute(delete(QueryEmbedding))
+    db.commit()
+    yield
+    embedding_cache._local_embeddings.clear()
+    db.execute(delete(QueryEmbedding))
+    db.commit()
+
+
+def fake_embed(texts: list[str]) -> NDArray[np.float32]:
+    embeddings = np.zeros((len(texts), 1536), dtype=np.float32)
+    embeddings[:, 0] = [len(text) for text in texts]
+    return embeddings
+
+
+def test_normalize_query_text() -> None:
+    assert normalize_query_text("  What IS\n entropy? ") == "what is entropy?"
+
+
+def test_query_embedding_key_depends_on_normalized_text() -> None:
+    assert query_embedding_key("a") == query_embedding_key("a")
+    assert query_embedding_key("a") != query_embedding_key("b")
+    assert len(query_embedding_key("a")) == 64
+
+
+def test_embed_queries_cached_embeds_each_text_once(db: Session) -> None:
+    with patch(
+        "app.core.ai.embedding_cache.embed_queries", side_effect=fake_embed
+    ) as mock_embed:
+        first = embed_queries_cached(db, ["Why B?", "why  b?", "Why C?"])
+        second = embed_queries_cached(db, ["WHY B?"])
+
+    mock_embed.assert_called_once_with(["why b?", "why c?"])
+    assert first.shape == (3, 1536)
+    assert first.dtype == np.float32
+    np.testing.assert_array_equal(first[0], first[1])
+    np.testing.assert_array_equal(first[0], second[0])
+    assert first[0][0] == len("why b?")
+
+
+def test_embed_queries_cached_shared_through_postgres(db: Session) -> None:
+    with patch(
+        "app.core.ai.embedding_cache.embed_queries", side_effect=fake_embed
+    ) as mock_embed:
+        embed_queries_cached(db, ["Why B?"])
+        # a different worker starts with an empty local cache
+        embedding_cache._local_embeddings.clear()
+        result = embed_queries_cached(db, ["Why B?"])
+
+    mock_embed.assert_called_once()
+    assert result[0][0] == len("why b?")
+    assert db.exec(select(func.count()).select_from(QueryEmbedding)).one() == 1
+
+
+def test_embed_queries_cached_holds_no_locks_while_embedding(db: Session) -> None:
+    with patch("app.core.ai.embedding_cache.embed_queries", side_effect=fake_embed):
+        embed_queries_cached(db, ["Why B?"])
+    embedding_cache._local_embeddings.clear()
+
+    def embed_while_updating(texts: list[str]) -> NDArray[np.float32]:
+        # Blocks, and times out, if the touched row is still locked
+        with Session(db.get_bind()) as other:
+            other.execute(text("SET LOCAL lock_timeout = '1s'"))
+            other.execute(update(QueryEmbedding).values(last_used_at=func.now()))
+            other.commit()
+        return fake_embed(texts)
+
+    with patch(
+        "app.core.ai.embedding_cache.embed_queries", side_effect=embed_while_updating
+    ) as mock_embed:
+        result = embed_queries_cached(db, ["Why B?", "Why C?"])
+
+    mock_embed.assert_called_once_with(["why c?"])
+    assert result[1][0] == len("why c?")
+
+
+def test_embed_queries_cached_reembeds_expired_rows(db: Session) -> None:
+    stale = datetime.now(timezone.utc) - timedelta(
+        seconds=settings.QUERY_EMBEDDING_CACHE_TTL_SECONDS + 60
+    )
+    db.add(
+        QueryEmbedding(
+            key=query_embedding_key("why b?"),
+            embedding=[9.0] * 1536,
+            created_at=stale,
+            last_used_at=stale,
+        )
+    )
+    db.commit()
+
+    with patch(
+        "app.core.ai.embedding_cache.embed_queries", side_effect=fake_embed
+    ) as mock_embed:
+        result = embed_queries_cached(db, ["Why B?"])
+
+    mock_embed.assert_called_once()
+    assert result[0][0] == len("why b?")
+
+
+def test_embed_queries_cached_disabled(db: Session) -> None:
+    with (
+        patch("app.core.ai.embedding_cache.settings") as mock_settings,
+        patch(
+            "app.core.ai.embedding_cache.embed_queries", side_effect=fake_embed
+        ) as mock_embed,
+    ):
+        mock_settings.QUERY_EMBEDDING_CACHE_ENABLED = False
+        embed_queries_cached(db, ["Why B?"])
+        embed_queries_cached(db, ["Why B?"])
+
+    assert mock_embed.call_count == 2
+
+
+def test_embed_queries_cached_empty() -> None:
+    with patch("app.core.ai.embedding_cache.embed_queries") as mock_embed:
+        assert embed_queries_cached(MagicMock(), []).shape == (0, 1536)
+    mock_embed.assert_not_called()
+
+
+def test_prune_query_embeddings_keeps_most_recently_used(db: Session) -> None:
+    now = datetime.now(timezone.utc)
+    for i in range(4):
+        db.add(
+            QueryEmbedding(
+                key=query_embedding_key(f"q{i}"),
+                embedding=[0.0] * 1536,
+                created_at=now,
+                last_used_at=now - timedelta(minutes=i),
+            )
+        )
+    db.commit()
+
+    mock_settings = MagicMock(
+        QUERY_EMBEDDING_CACHE_MAX_ROWS=2,
+        QUERY_EMBEDDING_CACHE_TTL_SECONDS=settings.QUERY_EMBEDDING_CACHE_TTL_SECONDS,
+    )
+    with patch("app.core.ai.embedding_cache.settings", mock_settings):
+        prune_query_embeddings(db)
+    db.commit()
+
+    keys = set(db.exec(select(QueryEmbedding.key)).all())
+    assert keys == {query_embedding_key("q0"), query_embedding_key("q1")}
+
+
+def test_prune_query_embeddings_skipped_while_another_prunes(db: Session) -> None:
+    stale = datetime.now(timezone.utc) - timedelta(
+        seconds=settings.QUERY_EMBEDDING_CACHE_TTL_SECONDS + 60
+    )
+    db.add(
+        QueryEmbedding(
+            key=query_embedding_key("old"),
+            embedding=[0.0] * 1536,
+            created_at=stale,
+            last_used_at=stale,
+        )
+    )
+    db.commit()
+
+    with Session(db.get_bind()) as other:
+        assert try_transaction_lock(other, "queryembedding prune")
+        prune_query_embeddings(db)
+        db.commit()
+        other.commit()
+
+    assert db.exec(select(func.count()).select_from(QueryEmbedding)).one() == 1
+
+
+def test_embed_queries_cached_prunes_occasionally(db: Session) -> None:
+    with (
+        patch("app.core.ai.embedding_cache.embed_queries", side_effect=fake_embed),
+        patch.object(embedding_cache, "_prune_schedule", EveryNth(2)),
+        patch("app.core.ai.embedding_cache.prune_query_embeddings") as prune,
+    ):
+        for i in range(3):
+            embed_queries_cached(db, [f"Why {i}?"])
+
+    assert prune.call_count == 2
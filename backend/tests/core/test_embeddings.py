@@ -1,8 +1,14 @@
 from unittest.mock import MagicMock, patch
 
+import numpy as np
 import pytest
 
-from app.core.ai.embeddings import embed_documents, embed_text, get_embeddings_model
+from app.core.ai.embeddings import (
+    embed_documents,
+    embed_queries,
+    embed_text,
+    get_embeddings_model,
+)
 
 
 def test_get_embeddings_model_creates_singleton() -> None:
@@ -53,7 +59,8 @@ def test_embed_text() -> None:
     with patch("app.core.ai.embeddings.get_embeddings_model", return_value=mock_model):
         result = embed_text("test text")
 
-    assert result == mock_embedding
+    assert result.dtype == np.float32
+    np.testing.assert_allclose(result, mock_embedding, rtol=1e-6)
     mock_model.embed_query.assert_called_once_with("test text")
 
 
@@ -66,7 +73,7 @@ def test_embed_text_empty_string() -> None:
     with patch("app.core.ai.embeddings.get_embeddings_model", return_value=mock_model):
         result = embed_text("")
 
-    assert result == mock_embedding
+    assert result.shape == (1536,)
     mock_model.embed_query.assert_called_once_with("")
 
 
@@ -84,20 +91,20 @@ def test_embed_documents() -> None:
     with patch("app.core.ai.embeddings.get_embeddings_model", return_value=mock_model):
         result = embed_documents(texts)
 
-    assert result == mock_embeddings
+    assert result.dtype == np.float32
+    np.testing.assert_allclose(result, mock_embeddings, rtol=1e-6)
     mock_model.embed_documents.assert_called_once_with(texts)
 
 
 def test_embed_documents_empty_list() -> None:
     """Test embedding an empty list of documents."""
     mock_model = MagicMock()
-    mock_model.embed_documents.return_value = []
 
     with patch("app.core.ai.embeddings.get_embeddings_model", return_value=mock_model):
         result = embed_documents([])
 
-    assert result == []
-    mock_model.embed_documents.assert_called_once_with([])
+    assert result.shape == (0, 1536)
+    mock_model.embed_documents.assert_not_called()
 
 
 def test_embed_text_api_error() -> None:
@@ -110,3 +117,26 @@ def test_embed_text_api_error() -> None:
             embed_text("test text")
 
         assert "API Error" in str(exc_info.value)
+
+
+def test_embed_queries_single_request() -> None:
+    """Test that several queries are embedded with one API call."""
+    mock_model = MagicMock()
+    mock_model.embed_documents.return_value = [[0.1], [0.2]]
+
+    with patch("app.core.ai.embeddings.get_embeddings_model", return_value=mock_model):
+        result = embed_queries(["q1", "q2"])
+
+    np.testing.assert_allclose(result, [[0.1], [0.2]], rtol=1e-6)
+    mock_model.embed_documents.assert_called_once_with(["q1", "q2"])
+    mock_model.embed_query.assert_not_called()
+
+
+def test_embed_queries_empty_list() -> None:
+    """Test that no request is made for an empty list."""
+    mock_model = MagicMock()
+
+    with patch("app.core.ai.embeddings.get_embeddings_model", return_value=mock_model):
+        assert len(embed_queries([])) == 0
+
+    mock_model.embed_documents.assert_not_called()
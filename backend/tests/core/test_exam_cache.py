@@ -0,0 +1,262 @@
+import uuid
+from collections.abc import Generator
+from datetime import datetime, timedelta, timezone
+from unittest.mock import AsyncMock, patch
+
+import pytest
+from sqlmodel import Session, delete, select
+
+from app.core.ai import exam_cache
+from app.core.ai.exam_cache import (
+    exam_cache_key,
+    exam_cache_stats,
+    generate_questions_cached,
+    pregenerate_default_exam,
+    prune_exam_cache,
+)
+from app.core.cache import EveryNth, try_transaction_lock
+from app.core.config import settings
+from app.models import (
+    Difficulty,
+    DocumentStatus,
+    GeneratedExamCache,
+    QuestionCreate,
+    QuestionType,
+)
+from tests.utils.document import create_random_document
+
+DOCUMENT_ID = uuid.uuid4()
+
+
+@pytest.fixture(autouse=True)
+def empty_cache(db: Session) -> Generator[None, None, None]:
+    db.execute(delete(GeneratedExamCache))
+    db.commit()
+    yield
+    db.execute(delete(GeneratedExamCache))
+    db.commit()
+
+
+def make_questions(prefix: str, count: int) -> list[QuestionCreate]:
+    return [
+        QuestionCreate(
+            question=f"{prefix} question number {i} {prefix * i}",
+            correct_answer="A",
+            type=QuestionType.multiple_choice,
+            options=["A", "B", "C"],
+        )
+        for i in range(count)
+    ]
+
+
+def cache_key(texts: list[str], num_questions: int = 5) -> str:
+    return exam_cache_key(
+        texts,
+        num_questions=num_questions,
+        difficulty=Difficulty.medium,
+        question_types=[QuestionType.multiple_choice, QuestionType.true_false],
+    )
+
+
+def test_exam_cache_key_depends_on_content_and_parameters() -> None:
+    assert cache_key(["a", "b"]) == cache_key(["b", "a"])
+    assert cache_key(["a"]) != cache_key(["a changed"])
+    assert cache_key(["a"], 5) != cache_key(["a"], 10)
+    with patch.object(settings, "EXAM_CACHE_POLICY", "pool"):
+        assert cache_key(["a"], 5) == cache_key(["a"], 10)
+
+
+@pytest.mark.asyncio
+async def test_generate_questions_cached_exact_reuse(db: Session) -> None:
+    generate = AsyncMock(return_value=make_questions("x", 5))
+
+    with (
+        patch(
+            "app.core.ai.exam_cache.fetch_texts_by_document",
+            return_value={DOCUMENT_ID: "Text"},
+        ),
+        patch("app.core.ai.exam_cache.generate_questions_banked", generate),
+    ):
+        first = await generate_questions_cached(db, [uuid.uuid4()])
+        second = await generate_questions_cached(db, [uuid.uuid4()])
+
+    generate.assert_awaited_once()
+    assert second == first
+    stats = exam_cache_stats(db)
+    assert (stats.entries, stats.hits, stats.misses) == (1, 1, 1)
+    assert stats.seconds_saved >= 0
+
+
+@pytest.mark.asyncio
+async def test_generate_questions_cached_pool_samples(db: Session) -> None:
+    generate = AsyncMock(side_effect=[make_questions("x", 4), make_questions("y", 4)])
+
+    with (
+        patch.object(settings, "EXAM_CACHE_POLICY", "pool"),
+        patch(
+            "app.core.ai.exam_cache.fetch_texts_by_document",
+            return_value={DOCUMENT_ID: "Text"},
+        ),
+        patch("app.core.ai.exam_cache.generate_questions_banked", generate),
+    ):
+        for _ in range(3):
+            result = await generate_questions_cached(db, [uuid.uuid4()], 4)
+
+    # the pool needs twice the questions asked for before it is sampled
+    assert generate.await_count == 2
+    assert len(result) == 4
+    pool = db.exec(select(GeneratedExamCache)).one()
+    assert len(pool.questions) == 8
+    assert (pool.hits, pool.misses) == (1, 2)
+
+
+@pytest.mark.asyncio
+async def test_generate_questions_cached_regenerates_expired(db: Session) -> None:
+    stale = datetime.now(timezone.utc) - timedelta(
+        seconds=settings.EXAM_CACHE_TTL_SECONDS + 60
+    )
+    db.add(
+        GeneratedExamCache(
+            key=cache_key(["Text"]),
+            questions=[q.model_dump(mode="json") for q in make_questions("old", 5)],
+            misses=1,
+            created_at=stale,
+        )
+    )
+    db.commit()
+    generate = AsyncMock(return_value=make_questions("new", 5))
+
+    with (
+        patch(
+            "app.core.ai.exam_cache.fetch_texts_by_document",
+            return_value={DOCUMENT_ID: "Text"},
+        ),
+        patch("app.core.ai.exam_cache.generate_questions_banked", generate),
+    ):
+        result = await generate_questions_cached(db, [uuid.uuid4()])
+
+    generate.assert_awaited_once()
+    assert result[0].question.startswith("new")
+    db.expire_all()
+    entry = db.exec(select(GeneratedExamCache)).one()
+    assert entry.misses == 1
+    assert entry.questions[0]["question"].startswith("new")
+
+
+@pytest.mark.asyncio
+async def test_generate_questions_cached_disabled(db: Session) -> None:
+    generate = AsyncMock(return_value=make_questions("x", 5))
+
+    with (
+        patch.object(settings, "EXAM_CACHE_ENABLED", False),
+        patch(
+            "app.core.ai.exam_cache.fetch_texts_by_document",
+            return_value={DOCUMENT_ID: "Text"},
+        ),
+        patch("app.core.ai.exam_cache.generate_questions_banked", generate),
+    ):
+        await generate_questions_cached(db, [uuid.uuid4()])
+        await generate_questions_cached(db, [uuid.uuid4()])
+
+    assert generate.await_count == 2
+    assert exam_cache_stats(db).entries == 0
+
+
+@pytest.mark.asyncio
+async def test_pregenerated_default_exam_serves_first_request(db: Session) -> None:
+    document = create_random_document(db)
+    draft = AsyncMock(return_value=make_questions("draft", 5))
+    banked = AsyncMock(return_value=make_questions("late", 5))
+
+    with (
+        patch.object(settings, "EXAM_PREGENERATION_ENABLED", True),
+        patch("app.core.ai.exam_cache.generate_questions_from_texts", draft),
+        patch("app.core.ai.exam_cache.generate_questions_banked", banked),
+    ):
+        await pregenerate_default_exam(str(document.id))
+        # Already drafted: nothing more to generate
+        await pregenerate_default_exam(str(document.id))
+        questions = await generate_questions_cached(db, [document.id])
+
+    draft.assert_awaited_once()
+    assert draft.call_args.kwargs["difficulty"] == Difficulty.medium
+    banked.assert_not_awaited()
+    assert questions == make_questions("draft", 5)
+    stats = exam_cache_stats(db)
+    assert (stats.entries, stats.hits, stats.misses) == (1, 1, 1)
+
+
+@pytest.mark.asyncio
+async def test_pregenerate_default_exam_is_opt_in(db: Session) -> None:
+    ready = create_random_document(db)
+    processing = create_random_document(db, status=DocumentStatus.processing)
+    draft = AsyncMock(return_value=make_questions("draft", 5))
+
+    with patch("app.core.ai.exam_cache.generate_questions_from_texts", draft):
+        await pregenerate_default_exam(str(ready.id))
+        with patch.object(settings, "EXAM_PREGENERATION_ENABLED", True):
+            await pregenerate_default_exam(str(processing.id))
+
+    draft.assert_not_awaited()
+    assert exam_cache_stats(db).entries == 0
+
+
+def add_entries(db: Session, count: int) -> list[str]:
+    now = datetime.now(timezone.utc)
+    keys = [cache_key([f"Text {i}"]) for i in range(count)]
+    db.add_all(
+        GeneratedExamCache(
+            key=key,
+            questions=[],
+            created_at=now,
+            last_used_at=now - timedelta(minutes=i),
+        )
+        for i, key in enumerate(keys)
+    )
+    db.commit()
+    return keys
+
+
+def test_prune_exam_cache_keeps_most_recently_used(db: Session) -> None:
+    keys = add_entries(db, 4)
+
+    with patch.object(settings, "EXAM_CACHE_MAX_ROWS", 2):
+        prune_exam_cache(db)
+    db.commit()
+
+    assert set(db.exec(select(GeneratedExamCache.key)).all()) == set(keys[:2])
+
+
+def test_prune_exam_cache_skipped_while_another_prunes(db: Session) -> None:
+    add_entries(db, 4)
+
+    with (
+        patch.object(settings, "EXAM_CACHE_MAX_ROWS", 2),
+        Session(db.get_bind()) as other,
+    ):
+        assert try_transaction_lock(other, "generatedexamcache prune")
+        prune_exam_cache(db)
+        db.commit()
+        other.commit()
+
+    assert len(db.exec(select(GeneratedExamCache.key)).all()) == 4
+
+
+@pytest.mark.asyncio
+async def test_generate_questions_cached_prunes_occasionally(db: Session) -> None:
+    with (
+        patch(
+            "app.core.ai.exam_cache.generate_questions_banked",
+            AsyncMock(return_value=make_questions("x", 5)),
+        ),
+        patch.object(exam_cache, "_prune_schedule", EveryNth(2)),
+        patch("app.core.ai.exam_cache.prune_exam_cache") as prune,
+    ):
+        for i in range(3):
+            with patch(
+                "app.core.ai.exam_cache.fetch_texts_by_document",
+                return_value={DOCUMENT_ID: f"Text {i}"},
+            ):
+                await generate_questions_cached(db, [DOCUMENT_ID])
+
+    assert prune.call_count == 2
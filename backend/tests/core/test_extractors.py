@@ -1,7 +1,24 @@
-from unittest.mock import MagicMock, patch
+from collections.abc import Generator
+from unittest.mock import AsyncMock, MagicMock, patch
 
-from app.core.extractors import extract_text_and_save_to_db, perform_fixed_size_chunking
-from app.models import DocumentStatus
+import pytest
+from sqlmodel import Session
+
+from app.core.config import settings
+from app.core.extractors import (
+    build_document_digest,
+    extract_text_and_save_to_db,
+    find_chunk_offsets,
+    perform_fixed_size_chunking,
+)
+from app.models import (
+    DigestEntry,
+    Document,
+    DocumentChunk,
+    DocumentStatus,
+    StudyDigest,
+)
+from tests.utils.document import create_random_document
 
 
 def test_extract_text_and_save_chunks_to_db() -> None:
@@ -13,11 +30,13 @@ def test_extract_text_and_save_chunks_to_db() -> None:
     mock_document.id = fake_doc_id
     mock_document.status = DocumentStatus.processing  # Must be processing to proceed
 
-    with patch(
-        "app.core.extractors.extract_text_from_s3_file", return_value=fake_text
-    ) as _, patch("app.core.extractors.Session") as session_class_mock, patch(
-        "app.core.extractors.save_chunks_to_db"
-    ) as save_chunks_mock:
+    with (
+        patch(
+            "app.core.extractors.extract_text_from_s3_file", return_value=fake_text
+        ) as _,
+        patch("app.core.extractors.Session") as session_class_mock,
+        patch("app.core.extractors.save_chunks_to_db") as save_chunks_mock,
+    ):
         session_instance = MagicMock()
         session_class_mock.return_value.__enter__.return_value = session_instance
         # Mock session.get() instead of session.exec()
@@ -32,7 +51,7 @@ def test_extract_text_and_save_chunks_to_db() -> None:
         # Check chunking worked
         expected_chunks = perform_fixed_size_chunking(fake_text)
         save_chunks_mock.assert_called_once_with(
-            session_instance, fake_doc_id, expected_chunks
+            session_instance, fake_doc_id, expected_chunks, source_text=fake_text
         )
 
         # Verify document was updated
@@ -41,3 +60,90 @@ def test_extract_text_and_save_chunks_to_db() -> None:
         assert mock_document.status == DocumentStatus.ready
         session_instance.add.assert_called()
         session_instance.commit.assert_called()
+
+
+def test_find_chunk_offsets_with_overlap() -> None:
+    text = "alpha beta gamma delta"
+    chunks = ["alpha beta", "beta gamma", "gamma delta"]
+
+    assert find_chunk_offsets(text, chunks) == [0, 6, 11]
+
+
+def test_find_chunk_offsets_missing_chunk() -> None:
+    text = "alpha beta gamma"
+    chunks = ["alpha", "not there", "gamma"]
+
+    assert find_chunk_offsets(text, chunks) == [0, None, 11]
+
+
+@pytest.fixture
+def digests_enabled() -> Generator[None, None, None]:
+    """Digests are opt-in."""
+    with patch.object(settings, "DIGEST_ENABLED", True):
+        yield
+
+
+@pytest.mark.asyncio
+async def test_build_document_digest_disabled_by_default(db: Session) -> None:
+    document = create_random_document(db)
+    db.add(DocumentChunk(document_id=document.id, text="Only chunk", size=10))
+    db.commit()
+    build = AsyncMock()
+
+    with patch("app.core.extractors.build_study_digest", build):
+        await build_document_digest(str(document.id))
+
+    build.assert_not_called()
+
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures("digests_enabled")
+async def test_build_document_digest_stores_digest(db: Session) -> None:
+    document = create_random_document(db)
+    chunks = [
+        DocumentChunk(
+            document_id=document.id, text=text, size=len(text), start_offset=offset
+        )
+        for text, offset in (("Second chunk", 20), ("First chunk", 0))
+    ]
+    db.add_all(chunks)
+    db.commit()
+    digest = StudyDigest(
+        chunk_ids=[chunks[1].id, chunks[0].id],
+        concepts=[DigestEntry(text="Chunking", chunks=[1, 2])],
+        definitions=[],
+        facts=[],
+    )
+    build = AsyncMock(return_value=digest)
+
+    with patch("app.core.extractors.build_study_digest", build):
+        await build_document_digest(str(document.id))
+
+    assert build.call_args.args[1] == ["First chunk", "Second chunk"]
+    db.expire_all()
+    stored = db.get(Document, document.id)
+    assert stored is not None
+    assert StudyDigest.model_validate(stored.digest) == digest
+
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures("digests_enabled")
+async def test_build_document_digest_logs_failures(db: Session) -> None:
+    document = create_random_document(db)
+    db.add(DocumentChunk(document_id=document.id, text="Only chunk", size=10))
+    db.commit()
+
+    with (
+        patch(
+            "app.core.extractors.build_study_digest",
+            AsyncMock(side_effect=Exception("LLM down")),
+        ),
+        patch("app.core.extractors.logger") as mock_logger,
+    ):
+        await build_document_digest(str(document.id))
+
+    mock_logger.warning.assert_called_once()
+    db.expire_all()
+    stored = db.get(Document, document.id)
+    assert stored is not None
+    assert stored.digest is None
@@ -1,4 +1,7 @@
+import asyncio
 import uuid
+from collections.abc import AsyncIterator
+from typing import Any
 from unittest.mock import AsyncMock, MagicMock, patch
 from uuid import UUID
 
@@ -7,17 +10,46 @@ from fastapi import HTTPException
 from pydantic import ValidationError
 
 from app.core.ai.openai import (
-    MAX_CHARS,
+    allocate_questions,
+    build_study_digest,
     fetch_document_texts,
     generate_answer_explanation,
+    generate_answer_explanations,
     generate_explanation_prompt,
     generate_questions_from_documents,
+    generate_questions_map_reduce,
     generate_questions_prompt,
+    generate_section_questions,
+    merge_streams,
     normalize_uuid_list,
     parse_llm_output,
+    retrieve_exam_contexts,
+    select_questions,
+    shard_questions,
+    split_into_sections,
+    stream_questions_from_texts,
+    stream_section_questions,
     validate_and_convert_question_item,
 )
-from app.models import QuestionCreate, QuestionType
+from app.core.config import settings
+from app.models import (
+    Difficulty,
+    DigestEntry,
+    DigestOutput,
+    ExplanationOutput,
+    ExplanationRequest,
+    QuestionCreate,
+    QuestionType,
+    RetrievalMode,
+    RetrievedChunk,
+    StudyDigest,
+)
+
+
+def make_chunk(text: str, distance: float = 0.1) -> RetrievedChunk:
+    return RetrievedChunk(
+        id=uuid.uuid4(), document_id=uuid.uuid4(), text=text, distance=distance
+    )
 
 
 def test_generate_questions_prompt() -> None:
@@ -43,6 +75,20 @@ def test_generate_questions_prompt_default_num_questions() -> None:
     assert text in prompt
 
 
+def test_generate_questions_prompt_shares_prefix_across_requests() -> None:
+    """Test that per-request parameters come after the document text."""
+    text = "Sample document text."
+    first = generate_questions_prompt(text, 3, Difficulty.easy, part=(1, 2))
+    second = generate_questions_prompt(
+        text, 5, Difficulty.hard, [QuestionType.true_false], part=(2, 2)
+    )
+
+    prefix = first[: first.index(text) + len(text)]
+    assert second.startswith(prefix)
+    assert "Difficulty: easy" in first[len(prefix) :]
+    assert "part 1 of 2" in first[len(prefix) :]
+
+
 def test_fetch_document_texts_success() -> None:
     """Test successfully fetching document texts."""
     document_ids = [uuid.uuid4(), uuid.uuid4()]
@@ -50,7 +96,7 @@ def test_fetch_document_texts_success() -> None:
 
     mock_session = MagicMock()
     mock_result = MagicMock()
-    mock_result.all.return_value = [(text,) for text in expected_texts]
+    mock_result.all.return_value = [(text, None) for text in expected_texts]
     mock_session.exec.return_value = mock_result
 
     result = fetch_document_texts(mock_session, document_ids)
@@ -77,7 +123,7 @@ def test_fetch_document_texts_no_texts() -> None:
 def test_fetch_document_texts_filters_none() -> None:
     """Test that None texts are filtered out."""
     document_ids = [uuid.uuid4(), uuid.uuid4()]
-    texts_with_none = [("Text 1",), (None,), ("Text 2",)]
+    texts_with_none = [("Text 1", None), (None, None), ("Text 2", None)]
 
     mock_session = MagicMock()
     mock_result = MagicMock()
@@ -89,6 +135,73 @@ def test_fetch_document_texts_filters_none() -> None:
     assert result == ["Text 1", "Text 2"]
 
 
+def test_fetch_document_texts_prefers_digests() -> None:
+    """Test that a document's digest replaces its text for generation."""
+    digest = StudyDigest(
+        chunk_ids=[uuid.uuid4()],
+        concepts=[DigestEntry(text="Osmosis", chunks=[1])],
+        definitions=[],
+        facts=[DigestEntry(text="Water moves to the saltier side.", chunks=[1])],
+    ).model_dump(mode="json")
+    mock_session = MagicMock()
+    mock_session.exec.return_value.all.return_value = [
+        ("Long raw text", digest),
+        ("Text without digest", None),
+    ]
+
+    with patch.object(settings, "GENERATION_USE_DIGESTS", True):
+        texts = fetch_document_texts(mock_session, [uuid.uuid4(), uuid.uuid4()])
+
+    assert texts == [
+        "Key concepts:\n- Osmosis\n\nFacts:\n- Water moves to the saltier side.",
+        "Text without digest",
+    ]
+    # Off by default
+    texts = fetch_document_texts(mock_session, [uuid.uuid4(), uuid.uuid4()])
+    assert texts == ["Long raw text", "Text without digest"]
+
+
+@pytest.mark.asyncio
+async def test_build_study_digest_merges_sections() -> None:
+    """Test that sections are digested separately and merged with their references."""
+    prompts: list[str] = []
+
+    async def fake_ainvoke(prompt: str) -> DigestOutput:
+        prompts.append(prompt)
+        first = "[1]" in prompt
+        return DigestOutput(
+            concepts=[DigestEntry(text="Osmosis", chunks=[1] if first else [3])],
+            definitions=[],
+            facts=[
+                DigestEntry(
+                    text=f"Fact from section {1 if first else 2}",
+                    chunks=[2, 9] if first else [3],
+                )
+            ],
+        )
+
+    with (
+        patch("app.core.ai.openai.structured_digest_llm") as mock_llm,
+        patch.object(settings, "DIGEST_SECTION_TOKENS", 100),
+        patch("app.core.ai.openai.count_tokens", return_value=0),
+    ):
+        mock_llm.ainvoke = fake_ainvoke
+        chunk_ids = [uuid.uuid4() for _ in range(3)]
+        digest = await build_study_digest(
+            chunk_ids, ["first", "second", "third"], [60, 30, 50]
+        )
+
+    assert len(prompts) == 2
+    assert "[1] first\n\n[2] second" in prompts[0]
+    assert "[3] third" in prompts[1]
+    assert digest.chunk_ids == chunk_ids
+    assert [(e.text, e.chunks) for e in digest.concepts] == [("Osmosis", [1, 3])]
+    assert [(e.text, e.chunks) for e in digest.facts] == [
+        ("Fact from section 1", [2]),
+        ("Fact from section 2", [3]),
+    ]
+
+
 def test_validate_and_convert_question_item_success() -> None:
     """Test successful validation and conversion of question item."""
     mock_question = MagicMock()
@@ -122,43 +235,59 @@ def test_validate_and_convert_question_item_true_false() -> None:
 
 def test_parse_llm_output_success() -> None:
     """Test parsing LLM output successfully."""
-    mock_question1 = MagicMock()
-    mock_question1.question = "Question 1"
-    mock_question1.answer = "Answer 1"
-    mock_question1.type = "multiple_choice"
-    mock_question1.options = ["A", "B", "C"]
-
-    mock_question2 = MagicMock()
-    mock_question2.question = "Question 2"
-    mock_question2.answer = "True"
-    mock_question2.type = "true_false"
-    mock_question2.options = ["True", "False"]
-
-    mock_llm_output = MagicMock()
-    mock_llm_output.questions = [mock_question1, mock_question2]
-
-    with patch(
-        "app.core.ai.openai.validate_and_convert_question_item"
-    ) as mock_validate:
-        mock_validate.side_effect = [
-            QuestionCreate(
-                question="Question 1",
-                correct_answer="Answer 1",
-                type=QuestionType.multiple_choice,
-                options=["A", "B", "C"],
-            ),
-            QuestionCreate(
-                question="Question 2",
-                correct_answer="True",
-                type=QuestionType.true_false,
-                options=["True", "False"],
-            ),
+    llm_output = {
+        "questions": [
+            {
+                "question": "Question 1",
+                "answer": "Answer 1",
+                "type": "multiple_choice",
+                "options": ["A", "B", "C"],
+            },
+            {
+                "question": "Question 2",
+                "answer": "True",
+                "type": "true_false",
+                "options": ["True", "False"],
+            },
+        ]
+    }
+
+    result = parse_llm_output(llm_output)
+
+    assert [q.question for q in result] == ["Question 1", "Question 2"]
+    assert [q.type for q in result] == [
+        QuestionType.multiple_choice,
+        QuestionType.true_false,
+    ]
+
+
+def test_parse_llm_output_drops_invalid_items() -> None:
+    """Test that invalid items are dropped instead of failing the output."""
+    llm_output = {
+        "questions": [
+            {
+                "question": "Question 1",
+                "answer": "A",
+                "type": "multiple_choice",
+                "options": ["A", "B"],
+            },
+            {"question": "Question 2"},
+            {
+                "question": "Question 3",
+                "answer": "A",
+                "type": "multiple_choice",
+                "options": ["A", "B", "C"],
+            },
         ]
+    }
 
-        result = parse_llm_output(mock_llm_output)
+    with patch("app.core.ai.openai.logger") as mock_logger:
+        result = parse_llm_output(llm_output)
 
-    assert len(result) == 2
-    assert all(isinstance(q, QuestionCreate) for q in result)
+    assert [q.question for q in result] == ["Question 3"]
+    assert any(
+        "Dropped 2 of 3" in str(call) for call in mock_logger.warning.call_args_list
+    )
 
 
 def test_parse_llm_output_filters_none() -> None:
@@ -194,10 +323,12 @@ async def test_generate_questions_from_documents_success() -> None:
     mock_llm_output = MagicMock()
     mock_llm_output.questions = [MagicMock()]
 
-    with patch(
-        "app.core.ai.openai.fetch_document_texts", return_value=["Document text"]
-    ), patch("app.core.ai.openai.structured_question_llm", mock_llm), patch(
-        "app.core.ai.openai.parse_llm_output", return_value=[mock_question]
+    with (
+        patch(
+            "app.core.ai.openai.fetch_document_texts", return_value=["Document text"]
+        ),
+        patch("app.core.ai.openai.structured_question_llm", mock_llm),
+        patch("app.core.ai.openai.parse_llm_output", return_value=[mock_question]),
     ):
         mock_llm.ainvoke.return_value = mock_llm_output
 
@@ -230,10 +361,12 @@ async def test_generate_questions_from_documents_validation_error() -> None:
     mock_session = MagicMock()
     mock_llm = AsyncMock()
 
-    with patch(
-        "app.core.ai.openai.fetch_document_texts", return_value=["Document text"]
-    ), patch("app.core.ai.openai.structured_question_llm", mock_llm), patch(
-        "app.core.ai.openai.logger"
+    with (
+        patch(
+            "app.core.ai.openai.fetch_document_texts", return_value=["Document text"]
+        ),
+        patch("app.core.ai.openai.structured_question_llm", mock_llm),
+        patch("app.core.ai.openai.logger"),
     ):
         # Create a ValidationError by actually trying to create an invalid QuestionOutput
         # This is the most reliable way to get a proper ValidationError
@@ -261,10 +394,12 @@ async def test_generate_questions_from_documents_general_error() -> None:
     mock_session = MagicMock()
     mock_llm = AsyncMock()
 
-    with patch(
-        "app.core.ai.openai.fetch_document_texts", return_value=["Document text"]
-    ), patch("app.core.ai.openai.structured_question_llm", mock_llm), patch(
-        "app.core.ai.openai.logger"
+    with (
+        patch(
+            "app.core.ai.openai.fetch_document_texts", return_value=["Document text"]
+        ),
+        patch("app.core.ai.openai.structured_question_llm", mock_llm),
+        patch("app.core.ai.openai.logger"),
     ):
         mock_llm.ainvoke.side_effect = Exception("API Error")
 
@@ -275,52 +410,397 @@ async def test_generate_questions_from_documents_general_error() -> None:
         assert "Failed to generate questions" in exc_info.value.detail
 
 
+def make_question(text: str) -> QuestionCreate:
+    return QuestionCreate(
+        question=text,
+        correct_answer="A",
+        type=QuestionType.multiple_choice,
+        options=["A", "B", "C"],
+    )
+
+
+def mc_item(text: str) -> dict[str, Any]:
+    return {
+        "question": text,
+        "answer": "A",
+        "type": "multiple_choice",
+        "options": ["A", "B", "C"],
+    }
+
+
 @pytest.mark.asyncio
-async def test_generate_questions_from_documents_truncates_long_text() -> None:
-    """Test that extracted text is truncated to MAX_CHARS when generating questions."""
-    document_ids = [uuid.uuid4()]
-    # Create text longer than MAX_CHARS
-    long_text = "a" * (MAX_CHARS + 1000)
+async def test_generate_section_questions_asks_only_for_dropped_items() -> None:
+    """Test that a follow-up call asks only for the questions lost to invalid items."""
+    mock_llm = AsyncMock()
+    mock_llm.ainvoke.side_effect = [
+        {
+            "questions": [
+                mc_item("What is osmosis?"),
+                {"question": "Broken", "type": "multiple_choice", "options": ["A"]},
+                mc_item("Define entropy."),
+                {"question": "Missing fields"},
+            ]
+        },
+        {"questions": [mc_item("Explain diffusion."), mc_item("What is enthalpy?")]},
+    ]
+
+    with (
+        patch("app.core.ai.openai.structured_question_llm", mock_llm),
+        patch("app.core.ai.openai.generate_questions_prompt") as mock_prompt,
+    ):
+        result = await generate_section_questions(
+            "Some text",
+            num_questions=4,
+            difficulty=Difficulty.medium,
+            question_types=[QuestionType.multiple_choice],
+        )
 
-    mock_session = MagicMock()
+    assert [call.kwargs["num_questions"] for call in mock_prompt.call_args_list] == [
+        4,
+        2,
+    ]
+    assert [q.question for q in result] == [
+        "What is osmosis?",
+        "Define entropy.",
+        "Explain diffusion.",
+        "What is enthalpy?",
+    ]
+
+
+@pytest.mark.asyncio
+async def test_generate_section_questions_keeps_salvage_when_follow_up_fails() -> None:
+    """Test that a failed follow-up returns the valid questions already parsed."""
     mock_llm = AsyncMock()
-    mock_llm_output = MagicMock()
-    mock_llm_output.questions = [MagicMock()]
+    mock_llm.ainvoke.side_effect = [
+        {"questions": [mc_item("What is osmosis?"), {"question": "Broken"}]},
+        Exception("API Error"),
+    ]
+
+    with (
+        patch("app.core.ai.openai.structured_question_llm", mock_llm),
+        patch("app.core.ai.openai.logger"),
+    ):
+        result = await generate_section_questions(
+            "Some text",
+            num_questions=2,
+            difficulty=Difficulty.medium,
+            question_types=[QuestionType.multiple_choice],
+        )
 
-    mock_question = QuestionCreate(
-        question="Test question?",
-        correct_answer="Answer",
-        type=QuestionType.multiple_choice,
-        options=["A", "B", "C"],
-    )
+    assert mock_llm.ainvoke.await_count == 2
+    assert [q.question for q in result] == ["What is osmosis?"]
 
-    with patch(
-        "app.core.ai.openai.fetch_document_texts", return_value=[long_text]
-    ), patch("app.core.ai.openai.structured_question_llm", mock_llm), patch(
-        "app.core.ai.openai.parse_llm_output", return_value=[mock_question]
-    ), patch("app.core.ai.openai.generate_questions_prompt") as mock_prompt, patch(
-        "app.core.ai.openai.logger"
-    ) as mock_logger:
-        mock_llm.ainvoke.return_value = mock_llm_output
-        # Make generate_questions_prompt return the text passed to it
-        mock_prompt.side_effect = lambda text, **kwargs: text
 
-        result = await generate_questions_from_documents(mock_session, document_ids)
+@pytest.mark.usefixtures("estimated_token_counts")
+def test_split_into_sections_packs_paragraphs() -> None:
+    """Test that paragraphs are packed up to the limit and long ones are cut."""
+    texts = ["a" * 40 + "\n\n" + "b" * 40, "c" * 150]
 
-        # Verify truncation occurred - the text passed to generate_questions_prompt should be <= MAX_CHARS
-        call_args = mock_prompt.call_args[0][0]
-        assert len(call_args) == MAX_CHARS
-        # Verify warning was logged
-        assert mock_logger.warning.called
-        assert "Truncated" in str(mock_logger.warning.call_args)
+    # 4 characters a token, see the estimated_token_counts fixture
+    sections = split_into_sections(texts, 25)
+
+    assert sections == ["a" * 40 + "\n\n" + "b" * 40, "c" * 100, "c" * 50]
+
+
+def test_allocate_questions_proportional_with_minimum() -> None:
+    """Test that candidates follow section length, oversampled, at least one."""
+    assert allocate_questions([900, 100], 10, 1.5) == [14, 2]
+    assert allocate_questions([1000, 1], 2, 1.0) == [2, 1]
 
-    assert len(result) == 1
-    assert result[0] == mock_question
+
+def test_select_questions_round_robin_and_dedup() -> None:
+    """Test that sections take turns and near-duplicate questions are skipped."""
+    candidates = [
+        [make_question("What is entropy?"), make_question("Define enthalpy.")],
+        [make_question("what is  entropy"), make_question("What is osmosis?")],
+    ]
+
+    selected = select_questions(candidates, 3)
+
+    assert [q.question for q in selected] == [
+        "What is entropy?",
+        "Define enthalpy.",
+        "What is osmosis?",
+    ]
+
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures("estimated_token_counts")
+async def test_generate_questions_from_documents_map_reduce() -> None:
+    """Test that long material is covered by concurrent per-section calls."""
+    # each text fills one section at 4 characters a token
+    texts = [f"{i}" * 4 * 4_000 for i in range(3)]
+    running = 0
+    max_running = 0
+
+    async def fake_section(text: str, **_: object) -> list[QuestionCreate]:
+        nonlocal running, max_running
+        running += 1
+        max_running = max(max_running, running)
+        await asyncio.sleep(0.01)
+        running -= 1
+        return [make_question(f"Question about {text[0]} #{i}") for i in range(5)]
+
+    with (
+        patch("app.core.ai.openai.fetch_document_texts", return_value=texts),
+        patch(
+            "app.core.ai.openai.generate_section_questions", side_effect=fake_section
+        ) as mock_section,
+        patch("app.core.ai.openai.settings") as mock_settings,
+    ):
+        mock_settings.GENERATION_SECTION_TOKENS = 4_000
+        mock_settings.GENERATION_MAX_SECTIONS = 8
+        mock_settings.GENERATION_CONCURRENCY = 2
+        mock_settings.GENERATION_OVERSAMPLE = 1.5
+        mock_settings.GENERATION_QUESTIONS_PER_CALL = 5
+
+        result = await generate_questions_from_documents(
+            MagicMock(), [uuid.uuid4()], num_questions=6
+        )
+
+    assert mock_section.call_count == 3
+    assert max_running == 2
+    assert len(result) == 6
+    # every section is represented
+    assert {q.question.split()[2] for q in result} == {"0", "1", "2"}
+
+
+def test_shard_questions_fits_per_call_limit() -> None:
+    """Test that shards are as few and as even as the per-call limit allows."""
+    assert shard_questions(3, 5) == [3]
+    assert shard_questions(10, 5) == [5, 5]
+    assert shard_questions(12, 5) == [4, 4, 4]
+    assert shard_questions(75, 5) == [5] * 15
+
+
+def test_generate_questions_prompt_part() -> None:
+    """Test that a shard's prompt names the part of the text to focus on."""
+    prompt = generate_questions_prompt("Some text", 5, part=(2, 3))
+
+    assert "part 2 of 3" in prompt
+    assert "part " not in generate_questions_prompt("Some text", 5)
+
+
+@pytest.mark.asyncio
+async def test_generate_questions_from_documents_shards_large_requests() -> None:
+    """Test that many questions from one short text are sharded per call."""
+    calls: list[tuple[int, tuple[int, int] | None]] = []
+
+    async def fake_section(
+        text: str, *, num_questions: int, part: tuple[int, int] | None, **_: object
+    ) -> list[QuestionCreate]:
+        calls.append((num_questions, part))
+        assert part is not None
+        return [
+            make_question(f"Question {i} about part {part[0]} of {text}")
+            for i in range(num_questions)
+        ]
+
+    with (
+        patch("app.core.ai.openai.fetch_document_texts", return_value=["Short text"]),
+        patch(
+            "app.core.ai.openai.generate_section_questions", side_effect=fake_section
+        ),
+    ):
+        result = await generate_questions_from_documents(
+            MagicMock(), [uuid.uuid4()], num_questions=50
+        )
+
+    assert len(calls) == 15
+    assert all(count <= 5 for count, _ in calls)
+    assert sorted(part for _, part in calls) == [(i, 15) for i in range(1, 16)]
+    assert len(result) == 50
+    assert len({q.question for q in result}) == 50
+
+
+def question_item(text: str) -> dict[str, Any]:
+    return {
+        "question": text,
+        "answer": "A",
+        "type": "multiple_choice",
+        "options": ["A", "B", "C"],
+    }
+
+
+@pytest.mark.asyncio
+async def test_stream_section_questions_yields_items_as_completed() -> None:
+    """Test that an item is yielded once the next one starts streaming."""
+    chunks_sent = 0
+    partials: list[dict[str, Any]] = [
+        {"questions": [{"question": "What is"}]},
+        {"questions": [question_item("What is osmosis?")]},
+        {"questions": [question_item("What is osmosis?"), {"question": "Def"}]},
+        {"questions": [question_item("What is osmosis?"), {"question": "Bad"}]},
+        {
+            "questions": [
+                question_item("What is osmosis?"),
+                {"question": "Bad"},
+                question_item("Define entropy."),
+            ]
+        },
+    ]
+
+    async def fake_astream(_: str) -> AsyncIterator[dict[str, Any]]:
+        nonlocal chunks_sent
+        for partial in partials:
+            chunks_sent += 1
+            yield partial
+
+    follow_up = AsyncMock(return_value=[make_question("Explain diffusion.")])
+    yielded_after: list[tuple[str, int]] = []
+    with (
+        patch("app.core.ai.openai.streaming_question_llm") as mock_llm,
+        patch("app.core.ai.openai.generate_section_questions", follow_up),
+    ):
+        mock_llm.astream = fake_astream
+        async for question in stream_section_questions(
+            "Some text",
+            num_questions=3,
+            difficulty=Difficulty.medium,
+            question_types=[QuestionType.multiple_choice],
+        ):
+            yielded_after.append((question.question, chunks_sent))
+
+    # the invalid item (no answer, type or options) is skipped, then asked for again
+    assert yielded_after == [
+        ("What is osmosis?", 3),
+        ("Define entropy.", 5),
+        ("Explain diffusion.", 5),
+    ]
+    assert follow_up.call_args.kwargs["num_questions"] == 1
+
+
+@pytest.mark.asyncio
+async def test_stream_section_questions_maps_errors() -> None:
+    """Test that a failed stream raises HTTPException like a failed call."""
+
+    async def failing_astream(_: str) -> AsyncIterator[dict[str, Any]]:
+        raise Exception("API Error")
+        yield {}
+
+    with patch("app.core.ai.openai.streaming_question_llm") as mock_llm:
+        mock_llm.astream = failing_astream
+        with pytest.raises(HTTPException) as exc_info:
+            async for _ in stream_section_questions(
+                "Some text",
+                num_questions=3,
+                difficulty=Difficulty.medium,
+                question_types=[QuestionType.multiple_choice],
+            ):
+                pass
+
+    assert "Failed to generate questions" in exc_info.value.detail
+
+
+@pytest.mark.asyncio
+async def test_merge_streams_interleaves_and_tolerates_failures() -> None:
+    """Test that items arrive as produced and a failed stream is dropped."""
+
+    async def numbers(delay: float, values: list[int]) -> AsyncIterator[int]:
+        for value in values:
+            await asyncio.sleep(delay)
+            yield value
+
+    async def failing() -> AsyncIterator[int]:
+        raise ValueError("boom")
+        yield 0
+
+    merged = [
+        item
+        async for item in merge_streams(
+            [numbers(0.01, [1, 3]), numbers(0.015, [2, 4]), failing()]
+        )
+    ]
+
+    assert merged == [1, 2, 3, 4]
+    with pytest.raises(ValueError):
+        async for _ in merge_streams([failing(), failing()]):
+            pass
+
+
+@pytest.mark.asyncio
+async def test_stream_questions_from_texts_stops_when_complete() -> None:
+    """Test that near-duplicates are skipped and streaming stops at the count."""
+    started: list[tuple[int, int] | None] = []
+
+    async def fake_stream(
+        text: str, *, num_questions: int, part: tuple[int, int] | None, **_: object
+    ) -> AsyncIterator[QuestionCreate]:
+        started.append(part)
+        assert part is not None
+        yield make_question("What is osmosis?")
+        for i in range(num_questions - 1):
+            yield make_question(
+                f"Question {i} part{part[0]} term{i}x{part[0]} of {text}"
+            )
+
+    with (
+        patch("app.core.ai.openai.stream_section_questions", side_effect=fake_stream),
+        patch("app.core.ai.openai.settings") as mock_settings,
+    ):
+        mock_settings.GENERATION_SECTION_TOKENS = 4_000
+        mock_settings.GENERATION_MAX_SECTIONS = 8
+        mock_settings.GENERATION_CONCURRENCY = 1
+        mock_settings.GENERATION_OVERSAMPLE = 1.5
+        mock_settings.GENERATION_QUESTIONS_PER_CALL = 5
+        result = [
+            q
+            async for q in stream_questions_from_texts(["Short text"], num_questions=6)
+        ]
+
+    assert len(result) == 6
+    assert len({q.question for q in result}) == 6
+    assert sum(q.question == "What is osmosis?" for q in result) == 1
+    # 9 candidates in 2 shards; one at a time, the second shard completes the exam
+    assert started == [(1, 2), (2, 2)]
+
+
+@pytest.mark.asyncio
+async def test_generate_questions_map_reduce_skips_failed_sections() -> None:
+    """Test that one failed section does not fail the whole exam."""
+    sections = ["first section", "second section"]
+
+    async def fake_section(text: str, **_: object) -> list[QuestionCreate]:
+        if text.startswith("first"):
+            raise HTTPException(status_code=500, detail="Failed to generate questions")
+        return [make_question("What is osmosis?")]
+
+    with (
+        patch(
+            "app.core.ai.openai.generate_section_questions", side_effect=fake_section
+        ),
+        patch("app.core.ai.openai.logger") as mock_logger,
+    ):
+        result = await generate_questions_map_reduce(
+            sections,
+            num_questions=2,
+            difficulty=Difficulty.medium,
+            question_types=[QuestionType.multiple_choice],
+        )
+
+    assert [q.question for q in result] == ["What is osmosis?"]
+    mock_logger.warning.assert_called_once()
+
+
+@pytest.mark.asyncio
+async def test_generate_questions_map_reduce_all_sections_failed() -> None:
+    """Test that the error is raised when no section succeeds."""
+    with patch(
+        "app.core.ai.openai.generate_section_questions",
+        side_effect=HTTPException(status_code=500, detail="Failed"),
+    ):
+        with pytest.raises(HTTPException):
+            await generate_questions_map_reduce(
+                ["a", "b"],
+                num_questions=2,
+                difficulty=Difficulty.medium,
+                question_types=[QuestionType.multiple_choice],
+            )
 
 
 @pytest.mark.asyncio
 async def test_generate_questions_from_documents_no_truncation_when_short() -> None:
-    """Test that text is not truncated when it's shorter than MAX_CHARS."""
+    """Test that text is not truncated when it fits one section."""
     document_ids = [uuid.uuid4()]
     short_text = "Short document text"
 
@@ -336,11 +816,12 @@ async def test_generate_questions_from_documents_no_truncation_when_short() -> N
         options=["A", "B", "C"],
     )
 
-    with patch(
-        "app.core.ai.openai.fetch_document_texts", return_value=[short_text]
-    ), patch("app.core.ai.openai.structured_question_llm", mock_llm), patch(
-        "app.core.ai.openai.parse_llm_output", return_value=[mock_question]
-    ), patch("app.core.ai.openai.logger") as mock_logger:
+    with (
+        patch("app.core.ai.openai.fetch_document_texts", return_value=[short_text]),
+        patch("app.core.ai.openai.structured_question_llm", mock_llm),
+        patch("app.core.ai.openai.parse_llm_output", return_value=[mock_question]),
+        patch("app.core.ai.openai.logger") as mock_logger,
+    ):
         mock_llm.ainvoke.return_value = mock_llm_output
 
         result = await generate_questions_from_documents(mock_session, document_ids)
@@ -433,17 +914,23 @@ async def test_generate_answer_explanation_success() -> None:
 
     mock_session = MagicMock()
     mock_embedding = [0.1, 0.2, 0.3]
-    mock_chunks = ["Chunk 1", "Chunk 2"]
+    mock_chunks = [make_chunk("Chunk 1"), make_chunk("Chunk 2")]
     mock_explanation = MagicMock()
     mock_explanation.explanation = "Explanation text"
     mock_explanation.key_takeaway = "Takeaway"
     mock_explanation.suggested_review = "Review"
 
-    with patch("app.core.ai.openai.embed_text", return_value=mock_embedding), patch(
-        "app.core.ai.openai.retrieve_top_k_chunks", return_value=mock_chunks
-    ), patch(
-        "app.core.ai.openai.structured_explanation_llm", new_callable=AsyncMock
-    ) as mock_llm, patch("app.core.ai.openai.ExplanationOutput") as mock_output:
+    with (
+        patch("app.core.ai.openai.embed_queries_cached", return_value=[mock_embedding]),
+        patch(
+            "app.core.ai.openai.retrieve_top_k_chunks", return_value=mock_chunks
+        ) as mock_retrieve,
+        patch(
+            "app.core.ai.openai.structured_explanation_llm", new_callable=AsyncMock
+        ) as mock_llm,
+        patch("app.core.ai.openai.ExplanationOutput") as mock_output,
+        patch.object(settings, "RETRIEVAL_MODE", "hybrid"),
+    ):
         mock_llm_instance = AsyncMock()
         mock_llm_instance.ainvoke.return_value = mock_explanation
         mock_llm.return_value = mock_llm_instance
@@ -458,6 +945,8 @@ async def test_generate_answer_explanation_success() -> None:
         )
 
     assert result == mock_explanation
+    assert mock_retrieve.call_args.kwargs["mode"] == RetrievalMode.hybrid
+    assert "What is 2+2?" in mock_retrieve.call_args.kwargs["query_text"]
 
 
 @pytest.mark.asyncio
@@ -486,13 +975,16 @@ async def test_generate_answer_explanation_api_error() -> None:
 
     mock_session = MagicMock()
     mock_embedding = [0.1, 0.2, 0.3]
-    mock_chunks = ["Chunk 1"]
-
-    with patch("app.core.ai.openai.embed_text", return_value=mock_embedding), patch(
-        "app.core.ai.openai.retrieve_top_k_chunks", return_value=mock_chunks
-    ), patch(
-        "app.core.ai.openai.structured_explanation_llm", new_callable=AsyncMock
-    ) as mock_llm, patch("app.core.ai.openai.logger"):
+    mock_chunks = [make_chunk("Chunk 1")]
+
+    with (
+        patch("app.core.ai.openai.embed_queries_cached", return_value=[mock_embedding]),
+        patch("app.core.ai.openai.retrieve_top_k_chunks", return_value=mock_chunks),
+        patch(
+            "app.core.ai.openai.structured_explanation_llm", new_callable=AsyncMock
+        ) as mock_llm,
+        patch("app.core.ai.openai.logger"),
+    ):
         mock_llm_instance = AsyncMock()
         mock_llm_instance.ainvoke.side_effect = Exception("API Error")
         mock_llm.return_value = mock_llm_instance
@@ -508,3 +1000,190 @@ async def test_generate_answer_explanation_api_error() -> None:
 
         assert exc_info.value.status_code == 500
         assert "Failed to generate answer explanation" in exc_info.value.detail
+
+
+@pytest.mark.asyncio
+async def test_generate_answer_explanations_batches_embedding_and_retrieval() -> None:
+    """Test that N wrong answers share one embedding call and one retrieval."""
+    mock_exam = MagicMock()
+    mock_exam.source_document_ids = [str(uuid.uuid4())]
+    requests = [
+        ExplanationRequest(question=f"Q{i}", correct_answer="A", user_answer="B")
+        for i in range(3)
+    ]
+    explanation = ExplanationOutput(
+        explanation="Because", key_takeaway="Remember", suggested_review="Read"
+    )
+
+    with (
+        patch(
+            "app.core.ai.openai.embed_queries_cached",
+            return_value=[[0.1], [0.2], [0.3]],
+        ) as mock_embed,
+        patch(
+            "app.core.ai.openai.retrieve_top_k_chunks_batch",
+            return_value=[[make_chunk("C0")], [make_chunk("C1")], []],
+        ) as mock_retrieve,
+        patch("app.core.ai.openai.get_exam_chunk_matrix", return_value=None),
+        patch("app.core.ai.openai.structured_explanation_llm") as mock_llm,
+    ):
+        mock_llm.ainvoke = AsyncMock(return_value=explanation)
+
+        result = await generate_answer_explanations(
+            session=MagicMock(), exam=mock_exam, requests=requests
+        )
+
+    assert result == [explanation] * 3
+    mock_embed.assert_called_once()
+    assert len(mock_embed.call_args[0][1]) == 3
+    mock_retrieve.assert_called_once()
+    assert mock_llm.ainvoke.call_count == 3
+    assert "C1" in mock_llm.ainvoke.call_args_list[1][0][0]
+
+
+@pytest.mark.asyncio
+async def test_generate_answer_explanations_uses_question_links() -> None:
+    """Test that linked questions skip embedding; the rest are retrieved."""
+    mock_exam = MagicMock()
+    mock_exam.source_document_ids = [str(uuid.uuid4())]
+    linked_id, unlinked_id = uuid.uuid4(), uuid.uuid4()
+    requests = [
+        ExplanationRequest(
+            question_id=linked_id, question="Q0", correct_answer="A", user_answer="B"
+        ),
+        ExplanationRequest(
+            question_id=unlinked_id, question="Q1", correct_answer="A", user_answer="B"
+        ),
+    ]
+    explanation = ExplanationOutput(
+        explanation="Because", key_takeaway="Remember", suggested_review="Read"
+    )
+
+    with (
+        patch(
+            "app.core.ai.openai.load_linked_chunks",
+            return_value={linked_id: [make_chunk("Linked")]},
+        ),
+        patch(
+            "app.core.ai.openai.embed_queries_cached", return_value=[[0.1]]
+        ) as mock_embed,
+        patch(
+            "app.core.ai.openai.retrieve_top_k_chunks_batch",
+            return_value=[[make_chunk("Retrieved")]],
+        ),
+        patch("app.core.ai.openai.get_exam_chunk_matrix", return_value=None),
+        patch("app.core.ai.openai.structured_explanation_llm") as mock_llm,
+    ):
+        mock_llm.ainvoke = AsyncMock(return_value=explanation)
+
+        await generate_answer_explanations(
+            session=MagicMock(), exam=mock_exam, requests=requests
+        )
+
+    assert len(mock_embed.call_args[0][1]) == 1
+    assert "Q1" in mock_embed.call_args[0][1][0]
+    assert "Linked" in mock_llm.ainvoke.call_args_list[0][0][0]
+    assert "Retrieved" in mock_llm.ainvoke.call_args_list[1][0][0]
+
+
+@pytest.mark.asyncio
+async def test_generate_answer_explanation_uses_question_links() -> None:
+    """Test that a linked question is explained without an embedding call."""
+    question_id = uuid.uuid4()
+    explanation = ExplanationOutput(
+        explanation="Because", key_takeaway="Remember", suggested_review="Read"
+    )
+
+    with (
+        patch(
+            "app.core.ai.openai.load_linked_chunks",
+            return_value={question_id: [make_chunk("Linked")]},
+        ),
+        patch("app.core.ai.openai.embed_queries_cached") as mock_embed,
+        patch("app.core.ai.openai.structured_explanation_llm") as mock_llm,
+    ):
+        mock_llm.ainvoke = AsyncMock(return_value=explanation)
+
+        result = await generate_answer_explanation(
+            session=MagicMock(),
+            exam=MagicMock(),
+            question="Q",
+            correct_answer="A",
+            user_answer="B",
+            question_id=question_id,
+        )
+
+    assert result == explanation
+    mock_embed.assert_not_called()
+    assert "Linked" in mock_llm.ainvoke.call_args[0][0]
+
+
+@pytest.mark.asyncio
+async def test_generate_answer_explanations_empty() -> None:
+    """Test that nothing is embedded when there is nothing to explain."""
+    with patch("app.core.ai.openai.embed_queries_cached") as mock_embed:
+        result = await generate_answer_explanations(
+            session=MagicMock(), exam=MagicMock(), requests=[]
+        )
+
+    assert result == []
+    mock_embed.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_generate_answer_explanations_no_correct_answer() -> None:
+    """Test that batch explanation requires correct answers."""
+    requests = [ExplanationRequest(question="Q", correct_answer="", user_answer="B")]
+
+    with pytest.raises(ValueError):
+        await generate_answer_explanations(
+            session=MagicMock(), exam=MagicMock(), requests=requests
+        )
+
+
+def test_retrieve_exam_contexts_uses_cached_matrix() -> None:
+    """Test that a cached exam matrix replaces the SQL search."""
+    mock_matrix = MagicMock()
+    mock_matrix.top_k_batch.return_value = [[make_chunk("Cached")]]
+
+    with (
+        patch("app.core.ai.openai.get_exam_chunk_matrix", return_value=mock_matrix),
+        patch("app.core.ai.openai.retrieve_top_k_chunks_batch") as mock_retrieve,
+    ):
+        result = retrieve_exam_contexts(
+            session=MagicMock(),
+            exam_id=uuid.uuid4(),
+            document_ids=[uuid.uuid4()],
+            query_embeddings=[[0.1, 0.2]],
+            query_texts=["Question"],
+            k=4,
+        )
+
+    assert [chunk.text for chunk in result[0]] == ["Cached"]
+    mock_matrix.top_k_batch.assert_called_once_with([[0.1, 0.2]], 4)
+    mock_retrieve.assert_not_called()
+
+
+def test_retrieve_exam_contexts_hybrid_skips_cache() -> None:
+    """Test that hybrid retrieval goes to Postgres with the query texts."""
+    with (
+        patch("app.core.ai.openai.settings") as mock_settings,
+        patch("app.core.ai.openai.get_exam_chunk_matrix") as mock_cache,
+        patch(
+            "app.core.ai.openai.retrieve_top_k_chunks_batch", return_value=[[]]
+        ) as mock_retrieve,
+    ):
+        mock_settings.RETRIEVAL_MODE = "hybrid"
+        mock_settings.VECTOR_CACHE_ENABLED = True
+        retrieve_exam_contexts(
+            session=MagicMock(),
+            exam_id=uuid.uuid4(),
+            document_ids=[uuid.uuid4()],
+            query_embeddings=[[0.1, 0.2]],
+            query_texts=["Question"],
+            k=4,
+        )
+
+    mock_cache.assert_not_called()
+    assert mock_retrieve.call_args.kwargs["mode"] == RetrievalMode.hybrid
+    assert mock_retrieve.call_args.kwargs["query_texts"] == ["Question"]
@@ -0,0 +1,386 @@
+from collections.abc import AsyncIterator
+from unittest.mock import AsyncMock, patch
+
+import numpy as np
+import pytest
+from fastapi import HTTPException
+from sqlmodel import Session, select
+
+from app.core.ai.question_bank import (
+    add_bank_questions,
+    fetch_texts_by_document,
+    generate_questions_banked,
+    split_questions,
+    stream_questions_banked,
+    top_up_question_banks,
+)
+from app.core.config import settings
+from app.core.vectors import EMBEDDING_DIM
+from app.models import (
+    BankQuestion,
+    Difficulty,
+    Document,
+    DocumentChunk,
+    QuestionCreate,
+    QuestionType,
+)
+from tests.utils.document import create_random_document
+
+
+def axis(i: int) -> np.ndarray:
+    vector = np.zeros(EMBEDDING_DIM, dtype=np.float32)
+    vector[i] = 1.0
+    return vector
+
+
+def make_questions(
+    topic: str,
+    count: int,
+    question_type: QuestionType = QuestionType.multiple_choice,
+) -> list[QuestionCreate]:
+    return [
+        QuestionCreate(
+            question=f"What does {topic} imply for case{i} term{i} part{i}?",
+            correct_answer="A",
+            type=question_type,
+            options=["A", "B", "C"],
+        )
+        for i in range(count)
+    ]
+
+
+def bank(db: Session, document_id: object) -> list[BankQuestion]:
+    db.expire_all()
+    return list(
+        db.exec(select(BankQuestion).where(BankQuestion.document_id == document_id))
+    )
+
+
+@pytest.mark.asyncio
+async def test_generate_questions_banked_fills_bank_then_reuses_it(
+    db: Session,
+) -> None:
+    document = create_random_document(db)
+    texts = fetch_texts_by_document(db, [document.id])
+    generate = AsyncMock(
+        return_value=make_questions("osmosis", 3)
+        + make_questions("diffusion", 2, QuestionType.true_false)
+    )
+
+    with patch("app.core.ai.question_bank.generate_questions_from_texts", generate):
+        first = await generate_questions_banked(
+            db, texts, num_questions=5, difficulty=Difficulty.easy
+        )
+        second = await generate_questions_banked(
+            db, texts, num_questions=5, difficulty=Difficulty.easy
+        )
+
+    generate.assert_awaited_once()
+    assert generate.call_args.kwargs["num_questions"] == 5
+    assert {q.question for q in second} == {q.question for q in first}
+    assert [q.served_count for q in bank(db, document.id)] == [2] * 5
+
+
+@pytest.mark.asyncio
+async def test_generate_questions_banked_generates_only_shortfall(
+    db: Session,
+) -> None:
+    document = create_random_document(db)
+    add_bank_questions(
+        db,
+        document.id,
+        make_questions("entropy", 3),
+        difficulty=Difficulty.medium,
+        served=False,
+    )
+    db.commit()
+    texts = fetch_texts_by_document(db, [document.id])
+    generate = AsyncMock(return_value=make_questions("enthalpy", 2))
+
+    with patch("app.core.ai.question_bank.generate_questions_from_texts", generate):
+        result = await generate_questions_banked(db, texts, num_questions=5)
+
+    assert generate.call_args.kwargs["num_questions"] == 2
+    assert len(result) == 5
+    assert len(bank(db, document.id)) == 5
+
+
+@pytest.mark.asyncio
+async def test_generate_questions_banked_balances_question_types(
+    db: Session,
+) -> None:
+    document = create_random_document(db)
+    add_bank_questions(
+        db,
+        document.id,
+        make_questions("entropy", 4),
+        difficulty=Difficulty.medium,
+        served=False,
+    )
+    db.commit()
+    texts = fetch_texts_by_document(db, [document.id])
+    generate = AsyncMock(
+        return_value=make_questions("enthalpy", 2, QuestionType.true_false)
+    )
+
+    with patch("app.core.ai.question_bank.generate_questions_from_texts", generate):
+        result = await generate_questions_banked(db, texts, num_questions=4)
+
+    # Half of the exam is drawn from the multiple choice bank, the true or
+    # false half is generated
+    assert generate.call_args.kwargs["num_questions"] == 2
+    assert generate.call_args.kwargs["question_types"] == [QuestionType.true_false]
+    assert (
+        sorted(q.type for q in result)
+        == [QuestionType.multiple_choice] * 2 + [QuestionType.true_false] * 2
+    )
+
+
+@pytest.mark.asyncio
+async def test_generate_questions_banked_skips_retired_questions(
+    db: Session,
+) -> None:
+    document = create_random_document(db)
+    add_bank_questions(
+        db,
+        document.id,
+        make_questions("entropy", 5),
+        difficulty=Difficulty.medium,
+        served=False,
+    )
+    for question in bank(db, document.id):
+        question.served_count = settings.QUESTION_BANK_MAX_SERVES
+        db.add(question)
+    db.commit()
+    texts = fetch_texts_by_document(db, [document.id])
+    generate = AsyncMock(return_value=make_questions("osmosis", 5))
+
+    with patch("app.core.ai.question_bank.generate_questions_from_texts", generate):
+        await generate_questions_banked(db, texts, num_questions=5)
+
+    assert generate.call_args.kwargs["num_questions"] == 5
+
+
+@pytest.mark.asyncio
+async def test_stream_questions_banked_yields_bank_first(db: Session) -> None:
+    document = create_random_document(db)
+    add_bank_questions(
+        db,
+        document.id,
+        make_questions("entropy", 2),
+        difficulty=Difficulty.medium,
+        served=False,
+    )
+    db.commit()
+    texts = fetch_texts_by_document(db, [document.id])
+    calls: list[int] = []
+
+    async def fake_stream(
+        _: list[str], *, num_questions: int, **__: object
+    ) -> AsyncIterator[QuestionCreate]:
+        calls.append(num_questions)
+        for question in make_questions("osmosis", num_questions):
+            yield question
+
+    with patch(
+        "app.core.ai.question_bank.stream_questions_from_texts",
+        side_effect=fake_stream,
+    ):
+        result = [q async for q in stream_questions_banked(db, texts, num_questions=5)]
+
+    assert calls == [3]
+    assert ["entropy" in q.question for q in result] == [True] * 2 + [False] * 3
+    stored = bank(db, document.id)
+    assert len(stored) == 5
+    assert all(q.served_count == 1 for q in stored)
+
+
+def test_add_bank_questions_skips_near_duplicates(db: Session) -> None:
+    document = create_random_document(db)
+    questions = make_questions("entropy", 2)
+
+    first = add_bank_questions(
+        db, document.id, questions, difficulty=Difficulty.medium, served=False
+    )
+    second = add_bank_questions(
+        db,
+        document.id,
+        questions + make_questions("osmosis", 1),
+        difficulty=Difficulty.medium,
+        served=False,
+    )
+    db.commit()
+
+    assert len(first) == 2
+    assert [q.question for q in second] == [make_questions("osmosis", 1)[0].question]
+    assert len(bank(db, document.id)) == 3
+
+
+@pytest.mark.asyncio
+async def test_top_up_question_banks_refills_popular_documents(db: Session) -> None:
+    popular = create_random_document(db)
+    quiet = create_random_document(db)
+    for document in (popular, quiet):
+        add_bank_questions(
+            db,
+            document.id,
+            make_questions(f"topic {document.id}", 2),
+            difficulty=Difficulty.medium,
+            served=False,
+        )
+    for question in bank(db, popular.id):
+        question.served_count = settings.QUESTION_BANK_POPULAR_SERVES
+        db.add(question)
+    db.commit()
+    generate = AsyncMock(return_value=make_questions("refill", 3))
+
+    with (
+        patch.object(settings, "QUESTION_BANK_MIN_STOCK", 5),
+        patch("app.core.ai.question_bank.generate_questions_from_texts", generate),
+    ):
+        await top_up_question_banks([popular.id, quiet.id])
+
+    generate.assert_awaited_once()
+    assert generate.call_args.kwargs["num_questions"] == 3
+    assert len(bank(db, popular.id)) == 5
+    assert len(bank(db, quiet.id)) == 2
+
+
+@pytest.mark.asyncio
+async def test_top_up_question_banks_logs_failures(db: Session) -> None:
+    document = create_random_document(db)
+
+    with (
+        patch("app.core.ai.question_bank.bank_stock", side_effect=Exception("DB down")),
+        patch("app.core.ai.question_bank.logger") as mock_logger,
+    ):
+        await top_up_question_banks([document.id])
+
+    mock_logger.warning.assert_called_once()
+
+
+def test_fetch_texts_by_document_refuses_documents_without_text(
+    db: Session,
+) -> None:
+    document = db.get(Document, create_random_document(db).id)
+    assert document
+    document.extracted_text = None
+    db.add(document)
+    db.commit()
+
+    with pytest.raises(HTTPException) as exc_info:
+        fetch_texts_by_document(db, [document.id])
+
+    assert exc_info.value.status_code == 409
+
+
+def test_split_questions_sums_to_num_questions() -> None:
+    assert split_questions([900, 100], 10) == [9, 1]
+    assert split_questions([1, 1, 1, 1, 1], 1) == [1, 0, 0, 0, 0]
+    assert split_questions([5, 3, 2], 4) == [2, 1, 1]
+    assert split_questions([0, 0], 3) == [2, 1]
+
+
+@pytest.mark.asyncio
+async def test_generate_questions_banked_draws_no_more_than_asked(
+    db: Session,
+) -> None:
+    documents = [create_random_document(db) for _ in range(3)]
+    for document in documents:
+        add_bank_questions(
+            db,
+            document.id,
+            make_questions(f"topic {document.id}", 2),
+            difficulty=Difficulty.medium,
+            served=False,
+        )
+    db.commit()
+    texts = fetch_texts_by_document(db, [document.id for document in documents])
+    generate = AsyncMock(return_value=[])
+
+    with patch("app.core.ai.question_bank.generate_questions_from_texts", generate):
+        result = await generate_questions_banked(db, texts, num_questions=1)
+
+    generate.assert_not_awaited()
+    assert len(result) == 1
+
+
+def test_fetch_texts_by_document_with_topics_uses_retrieved_chunks(
+    db: Session,
+) -> None:
+    first = create_random_document(db)
+    second = create_random_document(db)
+    db.add_all(
+        [
+            DocumentChunk(
+                document_id=document_id,
+                text=text,
+                size=len(text),
+                start_offset=offset,
+                embedding=axis(topic),
+            )
+            for document_id, text, offset, topic in (
+                (first.id, "Osmosis moves water", 0, 0),
+                (first.id, "Mitosis splits cells", 100, 1),
+                (first.id, "Diffusion spreads solutes", 200, 0),
+                (second.id, "Entropy always grows", 0, 2),
+            )
+        ]
+    )
+    db.commit()
+
+    with (
+        patch.object(settings, "TOPIC_CONTEXT_CHUNKS", 2),
+        patch.object(settings, "RETRIEVAL_MODE", "vector"),
+        patch(
+            "app.core.ai.question_bank.embed_queries_cached",
+            return_value=np.vstack([axis(0)]),
+        ) as embed,
+    ):
+        texts = fetch_texts_by_document(db, [first.id, second.id], ["osmosis"])
+
+    embed.assert_called_once_with(db, ["osmosis"])
+    # The two chunks nearest the topic, in reading order; the other
+    # document has none among them
+    assert texts == {first.id: "Osmosis moves water\n\nDiffusion spreads solutes"}
+
+
+def test_fetch_texts_by_document_with_unretrieved_topics_uses_whole_texts(
+    db: Session,
+) -> None:
+    document = create_random_document(db)
+
+    with patch(
+        "app.core.ai.question_bank.embed_queries_cached",
+        return_value=np.vstack([axis(0)]),
+    ):
+        texts = fetch_texts_by_document(db, [document.id], ["osmosis"])
+
+    assert texts == fetch_texts_by_document(db, [document.id])
+    assert texts
+
+
+@pytest.mark.asyncio
+async def test_generate_questions_banked_without_bank_generates_all(
+    db: Session,
+) -> None:
+    document = create_random_document(db)
+    add_bank_questions(
+        db,
+        document.id,
+        make_questions("entropy", 5),
+        difficulty=Difficulty.medium,
+        served=False,
+    )
+    db.commit()
+    generate = AsyncMock(return_value=make_questions("osmosis", 5))
+
+    with patch("app.core.ai.question_bank.generate_questions_from_texts", generate):
+        result = await generate_questions_banked(
+            db, {document.id: "Osmosis excerpt"}, num_questions=5, use_bank=False
+        )
+
+    generate.assert_awaited_once()
+    assert generate.call_args.args[0] == ["Osmosis excerpt"]
+    assert all("osmosis" in q.question for q in result)
+    assert [q.served_count for q in bank(db, document.id)] == [0] * 5
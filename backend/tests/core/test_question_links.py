@@ -0,0 +1,149 @@
+from collections.abc import Generator
+from unittest.mock import patch
+
+import pytest
+from sqlmodel import Session, select
+
+from app.core.ai.question_links import (
+    build_question_query,
+    link_exam_questions,
+    link_questions_to_chunks,
+)
+from app.core.ai.retrieval import load_linked_chunks
+from app.core.config import settings
+from app.models import DocumentChunk, Exam, QuestionChunkLink
+from tests.utils.document import create_random_document
+from tests.utils.exam import create_random_exam
+
+
+@pytest.fixture(autouse=True)
+def exact_scan() -> Generator[None, None, None]:
+    # The links must not depend on the pgvector version of the test database
+    with patch.object(settings, "HNSW_ITERATIVE_SCAN", "off"):
+        yield
+
+
+def unit_vector(index: int) -> list[float]:
+    vector = [0.0] * 1536
+    vector[index] = 1.0
+    return vector
+
+
+def add_chunks(db: Session, document_id: object, count: int) -> list[DocumentChunk]:
+    chunks = [
+        DocumentChunk(
+            document_id=document_id,
+            text=f"chunk {i}",
+            size=7,
+            embedding=unit_vector(i),
+        )
+        for i in range(count)
+    ]
+    db.add_all(chunks)
+    db.commit()
+    return chunks
+
+
+def make_exam(db: Session, document_id: object) -> Exam:
+    exam = db.get(Exam, create_random_exam(db).id)
+    assert exam is not None
+    exam.source_document_ids = [str(document_id)]
+    db.add(exam)
+    db.commit()
+    db.refresh(exam)
+    return exam
+
+
+def test_link_questions_to_chunks_stores_ranked_links(db: Session) -> None:
+    document = create_random_document(db)
+    chunks = add_chunks(db, document.id, 3)
+    exam = make_exam(db, document.id)
+    questions = list(exam.questions)
+
+    with patch(
+        "app.core.ai.question_links.embed_queries_cached",
+        return_value=[unit_vector(i) for i in range(len(questions))],
+    ) as mock_embed:
+        count = link_questions_to_chunks(
+            db, questions=questions, document_ids=[document.id]
+        )
+    db.commit()
+
+    assert count == len(questions) * len(chunks)
+    mock_embed.assert_called_once()
+    assert mock_embed.call_args[0][1][0] == build_question_query(questions[0])
+    linked = load_linked_chunks(db, [q.id for q in questions])
+    for i, question in enumerate(questions):
+        assert linked[question.id][0].id == chunks[i].id
+        assert linked[question.id][0].distance < 1e-6
+
+
+def test_link_questions_to_chunks_replaces_links(db: Session) -> None:
+    document = create_random_document(db)
+    add_chunks(db, document.id, 2)
+    exam = make_exam(db, document.id)
+    questions = list(exam.questions)[:1]
+
+    with patch(
+        "app.core.ai.question_links.embed_queries_cached",
+        return_value=[unit_vector(0)],
+    ):
+        link_questions_to_chunks(db, questions=questions, document_ids=[document.id])
+        link_questions_to_chunks(db, questions=questions, document_ids=[document.id])
+    db.commit()
+
+    links = db.exec(
+        select(QuestionChunkLink).where(
+            QuestionChunkLink.question_id == questions[0].id
+        )
+    ).all()
+    assert sorted(link.rank for link in links) == [0, 1]
+
+
+def test_link_questions_to_chunks_without_chunks(db: Session) -> None:
+    document = create_random_document(db)
+    exam = make_exam(db, document.id)
+
+    with patch("app.core.ai.question_links.embed_queries_cached") as mock_embed:
+        count = link_questions_to_chunks(
+            db, questions=list(exam.questions), document_ids=[document.id]
+        )
+
+    assert count == 0
+    mock_embed.assert_not_called()
+
+
+def test_links_removed_with_chunks(db: Session) -> None:
+    document = create_random_document(db)
+    chunks = add_chunks(db, document.id, 1)
+    exam = make_exam(db, document.id)
+    questions = list(exam.questions)
+
+    with patch(
+        "app.core.ai.question_links.embed_queries_cached",
+        return_value=[unit_vector(0)] * len(questions),
+    ):
+        link_questions_to_chunks(db, questions=questions, document_ids=[document.id])
+    db.commit()
+    db.delete(chunks[0])
+    db.commit()
+
+    assert load_linked_chunks(db, [q.id for q in questions]) == {}
+
+
+def test_link_exam_questions_logs_failures(db: Session) -> None:
+    document = create_random_document(db)
+    add_chunks(db, document.id, 1)
+    exam = make_exam(db, document.id)
+
+    with (
+        patch(
+            "app.core.ai.question_links.embed_queries_cached",
+            side_effect=Exception("API Error"),
+        ),
+        patch("app.core.ai.question_links.logger") as mock_logger,
+    ):
+        link_exam_questions(exam.id)
+
+    mock_logger.warning.assert_called_once()
+    assert load_linked_chunks(db, [q.id for q in exam.questions]) == {}
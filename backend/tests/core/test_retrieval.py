@@ -1,7 +1,61 @@
 import uuid
-from unittest.mock import MagicMock
+from collections.abc import Generator
+from types import SimpleNamespace
+from typing import Any
+from unittest.mock import MagicMock, patch
+
+import numpy as np
+import pytest
+from sqlmodel import Session
+
+from app.core.ai import retrieval
+from app.core.ai.retrieval import (
+    BINARY_QUANTIZE_VERSION,
+    HYBRID_CANDIDATES_PER_RESULT,
+    apply_vector_search_settings,
+    attach_embeddings,
+    load_linked_chunks,
+    pgvector_version,
+    retrieve_top_k_chunks,
+    retrieve_top_k_chunks_batch,
+)
+from app.core.vectors import EMBEDDING_DIM
+from app.models import DocumentChunk, RetrievalMode, RetrievedChunk
+from tests.utils.document import create_random_document
+
+
+@pytest.fixture(autouse=True)
+def pgvector_0_8() -> Generator[None, None, None]:
+    """Mock sessions cannot report the extension version; assume 0.8."""
+    with patch("app.core.ai.retrieval.pgvector_version", return_value=(0, 8)):
+        yield
+
+
+@pytest.fixture
+def real_pgvector() -> Generator[None, None, None]:
+    """For tests against Postgres: the extension version it really has."""
+    with (
+        patch("app.core.ai.retrieval.pgvector_version", pgvector_version),
+        patch.object(retrieval, "_binary_fallbacks", set()),
+    ):
+        yield
+
+
+def make_row(text: str, distance: float = 0.1, document_id: Any = None) -> Any:
+    return SimpleNamespace(
+        id=uuid.uuid4(),
+        document_id=document_id or uuid.uuid4(),
+        text=text,
+        distance=distance,
+        start_offset=None,
+        token_count=None,
+    )
+
 
-from app.core.ai.retrieval import retrieve_top_k_chunks
+def make_session(rows: list[Any]) -> MagicMock:
+    mock_session = MagicMock()
+    mock_session.execute.return_value.all.return_value = rows
+    return mock_session
 
 
 def test_retrieve_top_k_chunks_success() -> None:
@@ -10,19 +64,13 @@ def test_retrieve_top_k_chunks_success() -> None:
     query_embedding = [0.1, 0.2, 0.3, 0.4, 0.5]
     k = 3
 
-    mock_chunk1 = MagicMock()
-    mock_chunk1.text = "Chunk 1 text"
-    mock_chunk2 = MagicMock()
-    mock_chunk2.text = "Chunk 2 text"
-    mock_chunk3 = MagicMock()
-    mock_chunk3.text = "Chunk 3 text"
-
-    mock_session = MagicMock()
-    mock_scalars = MagicMock()
-    mock_scalars.all.return_value = [mock_chunk1, mock_chunk2, mock_chunk3]
-    mock_execute = MagicMock()
-    mock_execute.scalars.return_value = mock_scalars
-    mock_session.execute.return_value = mock_execute
+    mock_session = make_session(
+        [
+            make_row("Chunk 1 text", 0.1),
+            make_row("Chunk 2 text", 0.2),
+            make_row("Chunk 3 text", 0.3),
+        ]
+    )
 
     result = retrieve_top_k_chunks(
         session=mock_session,
@@ -32,8 +80,13 @@ def test_retrieve_top_k_chunks_success() -> None:
     )
 
     assert len(result) == 3
-    assert result == ["Chunk 1 text", "Chunk 2 text", "Chunk 3 text"]
-    mock_session.execute.assert_called_once()
+    assert [chunk.text for chunk in result] == [
+        "Chunk 1 text",
+        "Chunk 2 text",
+        "Chunk 3 text",
+    ]
+    # search settings + the top-k query
+    assert mock_session.execute.call_count == 2
 
 
 def test_retrieve_top_k_chunks_default_k() -> None:
@@ -41,12 +94,7 @@ def test_retrieve_top_k_chunks_default_k() -> None:
     document_ids = [uuid.uuid4()]
     query_embedding = [0.1, 0.2, 0.3]
 
-    mock_session = MagicMock()
-    mock_scalars = MagicMock()
-    mock_scalars.all.return_value = []
-    mock_execute = MagicMock()
-    mock_execute.scalars.return_value = mock_scalars
-    mock_session.execute.return_value = mock_execute
+    mock_session = make_session([])
 
     result = retrieve_top_k_chunks(
         session=mock_session,
@@ -66,12 +114,7 @@ def test_retrieve_top_k_chunks_empty_result() -> None:
     query_embedding = [0.1, 0.2, 0.3]
     k = 5
 
-    mock_session = MagicMock()
-    mock_scalars = MagicMock()
-    mock_scalars.all.return_value = []
-    mock_execute = MagicMock()
-    mock_execute.scalars.return_value = mock_scalars
-    mock_session.execute.return_value = mock_execute
+    mock_session = make_session([])
 
     result = retrieve_top_k_chunks(
         session=mock_session,
@@ -88,12 +131,7 @@ def test_retrieve_top_k_chunks_filters_by_document_ids() -> None:
     document_ids = [uuid.uuid4(), uuid.uuid4()]
     query_embedding = [0.1, 0.2, 0.3]
 
-    mock_session = MagicMock()
-    mock_scalars = MagicMock()
-    mock_scalars.all.return_value = []
-    mock_execute = MagicMock()
-    mock_execute.scalars.return_value = mock_scalars
-    mock_session.execute.return_value = mock_execute
+    mock_session = make_session([])
 
     retrieve_top_k_chunks(
         session=mock_session,
@@ -104,6 +142,7 @@ def test_retrieve_top_k_chunks_filters_by_document_ids() -> None:
     # Verify the query includes document_id filter
     call_args = mock_session.execute.call_args[0][0]
     assert call_args is not None
+    assert "document_id IN" in str(call_args)
 
 
 def test_retrieve_top_k_chunks_orders_by_cosine_distance() -> None:
@@ -111,12 +150,7 @@ def test_retrieve_top_k_chunks_orders_by_cosine_distance() -> None:
     document_ids = [uuid.uuid4()]
     query_embedding = [0.1, 0.2, 0.3]
 
-    mock_session = MagicMock()
-    mock_scalars = MagicMock()
-    mock_scalars.all.return_value = []
-    mock_execute = MagicMock()
-    mock_execute.scalars.return_value = mock_scalars
-    mock_session.execute.return_value = mock_execute
+    mock_session = make_session([])
 
     retrieve_top_k_chunks(
         session=mock_session,
@@ -127,6 +161,7 @@ def test_retrieve_top_k_chunks_orders_by_cosine_distance() -> None:
     # Verify order_by is called (implicitly through the query structure)
     call_args = mock_session.execute.call_args[0][0]
     assert call_args is not None
+    assert "ORDER BY distance" in str(call_args)
 
 
 def test_retrieve_top_k_chunks_respects_k_limit() -> None:
@@ -135,20 +170,10 @@ def test_retrieve_top_k_chunks_respects_k_limit() -> None:
     query_embedding = [0.1, 0.2, 0.3]
     k = 2
 
-    mock_chunk1 = MagicMock()
-    mock_chunk1.text = "Chunk 1"
-    mock_chunk2 = MagicMock()
-    mock_chunk2.text = "Chunk 2"
-    mock_chunk3 = MagicMock()
-    mock_chunk3.text = "Chunk 3"
-
-    mock_session = MagicMock()
-    mock_scalars = MagicMock()
     # Even though we return 3 chunks, limit should be 2
-    mock_scalars.all.return_value = [mock_chunk1, mock_chunk2, mock_chunk3]
-    mock_execute = MagicMock()
-    mock_execute.scalars.return_value = mock_scalars
-    mock_session.execute.return_value = mock_execute
+    mock_session = make_session(
+        [make_row("Chunk 1"), make_row("Chunk 2"), make_row("Chunk 3")]
+    )
 
     result = retrieve_top_k_chunks(
         session=mock_session,
@@ -167,17 +192,12 @@ def test_retrieve_top_k_chunks_multiple_documents() -> None:
     document_ids = [uuid.uuid4(), uuid.uuid4(), uuid.uuid4()]
     query_embedding = [0.1, 0.2, 0.3]
 
-    mock_chunk1 = MagicMock()
-    mock_chunk1.text = "Doc 1 chunk"
-    mock_chunk2 = MagicMock()
-    mock_chunk2.text = "Doc 2 chunk"
-
-    mock_session = MagicMock()
-    mock_scalars = MagicMock()
-    mock_scalars.all.return_value = [mock_chunk1, mock_chunk2]
-    mock_execute = MagicMock()
-    mock_execute.scalars.return_value = mock_scalars
-    mock_session.execute.return_value = mock_execute
+    mock_session = make_session(
+        [
+            make_row("Doc 1 chunk", document_id=document_ids[0]),
+            make_row("Doc 2 chunk", document_id=document_ids[1]),
+        ]
+    )
 
     result = retrieve_top_k_chunks(
         session=mock_session,
@@ -186,5 +206,506 @@ def test_retrieve_top_k_chunks_multiple_documents() -> None:
     )
 
     assert len(result) == 2
-    assert "Doc 1 chunk" in result
-    assert "Doc 2 chunk" in result
+    texts = [chunk.text for chunk in result]
+    assert "Doc 1 chunk" in texts
+    assert "Doc 2 chunk" in texts
+    assert {chunk.document_id for chunk in result} == set(document_ids[:2])
+
+
+def test_retrieve_top_k_chunks_never_selects_embedding() -> None:
+    """Test that the query projects columns instead of loading embeddings."""
+    mock_session = make_session([])
+
+    retrieve_top_k_chunks(
+        session=mock_session,
+        document_ids=[uuid.uuid4()],
+        query_embedding=[0.1, 0.2, 0.3],
+    )
+
+    stmt = mock_session.execute.call_args[0][0]
+    selected = [column.name for column in stmt.selected_columns]
+    assert selected == [
+        "id",
+        "document_id",
+        "text",
+        "start_offset",
+        "token_count",
+        "distance",
+    ]
+
+
+def test_retrieve_top_k_chunks_returns_similarity() -> None:
+    """Test that distance and similarity are exposed on each chunk."""
+    mock_session = make_session([make_row("Close", 0.25)])
+
+    result = retrieve_top_k_chunks(
+        session=mock_session,
+        document_ids=[uuid.uuid4()],
+        query_embedding=[0.1, 0.2, 0.3],
+    )
+
+    assert result[0].distance == 0.25
+    assert result[0].similarity == 0.75
+
+
+def test_retrieve_top_k_chunks_min_similarity() -> None:
+    """Test that chunks below the similarity threshold are dropped."""
+    mock_session = make_session([make_row("Close", 0.1), make_row("Far", 0.8)])
+
+    result = retrieve_top_k_chunks(
+        session=mock_session,
+        document_ids=[uuid.uuid4()],
+        query_embedding=[0.1, 0.2, 0.3],
+        min_similarity=0.5,
+    )
+
+    assert [chunk.text for chunk in result] == ["Close"]
+
+
+def test_apply_vector_search_settings_uses_defaults() -> None:
+    """Test that HNSW settings default to the configured values."""
+    mock_session = MagicMock()
+
+    with (
+        patch("app.core.ai.retrieval.settings") as mock_settings,
+        patch("app.core.ai.retrieval.pgvector_version", return_value=(0, 8)),
+    ):
+        mock_settings.HNSW_EF_SEARCH = 100
+        mock_settings.HNSW_ITERATIVE_SCAN = "strict_order"
+        mock_settings.HNSW_MAX_SCAN_TUPLES = 20_000
+        apply_vector_search_settings(mock_session)
+
+    params = mock_session.execute.call_args[0][1]
+    assert params == {
+        "ef_search": "100",
+        "iterative_scan": "strict_order",
+        "max_scan_tuples": "20000",
+    }
+    assert "set_config('hnsw.ef_search'" in str(mock_session.execute.call_args[0][0])
+
+
+def test_apply_vector_search_settings_iterative_scan_off() -> None:
+    """Test that iterative scan settings are skipped when disabled."""
+    mock_session = MagicMock()
+
+    with patch("app.core.ai.retrieval.settings") as mock_settings:
+        mock_settings.HNSW_EF_SEARCH = 40
+        mock_settings.HNSW_ITERATIVE_SCAN = "off"
+        apply_vector_search_settings(mock_session)
+
+    stmt, params = mock_session.execute.call_args[0]
+    assert params == {"ef_search": "40"}
+    assert "iterative_scan" not in str(stmt)
+
+
+def test_apply_vector_search_settings_skips_iterative_scan_before_0_8() -> None:
+    """Test that iterative scan settings are skipped where pgvector lacks them."""
+    mock_session = MagicMock()
+
+    with (
+        patch("app.core.ai.retrieval.settings") as mock_settings,
+        patch("app.core.ai.retrieval.pgvector_version", return_value=(0, 6)),
+    ):
+        mock_settings.HNSW_EF_SEARCH = 40
+        mock_settings.HNSW_ITERATIVE_SCAN = "strict_order"
+        apply_vector_search_settings(mock_session)
+
+    stmt, params = mock_session.execute.call_args[0]
+    assert params == {"ef_search": "40"}
+    assert "iterative_scan" not in str(stmt)
+
+
+def test_pgvector_version_is_looked_up_once_per_engine() -> None:
+    """Test that the extension version is queried once and parsed."""
+    mock_session = MagicMock()
+    mock_session.execute.return_value.scalar_one_or_none.return_value = "0.6.2"
+
+    with patch.dict("app.core.ai.retrieval._pgvector_versions", clear=True):
+        assert pgvector_version(mock_session) == (0, 6)
+        assert pgvector_version(mock_session) == (0, 6)
+
+    mock_session.execute.assert_called_once()
+
+
+def test_apply_vector_search_settings_ef_search_at_least_k() -> None:
+    """Test that ef_search is never lower than k."""
+    mock_session = MagicMock()
+
+    apply_vector_search_settings(mock_session, k=200, ef_search=40)
+
+    params = mock_session.execute.call_args[0][1]
+    assert params["ef_search"] == "200"
+
+
+def test_retrieve_top_k_chunks_per_query_ef_search() -> None:
+    """Test that a per-query ef_search is applied before the search."""
+    mock_session = make_session([])
+
+    retrieve_top_k_chunks(
+        session=mock_session,
+        document_ids=[uuid.uuid4()],
+        query_embedding=[0.1, 0.2, 0.3],
+        ef_search=250,
+    )
+
+    settings_call = mock_session.execute.call_args_list[0]
+    assert settings_call[0][1]["ef_search"] == "250"
+
+
+def test_retrieve_top_k_chunks_batch_groups_by_query() -> None:
+    """Test that batched rows are grouped per query, in query order."""
+    rows = [
+        SimpleNamespace(query_index=0, **vars(make_row("Q0 first", 0.1))),
+        SimpleNamespace(query_index=0, **vars(make_row("Q0 second", 0.2))),
+        SimpleNamespace(query_index=2, **vars(make_row("Q2 first", 0.3))),
+    ]
+    mock_session = make_session(rows)
+
+    result = retrieve_top_k_chunks_batch(
+        session=mock_session,
+        document_ids=[uuid.uuid4()],
+        query_embeddings=[[0.1, 0.2], [0.3, 0.4], [0.5, 0.6]],
+        k=2,
+    )
+
+    assert [[chunk.text for chunk in chunks] for chunks in result] == [
+        ["Q0 first", "Q0 second"],
+        [],
+        ["Q2 first"],
+    ]
+    # search settings + a single retrieval statement for all queries
+    assert mock_session.execute.call_count == 2
+
+
+def test_retrieve_top_k_chunks_batch_single_lateral_statement() -> None:
+    """Test that the batch query joins a VALUES list to a LATERAL top-k."""
+    mock_session = make_session([])
+
+    retrieve_top_k_chunks_batch(
+        session=mock_session,
+        document_ids=[uuid.uuid4()],
+        query_embeddings=[[0.1, 0.2], [0.3, 0.4]],
+    )
+
+    sql = str(mock_session.execute.call_args[0][0])
+    assert "VALUES" in sql
+    assert "LATERAL" in sql
+
+
+def test_retrieve_top_k_chunks_batch_no_queries() -> None:
+    """Test that no statement is run without query embeddings."""
+    mock_session = MagicMock()
+
+    result = retrieve_top_k_chunks_batch(
+        session=mock_session,
+        document_ids=[uuid.uuid4()],
+        query_embeddings=[],
+    )
+
+    assert result == []
+    mock_session.execute.assert_not_called()
+
+
+def test_retrieve_top_k_chunks_hybrid_single_statement() -> None:
+    """Test that hybrid mode fuses vector and full-text ranks in one query."""
+    mock_session = make_session([make_row("Entropy definition")])
+
+    result = retrieve_top_k_chunks(
+        session=mock_session,
+        document_ids=[uuid.uuid4()],
+        query_embedding=[0.1, 0.2, 0.3],
+        k=3,
+        mode=RetrievalMode.hybrid,
+        query_text="What is entropy?",
+    )
+
+    assert [chunk.text for chunk in result] == ["Entropy definition"]
+    assert mock_session.execute.call_count == 2
+    sql = str(mock_session.execute.call_args[0][0])
+    assert "ts_rank_cd" in sql
+    assert "search_vector @@" in sql
+    assert "FULL OUTER JOIN" in sql
+    assert "ORDER BY fused.rrf_score DESC" in sql
+
+
+def test_retrieve_top_k_chunks_hybrid_widens_ef_search() -> None:
+    """Test that the vector side of a hybrid search ranks more candidates."""
+    mock_session = make_session([])
+
+    with patch("app.core.ai.retrieval.settings") as mock_settings:
+        mock_settings.HNSW_EF_SEARCH = 10
+        mock_settings.HNSW_ITERATIVE_SCAN = "off"
+        retrieve_top_k_chunks(
+            session=mock_session,
+            document_ids=[uuid.uuid4()],
+            query_embedding=[0.1, 0.2, 0.3],
+            k=4,
+            mode=RetrievalMode.hybrid,
+            query_text="entropy",
+        )
+
+    settings_params = mock_session.execute.call_args_list[0][0][1]
+    assert settings_params["ef_search"] == str(4 * HYBRID_CANDIDATES_PER_RESULT)
+
+
+def test_retrieve_top_k_chunks_hybrid_requires_text() -> None:
+    """Test that hybrid mode without query text is rejected."""
+    with pytest.raises(ValueError):
+        retrieve_top_k_chunks(
+            session=MagicMock(),
+            document_ids=[uuid.uuid4()],
+            query_embedding=[0.1, 0.2, 0.3],
+            mode=RetrievalMode.hybrid,
+        )
+
+
+def test_retrieve_top_k_chunks_batch_hybrid() -> None:
+    """Test that batched hybrid search correlates each query's text."""
+    mock_session = make_session([])
+
+    retrieve_top_k_chunks_batch(
+        session=mock_session,
+        document_ids=[uuid.uuid4()],
+        query_embeddings=[[0.1, 0.2], [0.3, 0.4]],
+        mode=RetrievalMode.hybrid,
+        query_texts=["entropy", "osmosis"],
+    )
+
+    sql = str(mock_session.execute.call_args[0][0])
+    assert "plainto_tsquery(:plainto_tsquery_1, queries.query_text)" in sql
+    # the VALUES list is only rendered once, in the outer query
+    assert sql.count("AS queries") == 1
+
+
+def test_retrieve_top_k_chunks_batch_hybrid_requires_texts() -> None:
+    """Test that batched hybrid search needs a text per embedding."""
+    with pytest.raises(ValueError):
+        retrieve_top_k_chunks_batch(
+            session=MagicMock(),
+            document_ids=[uuid.uuid4()],
+            query_embeddings=[[0.1, 0.2], [0.3, 0.4]],
+            mode=RetrievalMode.hybrid,
+            query_texts=["entropy"],
+        )
+
+
+def test_retrieve_top_k_chunks_binary_prefilter_then_rerank() -> None:
+    """Test that binary mode reranks Hamming candidates by cosine distance."""
+    mock_session = make_session([make_row("Close", 0.1)])
+
+    result = retrieve_top_k_chunks(
+        session=mock_session,
+        document_ids=[uuid.uuid4()],
+        query_embedding=[0.1, 0.2, 0.3],
+        k=4,
+        mode=RetrievalMode.binary,
+        oversample=3,
+    )
+
+    assert [chunk.text for chunk in result] == ["Close"]
+    stmt = mock_session.execute.call_args[0][0]
+    sql = str(stmt)
+    assert "CAST(binary_quantize(documentchunk.embedding) AS BIT(1536)) <~>" in sql
+    assert ") AS candidates ORDER BY candidates.distance" in sql
+    params = stmt.compile().params
+    assert sorted(v for v in params.values() if isinstance(v, int)) == [4, 12]
+
+
+def test_retrieve_top_k_chunks_binary_default_oversample() -> None:
+    """Test that the configured oversampling sizes the candidate search."""
+    mock_session = make_session([])
+
+    with patch("app.core.ai.retrieval.settings") as mock_settings:
+        mock_settings.HNSW_EF_SEARCH = 10
+        mock_settings.HNSW_ITERATIVE_SCAN = "off"
+        mock_settings.BINARY_QUANTIZATION_OVERSAMPLE = 6
+        retrieve_top_k_chunks(
+            session=mock_session,
+            document_ids=[uuid.uuid4()],
+            query_embedding=[0.1, 0.2, 0.3],
+            k=5,
+            mode=RetrievalMode.binary,
+        )
+
+    assert mock_session.execute.call_args_list[0][0][1]["ef_search"] == "30"
+
+
+def test_apply_vector_search_settings_caps_ef_search() -> None:
+    """Test that ef_search never exceeds the pgvector maximum."""
+    mock_session = MagicMock()
+
+    apply_vector_search_settings(mock_session, k=5000)
+
+    assert mock_session.execute.call_args[0][1]["ef_search"] == "1000"
+
+
+def test_attach_embeddings_loads_missing_in_one_query() -> None:
+    """Test that only chunks without an embedding are looked up."""
+    known = RetrievedChunk(
+        id=uuid.uuid4(), document_id=uuid.uuid4(), text="a", distance=0.1
+    )
+    known.embedding = [1.0]
+    missing = RetrievedChunk(
+        id=uuid.uuid4(), document_id=uuid.uuid4(), text="b", distance=0.2
+    )
+    mock_session = make_session([SimpleNamespace(id=missing.id, embedding=[2.0])])
+
+    attach_embeddings(mock_session, [known, missing])
+
+    assert known.embedding == [1.0]
+    assert missing.embedding == [2.0]
+    mock_session.execute.assert_called_once()
+
+
+def test_load_linked_chunks_groups_by_question() -> None:
+    """Test that links come back per question, in rank order, with embeddings."""
+    first, second = uuid.uuid4(), uuid.uuid4()
+    rows = [
+        SimpleNamespace(**vars(make_row("a", 0.1)), question_id=first, embedding=[1.0]),
+        SimpleNamespace(**vars(make_row("b", 0.3)), question_id=first, embedding=[0.0]),
+        SimpleNamespace(
+            **vars(make_row("c", 0.2)), question_id=second, embedding=[0.5]
+        ),
+    ]
+    mock_session = make_session(rows)
+
+    linked = load_linked_chunks(mock_session, [first, second])
+
+    assert [c.text for c in linked[first]] == ["a", "b"]
+    assert [c.text for c in linked[second]] == ["c"]
+    assert linked[first][0].embedding == [1.0]
+    mock_session.execute.assert_called_once()
+
+
+def test_load_linked_chunks_no_questions() -> None:
+    """Test that no query is issued without question ids."""
+    mock_session = MagicMock()
+
+    assert load_linked_chunks(mock_session, []) == {}
+    mock_session.execute.assert_not_called()
+
+
+def direction(*weights: float) -> np.ndarray:
+    """Unit vector with `weights` on the first axes."""
+    vector = np.zeros(EMBEDDING_DIM, dtype=np.float32)
+    vector[: len(weights)] = weights
+    return vector / np.linalg.norm(vector)
+
+
+def add_chunks(
+    db: Session, document_id: uuid.UUID, chunks: list[tuple[str, np.ndarray]]
+) -> list[uuid.UUID]:
+    rows = [
+        DocumentChunk(
+            document_id=document_id,
+            text=text,
+            size=len(text),
+            start_offset=100 * i,
+            embedding=embedding,
+        )
+        for i, (text, embedding) in enumerate(chunks)
+    ]
+    db.add_all(rows)
+    db.commit()
+    return [row.id for row in rows]
+
+
+@pytest.mark.usefixtures("real_pgvector")
+def test_retrieve_top_k_chunks_binary_in_postgres(
+    db: Session, caplog: pytest.LogCaptureFixture
+) -> None:
+    """Test binary mode end to end, or its fallback where pgvector is too old."""
+    document = create_random_document(db)
+    ids = add_chunks(
+        db,
+        document.id,
+        [
+            ("Nearest", direction(1, 0.1)),
+            ("Near", direction(1, 0.5)),
+            ("Far", direction(0.1, 1)),
+        ],
+    )
+    search = {
+        "session": db,
+        "document_ids": [document.id],
+        "query_embedding": direction(1),
+        "k": 2,
+    }
+
+    with caplog.at_level("WARNING", logger="app.core.ai.retrieval"):
+        binary = retrieve_top_k_chunks(**search, mode=RetrievalMode.binary)
+    vector = retrieve_top_k_chunks(**search, mode=RetrievalMode.vector)
+
+    assert [chunk.id for chunk in binary] == ids[:2]
+    assert [chunk.distance for chunk in binary] == [chunk.distance for chunk in vector]
+    fell_back = "using vector mode" in caplog.text
+    assert fell_back == (pgvector_version(db) < BINARY_QUANTIZE_VERSION)
+
+
+@pytest.mark.usefixtures("real_pgvector")
+def test_retrieve_top_k_chunks_hybrid_in_postgres(db: Session) -> None:
+    """Test that hybrid mode surfaces a keyword match vector mode ranks last."""
+    document = create_random_document(db)
+    ids = add_chunks(
+        db,
+        document.id,
+        [
+            ("Cells divide by mitosis", direction(1, 0.1)),
+            ("Cells store energy", direction(1, 0.2)),
+            ("Cells have membranes", direction(1, 0.3)),
+            ("Photosynthesis makes glucose from light", direction(0.1, 1)),
+        ],
+    )
+    search = {
+        "session": db,
+        "document_ids": [document.id],
+        "query_embedding": direction(1),
+        "k": 2,
+        "query_text": "What is photosynthesis?",
+    }
+
+    vector = retrieve_top_k_chunks(**search, mode=RetrievalMode.vector)
+    hybrid = retrieve_top_k_chunks(**search, mode=RetrievalMode.hybrid)
+
+    assert [chunk.id for chunk in vector] == ids[:2]
+    # The only text match, it fuses its text rank with its (last) vector rank
+    assert [chunk.id for chunk in hybrid] == [ids[3], ids[0]]
+
+
+@pytest.mark.usefixtures("real_pgvector")
+def test_retrieve_top_k_chunks_batch_in_postgres(db: Session) -> None:
+    """Test that each query gets its own top k from the filtered documents."""
+    document = create_random_document(db)
+    other = create_random_document(db)
+    ids = add_chunks(
+        db,
+        document.id,
+        [
+            ("First axis", direction(1, 0.1)),
+            ("Mostly first axis", direction(1, 0.5)),
+            ("Second axis", direction(0.1, 1)),
+            ("Mostly second axis", direction(0.5, 1)),
+            ("Third axis", direction(0, 0.1, 1)),
+        ],
+    )
+    # Each nearer to a query than that query's second result
+    add_chunks(
+        db,
+        other.id,
+        [("Other first", direction(1)), ("Other second", direction(0, 1))],
+    )
+
+    results = retrieve_top_k_chunks_batch(
+        session=db,
+        document_ids=[document.id],
+        query_embeddings=[direction(1), direction(0, 1), direction(0, 0.3, 1)],
+        k=2,
+    )
+
+    assert [[chunk.id for chunk in result] for result in results] == [
+        [ids[0], ids[1]],
+        [ids[2], ids[3]],
+        [ids[4], ids[2]],
+    ]
+    for result in results:
+        assert result[0].distance <= result[1].distance
@@ -0,0 +1,98 @@
+import logging
+from unittest.mock import patch
+
+import pytest
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration, LLMResult
+
+from app.core.ai import tokens
+from app.core.ai.tokens import (
+    TokenUsageLogger,
+    count_tokens,
+    get_encoding,
+    prompt_budget,
+    split_by_tokens,
+    truncate_to_tokens,
+)
+
+
+class CharEncoding:
+    """Stand-in tokenizer with one token per character."""
+
+    def encode(self, text: str, **_: object) -> list[int]:
+        return [ord(char) for char in text]
+
+    def decode(self, tokens: list[int]) -> str:
+        return "".join(chr(token) for token in tokens)
+
+
+def test_count_tokens_uses_model_encoding() -> None:
+    with patch("app.core.ai.tokens.get_encoding", return_value=CharEncoding()):
+        assert count_tokens("abcdef") == 6
+
+
+@pytest.mark.usefixtures("estimated_token_counts")
+def test_count_tokens_estimates_without_encoding() -> None:
+    assert count_tokens("abcdef") == 2
+
+
+def test_get_encoding_retries_failed_loads() -> None:
+    encoding = CharEncoding()
+    with (
+        patch.dict(tokens._encodings, clear=True),
+        patch.dict(tokens._encoding_failures, clear=True),
+        patch(
+            "app.core.ai.tokens.tiktoken.get_encoding",
+            side_effect=[OSError("offline"), encoding],
+        ) as load,
+        patch("app.core.ai.tokens.time.monotonic", side_effect=[0, 1, 301]),
+    ):
+        assert get_encoding("gpt-4o-mini") is None
+        # Not retried within ENCODING_RETRY_SECONDS, then loaded and kept
+        assert get_encoding("gpt-4o-mini") is None
+        assert get_encoding("gpt-4o-mini") is encoding
+        assert get_encoding("gpt-4o-mini") is encoding
+
+    assert load.call_count == 2
+
+
+def test_split_by_tokens_cuts_exact_pieces() -> None:
+    with patch("app.core.ai.tokens.get_encoding", return_value=CharEncoding()):
+        assert split_by_tokens("abcdefg", 3) == [("abc", 3), ("def", 3), ("g", 1)]
+        assert truncate_to_tokens("abcdefg", 4) == "abcd"
+
+
+def test_prompt_budget_fits_context_window() -> None:
+    assert prompt_budget(4_000, reserved=1_000, model="gpt-4o-mini") == 4_000
+    assert prompt_budget(4_000, reserved=1_000, model="gpt-3.5-turbo") == 4_000
+    assert prompt_budget(20_000, reserved=1_000, model="gpt-3.5-turbo") == 15_385
+    assert prompt_budget(20_000, reserved=1_000, model="unknown-model") == 7_192
+
+
+def test_token_usage_logger_logs_and_totals_each_call(
+    caplog: pytest.LogCaptureFixture,
+) -> None:
+    message = AIMessage(
+        content="",
+        usage_metadata={
+            "input_tokens": 1812,
+            "output_tokens": 97,
+            "total_tokens": 1909,
+            "input_token_details": {"cache_read": 1536},
+        },
+    )
+    result = LLMResult(generations=[[ChatGeneration(message=message)]])
+    token_usage = TokenUsageLogger()
+
+    with caplog.at_level(logging.INFO, logger="app.core.ai.tokens"):
+        token_usage.on_llm_end(result)
+        token_usage.on_llm_end(result)
+
+    assert "1812 prompt (1536 cached) and 97 completion tokens" in caplog.text
+    stats = token_usage.stats()
+    assert (stats.calls, stats.prompt_tokens, stats.cached_prompt_tokens) == (
+        2,
+        3624,
+        3072,
+    )
+    assert stats.completion_tokens == 194
@@ -0,0 +1,175 @@
+import uuid
+from collections.abc import Generator
+from unittest.mock import MagicMock, patch
+
+import numpy as np
+import pytest
+from sqlmodel import Session, delete
+
+from app.core.ai import vector_cache
+from app.core.ai.vector_cache import (
+    ChunkMatrix,
+    get_exam_chunk_matrix,
+    invalidate_document,
+    invalidate_exam,
+)
+from app.core.vectors import EMBEDDING_DIM
+from app.models import Document, DocumentChunk
+from tests.utils.document import create_random_document
+
+
+@pytest.fixture(autouse=True)
+def empty_cache() -> Generator[None, None, None]:
+    vector_cache._exam_matrices.clear()
+    yield
+    vector_cache._exam_matrices.clear()
+
+
+def make_matrix(document_id: uuid.UUID | None = None) -> ChunkMatrix:
+    document_id = document_id or uuid.uuid4()
+    embeddings = np.array(
+        [[1.0, 0.0, 0.0], [0.0, 1.0, 0.0], [0.7, 0.7, 0.0]], dtype=np.float32
+    )
+    return ChunkMatrix(
+        source_document_ids=[document_id],
+        chunk_ids=[uuid.uuid4() for _ in range(3)],
+        document_ids=[document_id] * 3,
+        texts=["x axis", "y axis", "diagonal"],
+        start_offsets=[0, 10, 20],
+        token_counts=[2, 2, 1],
+        embeddings=embeddings,
+    )
+
+
+def test_chunk_matrix_rows_are_normalized_float32() -> None:
+    matrix = make_matrix()
+
+    assert matrix.matrix.dtype == np.float32
+    assert matrix.matrix.flags["C_CONTIGUOUS"]
+    np.testing.assert_allclose(np.linalg.norm(matrix.matrix, axis=1), 1.0, rtol=1e-6)
+
+
+def test_chunk_matrix_top_k_orders_by_similarity() -> None:
+    matrix = make_matrix()
+
+    result = matrix.top_k([1.0, 0.1, 0.0], k=2)
+
+    assert [chunk.text for chunk in result] == ["x axis", "diagonal"]
+    assert result[0].distance < result[1].distance
+    assert result[0].start_offset == 0
+    assert result[0].embedding is not None
+
+
+def test_chunk_matrix_top_k_batch_per_query() -> None:
+    matrix = make_matrix()
+
+    result = matrix.top_k_batch([[1.0, 0.0, 0.0], [0.0, 2.0, 0.0]], k=1)
+
+    assert [[chunk.text for chunk in chunks] for chunks in result] == [
+        ["x axis"],
+        ["y axis"],
+    ]
+    assert result[1][0].similarity == pytest.approx(1.0)
+
+
+def test_chunk_matrix_top_k_larger_than_matrix() -> None:
+    matrix = make_matrix()
+
+    assert len(matrix.top_k([0.0, 0.0, 1.0], k=10)) == 3
+
+
+def test_get_exam_chunk_matrix_loads_once() -> None:
+    exam_id = uuid.uuid4()
+    document_ids = [uuid.uuid4()]
+    session = MagicMock()
+
+    with (
+        patch("app.core.ai.vector_cache.estimate_matrix_bytes", return_value=1024),
+        patch(
+            "app.core.ai.vector_cache.load_chunk_matrix", return_value=make_matrix()
+        ) as mock_load,
+    ):
+        first = get_exam_chunk_matrix(
+            session, exam_id=exam_id, document_ids=document_ids
+        )
+        second = get_exam_chunk_matrix(
+            session, exam_id=exam_id, document_ids=document_ids
+        )
+
+    assert first is second
+    mock_load.assert_called_once()
+
+
+def test_get_exam_chunk_matrix_over_budget() -> None:
+    with (
+        patch(
+            "app.core.ai.vector_cache.estimate_matrix_bytes",
+            return_value=vector_cache.settings.VECTOR_CACHE_MAX_BYTES + 1,
+        ),
+        patch("app.core.ai.vector_cache.load_chunk_matrix") as mock_load,
+    ):
+        result = get_exam_chunk_matrix(
+            MagicMock(), exam_id=uuid.uuid4(), document_ids=[uuid.uuid4()]
+        )
+
+    assert result is None
+    mock_load.assert_not_called()
+
+
+def test_get_exam_chunk_matrix_reloads_changed_documents(db: Session) -> None:
+    """Test that a change made elsewhere (another worker) is picked up."""
+    document = create_random_document(db)
+    exam_id = uuid.uuid4()
+    embedding = np.zeros(EMBEDDING_DIM, dtype=np.float32)
+    embedding[0] = 1.0
+    db.add(
+        DocumentChunk(document_id=document.id, text="Old", size=3, embedding=embedding)
+    )
+    db.commit()
+
+    first = get_exam_chunk_matrix(db, exam_id=exam_id, document_ids=[document.id])
+    assert first is get_exam_chunk_matrix(
+        db, exam_id=exam_id, document_ids=[document.id]
+    )
+
+    # Re-extracted by another worker: this worker's cache is not invalidated
+    with Session(db.get_bind()) as other:
+        other.execute(
+            delete(DocumentChunk).where(DocumentChunk.document_id == document.id)
+        )
+        other.add(
+            DocumentChunk(
+                document_id=document.id, text="New", size=3, embedding=embedding
+            )
+        )
+        changed = other.get(Document, document.id)
+        assert changed
+        changed.chunk_count = 1
+        other.add(changed)
+        other.commit()
+
+    second = get_exam_chunk_matrix(db, exam_id=exam_id, document_ids=[document.id])
+
+    assert first is not None and first.texts == ["Old"]
+    assert second is not None and second.texts == ["New"]
+
+
+def test_invalidate_document_drops_matching_exams() -> None:
+    document_id = uuid.uuid4()
+    stale_exam, other_exam = uuid.uuid4(), uuid.uuid4()
+    vector_cache._exam_matrices.set(stale_exam, make_matrix(document_id))
+    vector_cache._exam_matrices.set(other_exam, make_matrix())
+
+    invalidate_document(str(document_id))
+
+    assert stale_exam not in vector_cache._exam_matrices
+    assert other_exam in vector_cache._exam_matrices
+
+
+def test_invalidate_exam() -> None:
+    exam_id = uuid.uuid4()
+    vector_cache._exam_matrices.set(exam_id, make_matrix())
+
+    invalidate_exam(exam_id)
+
+    assert exam_id not in vector_cache._exam_matrices
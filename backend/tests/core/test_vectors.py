@@ -0,0 +1,85 @@
+import numpy as np
+import pytest
+from sqlmodel import Session, select
+
+from app.core.ai.vector_cache import load_chunk_matrix
+from app.core.vectors import EMBEDDING_DIM, Float32Vector, fetch_binary
+from app.models import DocumentChunk
+from tests.utils.document import create_random_document
+
+
+def random_embedding(seed: int) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    return rng.standard_normal(EMBEDDING_DIM, dtype=np.float32)
+
+
+def test_embedding_round_trip_is_float32(db: Session) -> None:
+    document = create_random_document(db)
+    embedding = random_embedding(0)
+    chunk = DocumentChunk(
+        document_id=document.id, text="chunk", size=5, embedding=embedding
+    )
+    db.add(chunk)
+    db.commit()
+    db.expire_all()
+
+    stored = db.exec(
+        select(DocumentChunk.embedding).where(DocumentChunk.id == chunk.id)
+    ).one()
+
+    assert isinstance(stored, np.ndarray)
+    assert stored.dtype == np.float32
+    np.testing.assert_array_equal(stored, embedding)
+
+
+def test_fetch_binary_returns_arrays(db: Session) -> None:
+    document = create_random_document(db)
+    embedding = random_embedding(1)
+    db.add(
+        DocumentChunk(
+            document_id=document.id, text="chunk", size=5, embedding=embedding
+        )
+    )
+    db.commit()
+
+    rows = fetch_binary(
+        db,
+        "SELECT document_id, embedding FROM documentchunk WHERE document_id = %s",
+        [document.id],
+    )
+
+    assert rows[0].document_id == document.id
+    np.testing.assert_array_equal(rows[0].embedding, embedding)
+
+
+def test_load_chunk_matrix_reads_binary_embeddings(db: Session) -> None:
+    document = create_random_document(db)
+    embeddings = [random_embedding(i) for i in range(3)]
+    db.add_all(
+        [
+            DocumentChunk(
+                document_id=document.id,
+                text=f"chunk {i}",
+                size=7,
+                start_offset=i * 10,
+                embedding=embedding,
+            )
+            for i, embedding in enumerate(embeddings)
+        ]
+    )
+    db.commit()
+
+    matrix = load_chunk_matrix(db, [document.id])
+
+    assert matrix.matrix.shape == (3, EMBEDDING_DIM)
+    assert matrix.matrix.dtype == np.float32
+    assert sorted(matrix.texts) == ["chunk 0", "chunk 1", "chunk 2"]
+
+
+def test_float32_vector_rejects_wrong_dimension() -> None:
+    process = Float32Vector(3).bind_processor(None)
+
+    assert process([1, 2, 3]).dtype == np.float32
+    assert process(None) is None
+    with pytest.raises(ValueError):
+        process([1.0, 2.0])
@@ -1,3 +1,6 @@
+import uuid
+
+import pytest
 from sqlmodel import Session
 
 from app import crud
@@ -29,3 +32,19 @@ def test_create_document(db: Session) -> None:
 
     assert doc.id is not None
     assert doc.owner_id == user.id
+
+
+def test_search_cursor_round_trip() -> None:
+    chunk_id = uuid.uuid4()
+    cursor = crud.encode_search_cursor(0.25, chunk_id)
+    assert crud.decode_search_cursor(cursor) == (0.25, chunk_id)
+    with pytest.raises(ValueError):
+        crud.decode_search_cursor("bm90IGpzb24=")
+
+
+def test_split_highlights() -> None:
+    start, stop = crud.HIGHLIGHT_START, crud.HIGHLIGHT_STOP
+    headline = f"a {start}b{stop} c {start}dd{stop}"
+    snippet, highlights = crud.split_highlights(headline)
+    assert snippet == "a b c dd"
+    assert [snippet[start:end] for start, end in highlights] == ["b", "dd"]
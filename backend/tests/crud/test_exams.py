@@ -1,7 +1,17 @@
+import uuid
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
 from sqlmodel import Session
 
 from app import crud
-from app.models import ExamCreate, QuestionCreate, QuestionType, UserCreate
+from app.models import (
+    ExamCreate,
+    ExplanationOutput,
+    QuestionCreate,
+    QuestionType,
+    UserCreate,
+)
 from tests.utils.utils import random_email, random_lower_string
 
 
@@ -72,3 +82,43 @@ def test_create_exam_with_questions(db: Session) -> None:
 
     assert len(exam_public.questions) == 1
     assert exam_public.questions[0].question == "Q1"
+
+
+@pytest.mark.asyncio
+async def test_generate_explanations_for_incorrect_answers_batches() -> None:
+    def make_answer(response: str, is_correct: bool) -> MagicMock:
+        answer = MagicMock()
+        answer.response = response
+        answer.is_correct = is_correct
+        answer.question.id = uuid.uuid4()
+        answer.question.question = "What is 2+2?"
+        answer.question.correct_answer = "4"
+        return answer
+
+    wrong_1 = make_answer("3", False)
+    right = make_answer("4", True)
+    wrong_2 = make_answer("5", False)
+    explanation = ExplanationOutput(
+        explanation="Because", key_takeaway="Remember", suggested_review="Read"
+    )
+    session = MagicMock()
+
+    with patch(
+        "app.crud.generate_answer_explanations",
+        new_callable=AsyncMock,
+        return_value=[explanation, explanation],
+    ) as mock_generate:
+        await crud.generate_explanations_for_incorrect_answers(
+            session=session, exam=MagicMock(), answers=[wrong_1, right, wrong_2]
+        )
+
+    mock_generate.assert_called_once()
+    requests = mock_generate.call_args[1]["requests"]
+    assert [r.user_answer for r in requests] == ["3", "5"]
+    assert [r.question_id for r in requests] == [
+        wrong_1.question.id,
+        wrong_2.question.id,
+    ]
+    assert wrong_1.explanation.explanation == "Because"
+    assert wrong_2.explanation.key_takeaway == "Remember"
+    assert session.add.call_count == 2